@@ -1,23 +1,92 @@
 """
 // AICODE-NOTE: Базовые протоколы Event и AgentBase (минимум для запуска).
 // AICODE-NOTE: Добавлен абстрактный базовый класс AgentABC для единообразного контракта.
+// AICODE-NOTE: Event — лёгкий slotted dataclass (не pydantic): на ответ приходятся сотни событий `token`.
+Совместим с прежним контрактом (`model_dump`, `model_dump_json`, `model_validate(_json)`); кодирование в JSON —
+orjson (если установлен), SSE‑кадр `sse()` считается один раз и переиспользуется (single‑flight раздаёт один
+поток нескольким клиентам). Pydantic — только на границах API (модели запросов/ответов маршрутов).
 """
 
 from __future__ import annotations
 
-from typing import AsyncIterator, Protocol, Any, Dict, TYPE_CHECKING
+import json
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Protocol, Any, Dict, Optional, TYPE_CHECKING
 from abc import ABC, abstractmethod
-from pydantic import BaseModel
+
+try:
+    import orjson  # type: ignore
+except Exception:  # pragma: no cover - опциональная зависимость
+    orjson = None  # type: ignore
+
+from .context import current_run
+from .memory.base import with_idempotency_keys
+from .metrics import phase
 
 if TYPE_CHECKING:  # pragma: no cover - для аннотаций
     from .memory.base import BaseMemory
 
 
-class Event(BaseModel):
+# AICODE-NOTE: Событие с дельтой текста при стриминге ответа LLM (payload={"delta": "..."}).
+TOKEN_EVENT = "token"
+_STEP_TOKEN_SUFFIX = "/" + TOKEN_EVENT
+
+
+def is_token_event(name: str) -> bool:
+    """`token` агента или проброшенный workflow‑агентом `{step_id}/token` — только для стрима, не для трейса."""
+    return name == TOKEN_EVENT or name.endswith(_STEP_TOKEN_SUFFIX)
+
+
+def dumps_json(value: Any) -> bytes:
+    """Компактный UTF‑8 JSON: orjson, иначе stdlib; неизвестные типы — через str()."""
+    if orjson is not None:
+        return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, default=str, separators=(",", ":")).encode()
+
+
+def loads_json(raw: str | bytes) -> Any:
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+@dataclass(slots=True)
+class Event:
     event: str
     session_id: str
     trace_id: str
-    payload: Dict[str, Any] | None = None
+    payload: Optional[Dict[str, Any]] = None
+    # Готовый SSE‑кадр; событие после отдачи не меняют (раннер создаёт новое), поэтому кэш безопасен
+    _sse: Optional[bytes] = field(default=None, repr=False, compare=False)
+
+    def model_dump(self, **_: Any) -> Dict[str, Any]:
+        return {"event": self.event, "session_id": self.session_id, "trace_id": self.trace_id, "payload": self.payload}
+
+    def model_dump_json(self, **_: Any) -> str:
+        return self.to_json().decode()
+
+    def to_json(self) -> bytes:
+        return dumps_json(self.model_dump())
+
+    def sse(self) -> bytes:
+        """Кадр text/event-stream: `event: <имя>` + `data: <json>` (payload — `{}` вместо null)."""
+        frame = self._sse
+        if frame is None:
+            data = dumps_json({"event": self.event, "session_id": self.session_id, "trace_id": self.trace_id, "payload": self.payload or {}})
+            frame = self._sse = b"event: " + self.event.encode() + b"\ndata: " + data + b"\n\n"
+        return frame
+
+    @classmethod
+    def model_validate(cls, data: Dict[str, Any]) -> "Event":
+        if isinstance(data, cls):
+            return data
+        payload = data.get("payload")
+        if payload is not None and not isinstance(payload, dict):
+            raise ValueError("Event.payload must be a dict or null")
+        return cls(event=str(data["event"]), session_id=str(data.get("session_id") or ""), trace_id=str(data.get("trace_id") or ""), payload=payload)
+
+    @classmethod
+    def model_validate_json(cls, raw: str | bytes) -> "Event":
+        return cls.model_validate(loads_json(raw))
 
 
 class AgentBase(Protocol):
@@ -37,7 +106,8 @@ class AgentABC(ABC):
     Обеспечивает:
     - единый запуск `run()` поверх `run_with_events()`;
     - авто-событие `start_agent` и гарантию финального `final_result` (если не сгенерирован);
-    - хелпер `emit()` для создания событий.
+    - хелперы `emit()`/`emit_token()` для создания событий (`token` — дельты текста LLM, идут до `final_result`);
+    - `remember()` — запись сообщений шага в память (вкладка из `role_policy`, ключи идемпотентности хода).
     """
 
     # AICODE-NOTE: Класс предназначен для наследования паттернами и конкретными агентами.
@@ -53,22 +123,43 @@ class AgentABC(ABC):
         # прокидывается через этот атрибут. Наследники могут полагаться на `self.llm`.
         self.llm = llm
 
+    async def remember(self, session_id: str, messages: list[dict]) -> None:
+        """Сохранить сообщения шага в историю: в ветку вкладки из `role_policy`, не чаще одного раза на ход.
+
+        Единственный путь записи ответов агента в историю; запуск с `persist=False` ничего не пишет.
+        Ключи идемпотентности — от имени этого агента (`self.id`), не агента запуска: шаги workflow не конфликтуют.
+        """
+        ctx = current_run()
+        if ctx is not None and not ctx.persist:
+            return
+        with phase("memory_append"):
+            await self.memory.append(session_id, with_idempotency_keys(messages, self.id), role_policy=self.role_policy)
+
     def emit(self, event: str, session_id: str, *, payload: Dict[str, Any] | None = None, trace_id: str = "") -> Event:
         return Event(event=event, session_id=session_id, trace_id=trace_id, payload=payload)
 
+    def emit_token(self, session_id: str, delta: str, *, trace_id: str = "") -> Event:
+        return Event(event=TOKEN_EVENT, session_id=session_id, trace_id=trace_id, payload={"delta": delta})
+
     async def run(self, **kwargs) -> dict:
-        async for _ in self.run_with_events(**kwargs):
-            pass
-        return {"ok": True}
+        """Выполнить агента без стрима и вернуть payload его `final_result`."""
+        result: dict = {}
+        async for ev in self.run_with_events(**kwargs):
+            if ev.event == "final_result":
+                result = ev.payload or {}
+        return result
 
     async def run_with_events(self, *, session_id: str, **ctx) -> AsyncIterator[Event]:
         # Стартовое событие — единообразно для всех наследников
         yield self.emit("start_agent", session_id, payload={"agent": self.id, "version": self.version})
         final_emitted = False
-        async for ev in self._run(session_id=session_id, **ctx):
-            if ev.event == "final_result":
-                final_emitted = True
-            yield ev
+        # aclosing: при прерывании стрима потребителем `_run` закрывается сразу (его finally/отмена задач),
+        # а не при сборке мусора
+        async with aclosing(self._run(session_id=session_id, **ctx)) as events:
+            async for ev in events:
+                if ev.event == "final_result":
+                    final_emitted = True
+                yield ev
         if not final_emitted:
             # Гарантируем финальное событие (минимальное)
             yield self.emit("final_result", session_id, payload={"ok": True})
@@ -82,6 +173,6 @@ class AgentABC(ABC):
         raise NotImplementedError
 
 
-__all__ = ["Event", "AgentBase", "AgentABC"]
+__all__ = ["TOKEN_EVENT", "is_token_event", "Event", "AgentBase", "AgentABC", "dumps_json", "loads_json"]
 
 
@@ -1,28 +1,198 @@
 """
-// AICODE-NOTE: Минимальный CallbackManager с каналами before/after.
+// AICODE-NOTE: CallbackManager — хуки инструментирования агентов вне пути запуска.
+
+- Моменты (`moment`, `kind`): `before`/`after` (`agent`), `event` (`agent`, каждое событие запуска, включая `token`),
+  `llm_start`/`llm_end` (`llm`, в `llm_end` — `ms`, `usage`, `error`), `memory_load` (`memory`, `ms`, `messages`).
+- `fire()` не вызывает обработчики: без подписчиков — сразу return, иначе вызов кладётся в очередь обработчика
+  (не больше `max_queue` на обработчик, переполнение — `dropped`) и выполняется фоновыми задачами event loop'а.
+  Запуск агента не ждёт хуков.
+- У каждого обработчика свои очередь и воркеры (до `concurrency` одновременных вызовов): медленный обработчик
+  копит и теряет только свои вызовы, остальные выполняются без задержки. Вызовы одного обработчика при
+  `concurrency` > 1 могут завершаться не по порядку.
+- Обработчики — функции или корутины. Корутина ограничена `timeout` (по умолчанию `AGENTS_CALLBACK_TIMEOUT_MS`),
+  синхронная функция выполняется в loop'е (должна быть быстрой) или в потоке (`register(..., blocking=True)`).
+  Ошибки и таймауты обработчиков логируются и считаются в `stats()`, но не доходят до агента.
+- Аргументы передаются по ссылке и читаются позже: изменяемые объекты (trace, payload) обработчик видит
+  в состоянии на момент своего выполнения.
+- Вне event loop (синхронный код) синхронные обработчики вызываются сразу, корутины — отбрасываются.
 """
 
 from __future__ import annotations
 
-from typing import Callable, Dict, DefaultDict
-from collections import defaultdict
+import asyncio
+import inspect
+import logging
+import os
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, DefaultDict, Deque, Dict, Optional, Tuple
+
+
+logger = logging.getLogger("agents.callbacks")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+@dataclass
+class _Handler:
+    func: Callable[..., Any]
+    is_async: bool
+    timeout: Optional[float]
+    blocking: bool = False
+    # Отложенные вызовы и воркеры этого обработчика (воркеры привязаны к loop'у, в котором созданы)
+    queue: Deque[Tuple[str, Dict[str, Any]]] = field(default_factory=deque)
+    workers: set = field(default_factory=set)
+    loop: Optional[asyncio.AbstractEventLoop] = None
 
 
 class CallbackManager:
-    def __init__(self) -> None:
-        self._handlers: DefaultDict[str, Dict[str, list[Callable[..., None]]]] = defaultdict(lambda: defaultdict(list))
+    """Регистрация хуков и неблокирующая отправка.
 
-    def register(self, moment: str, kind: str, handler: Callable[..., None]) -> None:
-        self._handlers[moment][kind].append(handler)
+    - `max_queue` (env `AGENTS_CALLBACK_QUEUE`, 10000) — предел очереди вызовов одного обработчика;
+    - `timeout` (env `AGENTS_CALLBACK_TIMEOUT_MS`, 1000 мс) — время на один вызов обработчика по умолчанию;
+    - `concurrency` (env `AGENTS_CALLBACK_CONCURRENCY`, 4) — одновременных вызовов одного обработчика.
+    """
 
-    def fire(self, moment: str, kind: str, **kwargs) -> None:
-        for h in self._handlers[moment][kind]:
-            h(**kwargs)
+    def __init__(
+        self, *, max_queue: Optional[int] = None, timeout: Optional[float] = None, concurrency: Optional[int] = None
+    ) -> None:
+        self.max_queue = max_queue if max_queue is not None else _env_int("AGENTS_CALLBACK_QUEUE", 10_000)
+        self.timeout = timeout if timeout is not None else _env_int("AGENTS_CALLBACK_TIMEOUT_MS", 1000) / 1000
+        self.concurrency = max(concurrency if concurrency is not None else _env_int("AGENTS_CALLBACK_CONCURRENCY", 4), 1)
+        self._handlers: DefaultDict[str, Dict[str, list[_Handler]]] = defaultdict(lambda: defaultdict(list))
+        self._stats: Dict[str, int] = {"fired": 0, "dispatched": 0, "dropped": 0, "errors": 0, "timeouts": 0}
 
+    def register(
+        self,
+        moment: str,
+        kind: str,
+        handler: Callable[..., Any],
+        *,
+        timeout: Optional[float] = None,
+        blocking: bool = False,
+    ) -> None:
+        """Подписать обработчик; `timeout` — сек на вызов (None — общий), `blocking` — синхронный в потоке."""
+        self._handlers[moment][kind].append(
+            _Handler(func=handler, is_async=inspect.iscoroutinefunction(handler), timeout=timeout, blocking=blocking)
+        )
 
-callbacks = CallbackManager()
+    def unregister(self, moment: str, kind: str, handler: Callable[..., Any]) -> None:
+        handlers = self._handlers.get(moment, {}).get(kind)
+        if handlers:
+            handlers[:] = [h for h in handlers if h.func is not handler]
 
+    def has(self, moment: str, kind: str) -> bool:
+        by_kind = self._handlers.get(moment)
+        return bool(by_kind and by_kind.get(kind))
 
-__all__ = ["callbacks", "CallbackManager"]
+    def fire(self, moment: str, kind: str, **kwargs: Any) -> None:
+        # Горячий путь: без подписчиков — два поиска в dict, без аллокаций
+        by_kind = self._handlers.get(moment)
+        handlers = by_kind.get(kind) if by_kind else None
+        if not handlers:
+            return
+        self._stats["fired"] += 1
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._call_inline(handlers, moment, kwargs)
+            return
+        for handler in handlers:
+            if len(handler.queue) >= self.max_queue:
+                self._stats["dropped"] += 1
+                continue
+            handler.queue.append((moment, kwargs))
+            self._ensure_worker(handler, loop)
+
+    # ------------------------------------------------------------------
+    # Выполнение
+    # ------------------------------------------------------------------
+
+    def _call_inline(self, handlers: list[_Handler], moment: str, kwargs: Dict[str, Any]) -> None:
+        for handler in handlers:
+            if handler.is_async:
+                self._stats["dropped"] += 1
+                continue
+            try:
+                handler.func(**kwargs)
+                self._stats["dispatched"] += 1
+            except Exception:
+                self._stats["errors"] += 1
+                logger.warning("callback %s failed", moment, exc_info=True)
 
+    def _ensure_worker(self, handler: _Handler, loop: asyncio.AbstractEventLoop) -> None:
+        # Воркеры привязаны к loop'у: новый loop (другой поток, тесты) — новые воркеры, очередь общая
+        if handler.loop is not loop:
+            handler.loop = loop
+            handler.workers = set()
+        # Быстрой синхронной функции хватает одного воркера; новый — только если очередь длиннее числа воркеров
+        limit = self.concurrency if handler.is_async or handler.blocking else 1
+        if len(handler.workers) >= limit or len(handler.workers) >= len(handler.queue):
+            return
+        task = loop.create_task(self._work(handler, handler.workers), name="callbacks-worker")
+        handler.workers.add(task)
+        # Страховка для задачи, отменённой до старта (её finally не выполнится)
+        task.add_done_callback(handler.workers.discard)
 
+    async def _work(self, handler: _Handler, workers: set) -> None:
+        try:
+            while handler.queue:
+                moment, kwargs = handler.queue.popleft()
+                await self._call(handler, moment, kwargs)
+        finally:
+            # Снимаемся с учёта сразу после пустой очереди, без await: done-callback выполнится позже, и fire()
+            # в этом промежутке счёл бы воркер живым и не запустил новый — вызов застрял бы в очереди
+            workers.discard(asyncio.current_task())  # type: ignore[arg-type]
+
+    async def _call(self, handler: _Handler, moment: str, kwargs: Dict[str, Any]) -> None:
+        timeout = handler.timeout if handler.timeout is not None else self.timeout
+        try:
+            if handler.is_async:
+                await asyncio.wait_for(handler.func(**kwargs), timeout=timeout)
+            elif handler.blocking:
+                # Поток не прерывается по таймауту — перестаём только ждать его
+                await asyncio.wait_for(asyncio.to_thread(handler.func, **kwargs), timeout=timeout)
+            else:
+                handler.func(**kwargs)
+            self._stats["dispatched"] += 1
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            logger.warning("callback %s timed out after %.3fs", moment, timeout)
+        except Exception:
+            self._stats["errors"] += 1
+            logger.warning("callback %s failed", moment, exc_info=True)
+
+    def _all_handlers(self) -> list[_Handler]:
+        return [h for by_kind in self._handlers.values() for handlers in by_kind.values() for h in handlers]
+
+    async def drain(self) -> None:
+        """Дождаться выполнения всех поставленных вызовов (шатдаун, тесты)."""
+        loop = asyncio.get_running_loop()
+        for handler in self._all_handlers():
+            while handler.queue:
+                moment, kwargs = handler.queue.popleft()
+                await self._call(handler, moment, kwargs)
+            workers = [w for w in handler.workers if handler.loop is loop]
+            if workers:
+                await asyncio.gather(*workers, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        handlers = self._all_handlers()
+        return {
+            **self._stats,
+            "queue_depth": sum(len(h.queue) for h in handlers),
+            "inflight": sum(len(h.workers) for h in handlers),
+            "max_queue": self.max_queue,
+            "concurrency": self.concurrency,
+        }
+
+
+callbacks = CallbackManager()
+
+
+__all__ = ["callbacks", "CallbackManager"]
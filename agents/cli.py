@@ -36,7 +36,7 @@ from . import autodiscover
 from .registry import autodiscover_prompts
 from .registry import get_agent
 from .runner import run_agent_with_events
-from .memory import BackendMemory, InMemoryMemory
+from .memory import BackendMemory, InMemoryMemory, PostgresMemory
 from .llm import OpenAILLM
 
 
@@ -51,7 +51,7 @@ def _parser() -> ArgumentParser:
     runp.add_argument("version")
     runp.add_argument("--session", required=True)
     runp.add_argument("--query", default="", help="Свободный текст (старый контракт user_message)")
-    runp.add_argument("--memory", choices=["backend", "inmem"], default="backend", help="Источник памяти: backend или in-memory")
+    runp.add_argument("--memory", choices=["backend", "inmem", "postgres"], default="backend", help="Источник памяти: backend, in-memory или postgres (напрямую в БД)")
 
     # Специальный режим для learning_planner (готовые параметры формы)
     runlp = sub.add_parser("run_learning_planner", help="Запустить learning_planner с параметрами формы")
@@ -61,7 +61,7 @@ def _parser() -> ArgumentParser:
     runlp.add_argument("--goal", required=False, default="Написать первую нейросеть")
     runlp.add_argument("--focus", choices=["theory", "practice"], default="theory")
     runlp.add_argument("--tone", choices=["strict", "friendly", "motivational", "neutral"], default="friendly")
-    runlp.add_argument("--memory", choices=["backend", "inmem"], default="inmem")
+    runlp.add_argument("--memory", choices=["backend", "inmem", "postgres"], default="inmem")
 
     # Специальный режим для synopsis_manager (создание/обновление конспекта)
     runsyn = sub.add_parser("run_synopsis_manager", help="Запустить synopsis_manager для создания/обновления конспекта")
@@ -74,11 +74,19 @@ def _parser() -> ArgumentParser:
     runsyn.add_argument("--tone", choices=["strict", "friendly", "motivational", "neutral"], default="friendly")
     runsyn.add_argument("--plan", action="append", default=[], help="Пункт плана; можно передать несколько флагов --plan")
     runsyn.add_argument("--instructions", required=False, default=None, help="Свободные правки/уточнения для обновления")
-    runsyn.add_argument("--memory", choices=["backend", "inmem"], default="inmem")
+    runsyn.add_argument("--memory", choices=["backend", "inmem", "postgres"], default="inmem")
 
     return p
 
 
+def _build_memory(kind: str):
+    if kind == "backend":
+        return BackendMemory()
+    if kind == "postgres":
+        return PostgresMemory()
+    return InMemoryMemory()
+
+
 async def _cmd_list(args):  # pragma: no cover - простой вывод
     autodiscover_prompts()
     autodiscover()
@@ -88,7 +96,7 @@ async def _cmd_list(args):  # pragma: no cover - простой вывод
 async def _cmd_run(args):
     autodiscover_prompts()
     autodiscover()
-    memory = BackendMemory() if args.memory == "backend" else InMemoryMemory()
+    memory = _build_memory(args.memory)
     # AICODE-NOTE: Инициализируем LLM и передаём в фабрику агента. Клиент создаётся внутри реализации.
     llm = OpenAILLM()
     agent = get_agent(args.id, args.version, memory=memory, llm=llm)
@@ -100,7 +108,7 @@ async def _cmd_run_learning_planner(args):
     autodiscover_prompts()
     autodiscover()
 
-    memory = BackendMemory() if args.memory == "backend" else InMemoryMemory()
+    memory = _build_memory(args.memory)
 
     query: Dict[str, Any] = {
         "title": args.title,
@@ -121,7 +129,7 @@ async def _cmd_run_synopsis_manager(args):
     autodiscover_prompts()
     autodiscover()
 
-    memory = BackendMemory() if args.memory == "backend" else InMemoryMemory()
+    memory = _build_memory(args.memory)
 
     query: Dict[str, Any] = {
         "action": args.action,
@@ -0,0 +1,170 @@
+"""
+// AICODE-NOTE: Процессный контейнер агентов: общие LLM‑клиенты, бэкенды памяти и stateless‑инстансы агентов.
+// AICODE-NOTE: Создаётся один раз (FastAPI lifespan / воркер) вместо сборки OpenAILLM/памяти/агента на каждый запрос.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from .registry import get_agent
+from .llm import OpenAILLM, aclose_shared_clients
+from .llm.cache import CachedLLM
+from .llm.embeddings import get_embedder
+from .llm.semantic_cache import SemanticCachedLLM
+from .memory import BackendMemory, InMemoryMemory, PostgresMemory
+from .memory.redis_short_term import aclose_shared_pools
+from .roles.tokens import disable_encodings, preload_encodings
+
+
+MemoryFactory = Callable[[], Any]
+LLMFactory = Callable[[], Any]
+
+
+def _freeze(value: Optional[dict]) -> str:
+    # AICODE-NOTE: role_policy/meta — обычные dict; ключ кэша строим из канонического JSON
+    return json.dumps(value or {}, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class AgentContainer:
+    """Владеет общими зависимостями агентов на время жизни процесса.
+
+    - `llm(name)` — общий LLM‑клиент (по умолчанию `OpenAILLM` на общем пуле соединений);
+    - `memory(kind)` — общий бэкенд памяти по виду (`backend|inmem|postgres|...`);
+    - `agent(id, version, memory=..., role_policy=...)` — инстанс агента, кэшируется по
+      `(id, version, memory, role_policy, meta)`. Агенты не хранят состояние запуска, поэтому безопасно
+      переиспользуются конкурентными запросами.
+    - `cached_agents` — id агентов, чьи LLM‑вызовы идут через общий `CachedLLM` (env `AGENTS_LLM_CACHE`,
+      через запятую).
+    - `semantic_agents` — id агентов с семантическим кэшем ответов `SemanticCachedLLM`
+      (env `AGENTS_SEMANTIC_CACHE`, через запятую).
+    """
+
+    def __init__(
+        self,
+        *,
+        llm_factory: LLMFactory | None = None,
+        memory_factories: Dict[str, MemoryFactory] | None = None,
+        cached_agents: Iterable[str] | None = None,
+        semantic_agents: Iterable[str] | None = None,
+    ) -> None:
+        self._llm_factory: LLMFactory = llm_factory or OpenAILLM
+        self._memory_factories: Dict[str, MemoryFactory] = dict(
+            memory_factories or {"backend": BackendMemory, "inmem": InMemoryMemory, "postgres": PostgresMemory}
+        )
+        if cached_agents is None:
+            cached_agents = [a.strip() for a in os.getenv("AGENTS_LLM_CACHE", "").split(",") if a.strip()]
+        self._cached_agents = set(cached_agents)
+        if semantic_agents is None:
+            semantic_agents = [a.strip() for a in os.getenv("AGENTS_SEMANTIC_CACHE", "").split(",") if a.strip()]
+        self._semantic_agents = set(semantic_agents)
+        self._llms: Dict[str, Any] = {}
+        self._memories: Dict[str, Any] = {}
+        self._agents: Dict[Tuple[str, str, str, str, str], Any] = {}
+
+    def register_memory(self, kind: str, factory: MemoryFactory) -> None:
+        self._memory_factories[kind] = factory
+        self._memories.pop(kind, None)
+        self._agents = {k: v for k, v in self._agents.items() if k[2] != kind}
+
+    def llm(self, name: str = "default") -> Any:
+        llm = self._llms.get(name)
+        if llm is None:
+            # "cached"/"semantic" — кэширующие обёртки над общим клиентом (один кэш на процесс)
+            if name == "cached":
+                llm = CachedLLM(self.llm())
+            elif name == "semantic":
+                llm = SemanticCachedLLM(self.llm())
+            else:
+                llm = self._llm_factory()
+            self._llms[name] = llm
+        return llm
+
+    def _llm_name(self, agent_id: str) -> str:
+        if agent_id in self._semantic_agents:
+            return "semantic"
+        return "cached" if agent_id in self._cached_agents else "default"
+
+    def uses_semantic_cache(self, agent_id: str) -> bool:
+        return agent_id in self._semantic_agents
+
+    def cache_stats(self) -> Dict[str, Any]:
+        """Метрики созданных кэширующих обёрток LLM: `{"cached": {...}, "semantic": {...}}`."""
+        return {name: llm.stats() for name, llm in self._llms.items() if callable(getattr(llm, "stats", None))}
+
+    def memory_stats(self) -> Dict[str, Any]:
+        """Метрики созданных бэкендов памяти, у которых они есть (`inmem`: сессии, байты, выселения)."""
+        return {kind: mem.stats() for kind, mem in self._memories.items() if callable(getattr(mem, "stats", None))}
+
+    def memory(self, kind: str) -> Any:
+        mem = self._memories.get(kind)
+        if mem is None:
+            if kind not in self._memory_factories:
+                raise KeyError(f"Memory backend not registered: {kind}")
+            mem = self._memory_factories[kind]()
+            self._memories[kind] = mem
+        return mem
+
+    def agent(
+        self,
+        id: str,
+        version: str,
+        /,
+        *,
+        memory: str = "inmem",
+        role_policy: dict | None = None,
+        meta: dict | None = None,
+    ) -> Any:
+        key = (id, version, memory, _freeze(role_policy), _freeze(meta))
+        agent = self._agents.get(key)
+        if agent is None:
+            llm = self.llm(self._llm_name(id))
+            kwargs: Dict[str, Any] = {"memory": self.memory(memory), "llm": llm}
+            if role_policy is not None:
+                kwargs["role_policy"] = role_policy
+            if meta is not None:
+                kwargs["meta"] = meta
+            agent = get_agent(id, version, **kwargs)
+            self._agents[key] = agent
+        return agent
+
+    async def warmup(self, *, tokenizer_timeout: float = 10.0) -> None:
+        """Загрузить тяжёлые процессные ресурсы до приёма запросов, в потоке — не блокируя event loop.
+
+        - модель эмбеддингов (`AGENTS_EMBED_MODEL`: чтение с диска или скачивание — секунды) иначе строилась бы
+          лениво на первом запросе прямо в loop'е: её берут семантический кэш и retrieval конспекта;
+        - словари tiktoken для бюджета контекста: офлайн скачивание висит или падает — не дольше
+          `tokenizer_timeout` сек, затем подсчёт токенов эвристикой.
+        """
+        await asyncio.to_thread(get_embedder)
+        models = {None, os.getenv("AGENTS_DEFAULT_MODEL") or None, os.getenv("AGENTS_SUMMARY_MODEL") or None}
+        try:
+            await asyncio.wait_for(asyncio.to_thread(preload_encodings, models), timeout=tokenizer_timeout)
+        except asyncio.TimeoutError:
+            disable_encodings(f"preload timed out after {tokenizer_timeout:.0f}s")
+
+    async def aclose(self) -> None:
+        """Закрыть соединения памяти и LLM‑клиентов (вызывается при остановке процесса)."""
+        self._agents.clear()
+        for mem in list(self._memories.values()):
+            close = getattr(mem, "aclose", None)
+            if close is not None:
+                try:
+                    await close()
+                except Exception:
+                    pass
+        self._memories.clear()
+        for llm in list(self._llms.values()):
+            try:
+                await llm.aclose()
+            except Exception:
+                pass
+        self._llms.clear()
+        await aclose_shared_clients()
+        await aclose_shared_pools()
+
+
+__all__ = ["AgentContainer"]
@@ -0,0 +1,60 @@
+"""
+// AICODE-NOTE: Контекст текущего запуска агента (contextvar).
+
+Раннер выставляет `RunContext` на время `run_agent_with_events`, поэтому нижние слои (LLM‑обёртки, память)
+видят, чей это вызов — агент, сессия, трек, текст запроса — без протаскивания аргументов через все сигнатуры.
+"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, Optional
+
+
+@dataclass
+class RunContext:
+    agent_id: str
+    version: str
+    session_id: str
+    trace_id: str = ""
+    # Область переиспользования результатов между сессиями (обычно slug трека); None — только своя сессия
+    scope: Optional[str] = None
+    # Текст запроса пользователя (для семантического кэша); None — запрос не текстовый
+    query_text: Optional[str] = None
+    # Не отдавать ответы из кэшей для этого запуска
+    bypass_cache: bool = False
+    # Ключ идемпотентности хода (повтор запроса с тем же ключом не пишет сообщения второй раз); None — trace_id
+    idempotency_key: Optional[str] = None
+    # Счётчики записей в историю за запуск по `{agent_id}:{name|role}` — порядковая часть ключей идемпотентности
+    write_seq: Dict[str, int] = field(default_factory=dict)
+    # Сохранять ли ответ агента в историю диалога (False — «сухой» запуск без побочных эффектов)
+    persist: bool = True
+    # Что произошло с кэшами во время запуска (попадания/сходство) — для трейса и метрик
+    cache: Dict[str, Any] = field(default_factory=dict)
+    # Время по фазам и токены LLM (`agents.metrics.RunMetrics`); None — запуск без метрик
+    metrics: Any = None
+
+
+_CURRENT: ContextVar[Optional[RunContext]] = ContextVar("agents_run_context", default=None)
+
+
+def current_run() -> Optional[RunContext]:
+    return _CURRENT.get()
+
+
+@contextmanager
+def run_context(ctx: RunContext) -> Iterator[RunContext]:
+    token = _CURRENT.set(ctx)
+    try:
+        yield ctx
+    finally:
+        try:
+            _CURRENT.reset(token)
+        except ValueError:
+            # Генератор закрыт из другого контекста (например, при отмене задачи) — просто снимаем значение
+            _CURRENT.set(None)
+
+
+__all__ = ["RunContext", "current_run", "run_context"]
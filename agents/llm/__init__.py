@@ -6,13 +6,18 @@ from __future__ import annotations
 
 
 from .base import LLMClientBase, LLMMessage, LLMResponse
-from .openai_llm import OpenAILLM
+from .openai_llm import OpenAILLM, aclose_shared_clients
+from .cache import CachedLLM
+from .semantic_cache import SemanticCachedLLM
 
 __all__ = [
     "LLMClientBase",
     "LLMMessage",
     "LLMResponse",
     "OpenAILLM",
+    "CachedLLM",
+    "SemanticCachedLLM",
+    "aclose_shared_clients",
 ]
 
 
@@ -5,7 +5,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Any, Awaitable, Callable, Dict, List, Optional, Protocol, Sequence
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Protocol, Sequence
 from abc import ABC, abstractmethod
 
 try:
@@ -44,6 +44,10 @@ class LLMClientBase(ABC):
     @abstractmethod
     def _create_client(self, **client_kwargs: Any) -> Any: ...
 
+    async def aclose(self) -> None:
+        """Освободить ресурсы SDK‑клиента (соединения). По умолчанию — no-op."""
+        return
+
     @abstractmethod
     async def chat(
         self,
@@ -53,6 +57,22 @@ class LLMClientBase(ABC):
         temperature: float | None = None,
     ) -> LLMResponse: ...
 
+    async def chat_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        model: Optional[str] = None,
+        temperature: float | None = None,
+    ) -> AsyncIterator[str]:
+        """Стрим текстовых дельт ответа.
+
+        Реализация по умолчанию — один кусок с полным ответом `chat()`; провайдеры со стримингом переопределяют.
+        """
+        response = await self.chat(messages, model=model, temperature=temperature)
+        text = response.result if isinstance(response.result, str) else str(response.result)
+        if text:
+            yield text
+
     @abstractmethod
     async def structured_output(
         self,
@@ -0,0 +1,273 @@
+"""
+// AICODE-NOTE: Кэш ответов LLM по точному совпадению запроса.
+
+- `CachedLLM` оборачивает любой `LLMClientBase`: `chat` и `structured_output` кэшируются, стрим/tools/vision — нет.
+- Ключ — sha256 канонического JSON (операция, модель, сообщения, схема, temperature).
+- Уровни: in-process LRU (`MemoryLRUCache`) → Redis (`RedisCache`, общий для реплик API и воркеров).
+  Попадание в Redis дозаполняет LRU. Ошибки Redis не ломают вызов — считаются и пропускаются.
+- Включается по агентам (см. `AgentContainer`, env `AGENTS_LLM_CACHE`).
+"""
+
+from __future__ import annotations
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Protocol, Sequence, Tuple
+
+from .base import LLMClientBase, LLMMessage, LLMResponse, LLMTool
+
+try:
+    from redis import asyncio as redis_asyncio  # type: ignore
+except Exception:  # pragma: no cover - опциональная зависимость
+    redis_asyncio = None  # type: ignore
+
+
+logger = logging.getLogger("agents.llm.cache")
+
+# Версия формата ключа: поднять, чтобы разом инвалидировать кэш
+_KEY_VERSION = "v1"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+class CacheBackend(Protocol):
+    name: str
+
+    async def get(self, key: str) -> Optional[Any]: ...
+    async def set(self, key: str, value: Any, ttl: int) -> None: ...
+
+
+class MemoryLRUCache:
+    """LRU в памяти процесса с TTL на запись."""
+
+    name = "memory"
+
+    def __init__(self, maxsize: Optional[int] = None) -> None:
+        self.maxsize = maxsize if maxsize is not None else _env_int("AGENTS_LLM_CACHE_SIZE", 512)
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        # Копия: вызывающий может мутировать результат (dict структурного ответа)
+        return copy.deepcopy(value)
+
+    async def set(self, key: str, value: Any, ttl: int) -> None:
+        self._data[key] = (time.monotonic() + ttl, copy.deepcopy(value))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class RedisCache:
+    """Общий кэш в Redis (JSON‑значения с TTL). Клиент создаётся лениво внутри event loop."""
+
+    name = "redis"
+
+    def __init__(self, url: Optional[str] = None, *, prefix: str = "llmcache:", client: Any = None) -> None:
+        if client is None and redis_asyncio is None:
+            raise RuntimeError("redis is not installed")
+        self.url = url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self.prefix = prefix
+        self._client = client
+
+    def _redis(self) -> Any:
+        if self._client is None:
+            # Короткие таймауты: недоступный Redis не должен тормозить вызов LLM
+            self._client = redis_asyncio.Redis.from_url(self.url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        return self._client
+
+    async def get(self, key: str) -> Optional[Any]:
+        raw = await self._redis().get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Any, ttl: int) -> None:
+        await self._redis().set(self.prefix + key, json.dumps(value, ensure_ascii=False), ex=ttl)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def default_cache_tiers() -> List[Any]:
+    """LRU + Redis (если задан `REDIS_URL` и не выключен `AGENTS_LLM_CACHE_REDIS=0`)."""
+    tiers: List[Any] = [MemoryLRUCache()]
+    if os.getenv("REDIS_URL") and os.getenv("AGENTS_LLM_CACHE_REDIS", "1") not in {"0", "false", "False", "no"}:
+        try:
+            tiers.append(RedisCache())
+        except Exception:
+            logger.warning("Redis tier for LLM cache is unavailable")
+    return tiers
+
+
+def _schema_repr(schema: Any) -> Any:
+    if isinstance(schema, dict):
+        return schema
+    model_json_schema = getattr(schema, "model_json_schema", None)
+    if callable(model_json_schema):
+        return model_json_schema()
+    return repr(schema)
+
+
+def cache_key(op: str, *, model: Optional[str], messages: Sequence[LLMMessage], temperature: Any = None, schema: Any = None) -> str:
+    payload = {
+        "v": _KEY_VERSION,
+        "op": op,
+        "model": model,
+        "messages": list(messages),
+        "temperature": temperature,
+        "schema": _schema_repr(schema) if schema is not None else None,
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class CachedLLM(LLMClientBase):
+    """Кэширующая обёртка над LLM‑клиентом.
+
+    - `tiers` — уровни кэша по порядку опроса (по умолчанию `default_cache_tiers()`);
+    - `ttl` — время жизни записи, сек (env `AGENTS_LLM_CACHE_TTL`, 3600);
+    - `stats()` — попадания по уровням, промахи, ошибки бэкендов.
+    """
+
+    def __init__(self, inner: LLMClientBase, *, tiers: Optional[List[Any]] = None, ttl: Optional[int] = None) -> None:
+        self.inner = inner
+        self.tiers = tiers if tiers is not None else default_cache_tiers()
+        self.ttl = ttl if ttl is not None else _env_int("AGENTS_LLM_CACHE_TTL", 3600)
+        self._hits: Dict[str, int] = {tier.name: 0 for tier in self.tiers}
+        self._misses = 0
+        self._errors = 0
+        super().__init__(default_model=getattr(inner, "_default_model", None))
+
+    def _create_client(self, **client_kwargs: Any) -> Any:
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        hits = sum(self._hits.values())
+        total = hits + self._misses
+        return {
+            "hits": dict(self._hits),
+            "misses": self._misses,
+            "errors": self._errors,
+            "hit_ratio": (hits / total) if total else 0.0,
+        }
+
+    async def _lookup(self, key: str) -> Tuple[bool, Any]:
+        for i, tier in enumerate(self.tiers):
+            try:
+                value = await tier.get(key)
+            except Exception:
+                self._errors += 1
+                logger.debug("LLM cache tier %s get failed", tier.name, exc_info=True)
+                continue
+            if value is not None:
+                self._hits[tier.name] = self._hits.get(tier.name, 0) + 1
+                # Дозаполняем верхние (более быстрые) уровни
+                for upper in self.tiers[:i]:
+                    await self._store(upper, key, value)
+                return True, value
+        self._misses += 1
+        return False, None
+
+    async def _store(self, tier: Any, key: str, value: Any) -> None:
+        try:
+            await tier.set(key, value, self.ttl)
+        except Exception:
+            self._errors += 1
+            logger.debug("LLM cache tier %s set failed", tier.name, exc_info=True)
+
+    async def _store_all(self, key: str, value: Any) -> None:
+        for tier in self.tiers:
+            await self._store(tier, key, value)
+
+    async def chat(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        model: Optional[str] = None,
+        temperature: float | None = None,
+    ) -> LLMResponse:
+        key = cache_key("chat", model=model or self._default_model, messages=messages, temperature=temperature)
+        hit, value = await self._lookup(key)
+        if hit:
+            return LLMResponse(result=value)
+        response = await self.inner.chat(messages, model=model, temperature=temperature)
+        if response.result:
+            await self._store_all(key, response.result)
+        return response
+
+    async def structured_output(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        schema: Any,
+        model: Optional[str] = None,
+        temperature: float | None = None,
+    ) -> Any:
+        key = cache_key(
+            "structured_output", model=model or self._default_model, messages=messages, temperature=temperature, schema=schema
+        )
+        hit, value = await self._lookup(key)
+        if hit:
+            return LLMResponse(result=value)
+        kwargs: Dict[str, Any] = {"schema": schema, "model": model}
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+        response = await self.inner.structured_output(messages, **kwargs)
+        if response.result:
+            await self._store_all(key, response.result)
+        return response
+
+    def chat_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        model: Optional[str] = None,
+        temperature: float | None = None,
+    ) -> AsyncIterator[str]:
+        # Стрим не кэшируем: диалоговые ответы зависят от всей истории и почти не повторяются
+        return self.inner.chat_stream(messages, model=model, temperature=temperature)
+
+    async def chat_with_tools(
+        self,
+        messages: Sequence[LLMMessage],
+        tools: Sequence[LLMTool],
+        *,
+        model: Optional[str] = None,
+        temperature: float | None = None,
+        max_steps: int = 3,
+    ) -> LLMResponse:
+        return await self.inner.chat_with_tools(messages, tools, model=model, temperature=temperature, max_steps=max_steps)
+
+    async def vision_analyze(self, **kwargs: Any) -> LLMResponse:
+        return await self.inner.vision_analyze(**kwargs)
+
+    async def aclose(self) -> None:
+        # inner — общий клиент контейнера, его закрывает владелец; здесь только свои Redis‑соединения
+        for tier in self.tiers:
+            close = getattr(tier, "aclose", None)
+            if close is not None:
+                try:
+                    await close()
+                except Exception:
+                    pass
+
+
+__all__ = ["CachedLLM", "CacheBackend", "MemoryLRUCache", "RedisCache", "cache_key", "default_cache_tiers"]
@@ -0,0 +1,134 @@
+"""
+// AICODE-NOTE: Локальные эмбеддинги на CPU (без внешних API).
+
+- `SentenceTransformerEmbedder` — модель sentence-transformers (env `AGENTS_EMBED_MODEL`,
+  например `intfloat/multilingual-e5-small`); кодирование — в потоке, чтобы не блокировать event loop.
+- `HashingEmbedder` — fallback без моделей: hashing trick по символьным триграммам и словам (NumPy).
+  Ловит почти дословные повторы («как начать курс?» / «Как начать курс»), но не синонимы.
+- Векторы L2‑нормированы: косинусная близость = скалярное произведение.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import re
+import zlib
+from functools import lru_cache
+from typing import Any, Optional, Protocol, Sequence
+
+try:
+    import numpy as np  # type: ignore
+except Exception:  # pragma: no cover - опциональная зависимость
+    np = None  # type: ignore
+
+try:
+    from sentence_transformers import SentenceTransformer  # type: ignore
+except Exception:  # pragma: no cover - опциональная зависимость
+    SentenceTransformer = None  # type: ignore
+
+
+logger = logging.getLogger("agents.llm.embeddings")
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class Embedder(Protocol):
+    name: str
+    dim: int
+
+    async def embed(self, texts: Sequence[str], *, passage: bool = False) -> Any:
+        """Матрица `(len(texts), dim)` float32, строки L2‑нормированы. `passage=True` — документы индекса, иначе запросы."""
+        ...
+
+
+def _normalize_rows(m: Any) -> Any:
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (m / norms).astype(np.float32, copy=False)
+
+
+class HashingEmbedder:
+    """Hashing trick: признаки — слова и символьные триграммы, индекс/знак — crc32 (стабилен между процессами)."""
+
+    def __init__(self, dim: int = 512) -> None:
+        if np is None:
+            raise RuntimeError("numpy is not installed")
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    @staticmethod
+    def _features(text: str) -> list[str]:
+        words = _WORD_RE.findall(text.lower())
+        feats = [f"w:{w}" for w in words]
+        for w in words:
+            padded = f" {w} "
+            feats.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return feats
+
+    def _vector(self, text: str) -> Any:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for feat in self._features(text):
+            h = zlib.crc32(feat.encode())
+            vec[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        return vec
+
+    async def embed(self, texts: Sequence[str], *, passage: bool = False) -> Any:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return _normalize_rows(np.stack([self._vector(t) for t in texts]))
+
+
+class SentenceTransformerEmbedder:
+    """Модель sentence-transformers на CPU. `prefix`/`passage_prefix` — префиксы запроса и документа
+    для моделей семейства e5 (`query: ` / `passage: `)."""
+
+    def __init__(
+        self, model_name: str, *, device: str = "cpu", prefix: str = "", passage_prefix: str = "", batch_size: int = 32
+    ) -> None:
+        if SentenceTransformer is None or np is None:
+            raise RuntimeError("sentence-transformers is not installed")
+        self.name = model_name
+        self.prefix = prefix
+        self.passage_prefix = passage_prefix
+        self.batch_size = batch_size
+        self._model = SentenceTransformer(model_name, device=device)
+        self.dim = int(self._model.get_sentence_embedding_dimension())
+
+    def _encode(self, texts: Sequence[str], prefix: str) -> Any:
+        vecs = self._model.encode(
+            [prefix + t for t in texts],
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return np.asarray(vecs, dtype=np.float32)
+
+    async def embed(self, texts: Sequence[str], *, passage: bool = False) -> Any:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return await asyncio.to_thread(self._encode, list(texts), self.passage_prefix if passage else self.prefix)
+
+
+@lru_cache(maxsize=1)
+def get_embedder() -> Optional[Embedder]:
+    """Процессный эмбеддер: модель из `AGENTS_EMBED_MODEL`, иначе `HashingEmbedder`; None — нет NumPy."""
+    if np is None:
+        logger.warning("numpy is not installed: embeddings are unavailable")
+        return None
+    model_name = os.getenv("AGENTS_EMBED_MODEL")
+    if model_name:
+        try:
+            return SentenceTransformerEmbedder(
+                model_name,
+                prefix=os.getenv("AGENTS_EMBED_PREFIX", ""),
+                passage_prefix=os.getenv("AGENTS_EMBED_PASSAGE_PREFIX", ""),
+            )
+        except Exception:
+            logger.warning("embedding model %s is unavailable, falling back to hashing", model_name, exc_info=True)
+    return HashingEmbedder(int(os.getenv("AGENTS_EMBED_DIM") or 512))
+
+
+__all__ = ["Embedder", "HashingEmbedder", "SentenceTransformerEmbedder", "get_embedder"]
@@ -1,25 +1,166 @@
 """
 // AICODE-NOTE: Реализация LLMClientABC для OpenAI SDK.
+// AICODE-NOTE: Асинхронный клиент (AsyncOpenAI) — вызовы не блокируют event loop FastAPI.
+// AICODE-NOTE: По умолчанию SDK‑клиент и пул соединений httpx общие на процесс (на каждый event loop),
+// а не создаются на каждый запрос. Параметры пула — через env `OPENAI_MAX_CONNECTIONS` и др.
 """
 
 from __future__ import annotations
 
-import base64
+import asyncio
+import importlib.util
 import json
-from typing import Any, Dict, Optional, Sequence
+import logging
+import os
+import weakref
+from typing import Any, AsyncIterator, Dict, Optional, Sequence, Tuple
 from pydantic import BaseModel
+from ..metrics import current_metrics, llm_call, phase
 from .base import LLMClientBase, LLMMessage, LLMResponse, LLMTool
 
 
-from openai import OpenAI  # type: ignore
+import httpx
+from openai import AsyncOpenAI  # type: ignore
+
+
+logger = logging.getLogger("agents.llm.openai")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    raw = os.getenv(name)
+    if raw is None or raw == "":
+        return default
+    return raw in {"1", "true", "True", "yes"}
+
+
+def build_http_client(
+    *,
+    max_connections: Optional[int] = None,
+    max_keepalive_connections: Optional[int] = None,
+    keepalive_expiry: Optional[float] = None,
+    http2: Optional[bool] = None,
+    timeout: Optional[float] = None,
+) -> httpx.AsyncClient:
+    """Собрать httpx‑клиент с пулом соединений для AsyncOpenAI.
+
+    Незаданные параметры берутся из окружения (`OPENAI_MAX_CONNECTIONS`,
+    `OPENAI_MAX_KEEPALIVE`, `OPENAI_KEEPALIVE_EXPIRY`, `OPENAI_HTTP2`, `OPENAI_TIMEOUT`).
+    """
+    limits = httpx.Limits(
+        max_connections=max_connections if max_connections is not None else _env_int("OPENAI_MAX_CONNECTIONS", 200),
+        max_keepalive_connections=(
+            max_keepalive_connections if max_keepalive_connections is not None else _env_int("OPENAI_MAX_KEEPALIVE", 50)
+        ),
+        keepalive_expiry=keepalive_expiry if keepalive_expiry is not None else _env_float("OPENAI_KEEPALIVE_EXPIRY", 30.0),
+    )
+    use_http2 = http2 if http2 is not None else _env_flag("OPENAI_HTTP2", True)
+    if use_http2 and importlib.util.find_spec("h2") is None:
+        # AICODE-NOTE: HTTP/2 требует пакет h2 (httpx[http2]); без него тихо работаем по HTTP/1.1
+        logger.warning("HTTP/2 requested for OpenAI client but 'h2' is not installed; falling back to HTTP/1.1")
+        use_http2 = False
+    total = timeout if timeout is not None else _env_float("OPENAI_TIMEOUT", 120.0)
+    return httpx.AsyncClient(
+        limits=limits,
+        http2=use_http2,
+        timeout=httpx.Timeout(total, connect=min(total, 10.0)),
+        follow_redirects=True,
+    )
+
+
+# AICODE-NOTE: Реестр общих клиентов: event loop -> (конфиг -> AsyncOpenAI).
+# httpx‑пул привязан к loop'у, поэтому для CLI/воркера (asyncio.run) клиенты не переиспользуются между loop'ами.
+_SHARED_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[Any, ...], AsyncOpenAI]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _config_key(config: Dict[str, Any]) -> Tuple[Any, ...]:
+    return tuple(sorted((k, repr(v)) for k, v in config.items()))
+
+
+def get_shared_client(**config: Any) -> AsyncOpenAI:
+    """Вернуть общий на процесс (и текущий event loop) AsyncOpenAI‑клиент для данной конфигурации.
+
+    Должна вызываться внутри работающего event loop.
+    """
+    loop = asyncio.get_running_loop()
+    per_loop = _SHARED_CLIENTS.setdefault(loop, {})
+    key = _config_key(config)
+    client = per_loop.get(key)
+    if client is None:
+        client = _new_client(**config)
+        per_loop[key] = client
+    return client
+
+
+def _new_client(
+    *,
+    max_connections: Optional[int] = None,
+    max_keepalive_connections: Optional[int] = None,
+    keepalive_expiry: Optional[float] = None,
+    http2: Optional[bool] = None,
+    timeout: Optional[float] = None,
+    **client_kwargs: Any,
+) -> AsyncOpenAI:
+    http_client = build_http_client(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+        http2=http2,
+        timeout=timeout,
+    )
+    # client_kwargs: api_key, base_url и т.д. (по умолчанию SDK читает OPENAI_API_KEY/OPENAI_BASE_URL)
+    return AsyncOpenAI(http_client=http_client, **client_kwargs)
+
+
+async def aclose_shared_clients() -> None:
+    """Закрыть общие клиенты текущего event loop (вызывается при остановке приложения)."""
+    loop = asyncio.get_running_loop()
+    per_loop = _SHARED_CLIENTS.pop(loop, {})
+    for client in per_loop.values():
+        try:
+            await client.close()
+        except Exception:
+            pass
+
 
 class OpenAILLM(LLMClientBase):
-    def __init__(self, *, default_model: Optional[str] = None, **client_kwargs: Any) -> None:
+    def __init__(self, *, default_model: Optional[str] = None, shared: bool = True, **client_kwargs: Any) -> None:
+        # AICODE-NOTE: shared=True — берём общий клиент из реестра процесса; shared=False — собственный клиент
+        # (его нужно закрыть через aclose()).
+        self._shared = shared
+        self._client_kwargs = dict(client_kwargs)
         super().__init__(default_model=default_model, **client_kwargs)
 
     def _create_client(self, **client_kwargs: Any) -> Any:
-        # client_kwargs: api_key, base_url и т.д.
-        return OpenAI(**client_kwargs)
+        if self._shared:
+            # Общий клиент резолвится лениво внутри event loop (см. _get_client)
+            return None
+        return _new_client(**client_kwargs)
+
+    def _get_client(self) -> AsyncOpenAI:
+        if self._client is not None:
+            return self._client
+        return get_shared_client(**self._client_kwargs)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
 
     async def chat(
         self,
@@ -29,14 +170,46 @@ class OpenAILLM(LLMClientBase):
         temperature: float | None = None,
     ) -> LLMResponse:
         mdl = model or self._default_model
-        resp = self._client.chat.completions.create(
-            model=mdl,
-            messages=list(messages),
-            temperature=temperature if temperature is not None else 0.3,
-        )
+        with llm_call(mdl) as call:
+            resp = await self._get_client().chat.completions.create(
+                model=mdl,
+                messages=list(messages),
+                temperature=temperature if temperature is not None else 0.3,
+            )
+            call["usage"] = getattr(resp, "usage", None)
         text = resp.choices[0].message.content
         return LLMResponse(result=text, client_response=resp)
 
+    async def chat_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        model: Optional[str] = None,
+        temperature: float | None = None,
+    ) -> AsyncIterator[str]:
+        mdl = model or self._default_model
+        metrics = current_metrics()
+        # Фаза llm стрима — от запроса до последнего чанка (включая время потребителя между дельтами)
+        with llm_call(mdl) as call:
+            stream = await self._get_client().chat.completions.create(
+                model=mdl,
+                messages=list(messages),
+                temperature=temperature if temperature is not None else 0.3,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            async for chunk in stream:
+                # Последний чанк с include_usage приходит без choices
+                if getattr(chunk, "usage", None) is not None:
+                    call["usage"] = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if metrics is not None:
+                        metrics.mark_first_token()
+                    yield delta
+
     async def structured_output(
         self,
         messages: Sequence[LLMMessage],
@@ -45,12 +218,15 @@ class OpenAILLM(LLMClientBase):
         model: Optional[str] = None,
     ) -> tuple[Any, LLMResponse]:
         mdl = model or self._default_model
-        resp = self._client.beta.chat.completions.parse(
-            model=mdl,
-            messages=list(messages),
-            response_format=schema
-        )
-        parsed = json.loads(resp.choices[0].message.content)
+        with llm_call(mdl) as call:
+            resp = await self._get_client().beta.chat.completions.parse(
+                model=mdl,
+                messages=list(messages),
+                response_format=schema
+            )
+            call["usage"] = getattr(resp, "usage", None)
+        with phase("structured_parse"):
+            parsed = json.loads(resp.choices[0].message.content)
         # не использую message.parsed, так как это не корретно работает с json схемой, но с pydantic все норм
 
         return LLMResponse(result=parsed, client_response=resp)
@@ -82,6 +258,4 @@ class OpenAILLM(LLMClientBase):
         return LLMResponse(text=text, client_response=resp)
 
 
-__all__ = ["OpenAILLM"]
-
-
+__all__ = ["OpenAILLM", "build_http_client", "get_shared_client", "aclose_shared_clients"]
@@ -0,0 +1,288 @@
+"""
+// AICODE-NOTE: Семантический кэш ответов LLM для разговорных агентов (mentor_chat, practice_coach).
+
+- Ключ поиска — эмбеддинг текста запроса пользователя (`RunContext.query_text`), а не всего промпта:
+  шаблоны промптов одинаковы, и по ним все запросы выглядели бы похожими.
+- Область (scope) — агент/версия/модель + трек (`RunContext.scope`; без трека — сессия). В каждой области —
+  `VectorIndex`: NumPy‑матрица и brute‑force поиск по косинусу (на сотнях–тысячах записей это доли мс).
+- Ответ отдаётся из кэша, если близость ≥ порога (env `AGENTS_SEMANTIC_CACHE_THRESHOLD`, 0.92).
+- Режимы (env `AGENTS_SEMANTIC_CACHE_MODE`): `on` — отдаём попадания; `shadow` — только считаем, что было бы
+  попаданием, и всегда зовём LLM (безопасный замер экономии). Обход на запуск — `RunContext.bypass_cache`.
+- Ответ диалога зависит от истории; кэш сознательно её не учитывает — включать только там, где первые/типовые
+  вопросы преобладают (см. `AGENTS_SEMANTIC_CACHE`).
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from ..context import RunContext, current_run
+from .base import LLMClientBase, LLMMessage, LLMResponse, LLMTool
+from .embeddings import Embedder, get_embedder
+
+try:
+    import numpy as np  # type: ignore
+except Exception:  # pragma: no cover - опциональная зависимость
+    np = None  # type: ignore
+
+
+logger = logging.getLogger("agents.llm.semantic_cache")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+class VectorIndex:
+    """Индекс одной области: кольцевой буфер из `maxsize` векторов с ответами и сроком жизни."""
+
+    def __init__(self, dim: int, maxsize: int) -> None:
+        self.dim = dim
+        self.maxsize = max(1, maxsize)
+        self._vecs = np.zeros((min(16, self.maxsize), dim), dtype=np.float32)
+        self._expires = np.zeros(len(self._vecs), dtype=np.float64)
+        self._answers: List[str] = []
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self._answers)
+
+    def search(self, vec: Any) -> Tuple[float, Optional[str]]:
+        n = len(self._answers)
+        if n == 0:
+            return 0.0, None
+        sims = self._vecs[:n] @ vec
+        sims[self._expires[:n] < time.time()] = -1.0
+        i = int(np.argmax(sims))
+        sim = float(sims[i])
+        return (sim, self._answers[i]) if sim > -1.0 else (0.0, None)
+
+    def add(self, vec: Any, answer: str, ttl: int) -> None:
+        n = len(self._answers)
+        if n < self.maxsize:
+            if n == len(self._vecs):
+                cap = min(self.maxsize, len(self._vecs) * 2)
+                self._vecs = np.resize(self._vecs, (cap, self.dim))
+                self._expires = np.resize(self._expires, cap)
+            i = n
+            self._answers.append(answer)
+        else:
+            # Заполнено — перезаписываем самую старую запись
+            i = self._next % self.maxsize
+            self._answers[i] = answer
+        self._next = i + 1
+        self._vecs[i] = vec
+        self._expires[i] = time.time() + ttl
+
+
+class SemanticCachedLLM(LLMClientBase):
+    """Обёртка над LLM‑клиентом: семантический кэш для `chat` и `chat_stream`.
+
+    - `embedder` — по умолчанию `get_embedder()` (локальная модель или hashing‑fallback);
+    - `threshold` — минимальная косинусная близость для попадания;
+    - `max_entries` (env `AGENTS_SEMANTIC_CACHE_SIZE`, 1000) — записей на область, `max_scopes`
+      (env `AGENTS_SEMANTIC_CACHE_SCOPES`, 256) — областей в LRU;
+    - `stats()` — попадания/промахи/обходы и средние задержки попадания и вызова LLM.
+    """
+
+    def __init__(
+        self,
+        inner: LLMClientBase,
+        *,
+        embedder: Optional[Embedder] = None,
+        threshold: Optional[float] = None,
+        ttl: Optional[int] = None,
+        max_entries: Optional[int] = None,
+        max_scopes: Optional[int] = None,
+        mode: Optional[str] = None,
+    ) -> None:
+        self.inner = inner
+        self.embedder = embedder if embedder is not None else get_embedder()
+        self.threshold = threshold if threshold is not None else _env_float("AGENTS_SEMANTIC_CACHE_THRESHOLD", 0.92)
+        self.ttl = ttl if ttl is not None else _env_int("AGENTS_SEMANTIC_CACHE_TTL", 86400)
+        self.max_entries = max_entries if max_entries is not None else _env_int("AGENTS_SEMANTIC_CACHE_SIZE", 1000)
+        self.max_scopes = max_scopes if max_scopes is not None else _env_int("AGENTS_SEMANTIC_CACHE_SCOPES", 256)
+        self.mode = (mode or os.getenv("AGENTS_SEMANTIC_CACHE_MODE") or "on").lower()
+        self._indexes: "OrderedDict[str, VectorIndex]" = OrderedDict()
+        self._counts: Dict[str, int] = {"hits": 0, "misses": 0, "shadow_hits": 0, "bypassed": 0, "skipped": 0, "errors": 0}
+        self._timings: Dict[str, List[float]] = {"hit_ms": [0.0, 0], "llm_ms": [0.0, 0], "embed_ms": [0.0, 0]}
+        super().__init__(default_model=getattr(inner, "_default_model", None))
+
+    def _create_client(self, **client_kwargs: Any) -> Any:
+        return None
+
+    # ------------------------------------------------------------------
+    # Метрики
+    # ------------------------------------------------------------------
+
+    def _observe(self, name: str, started: float) -> None:
+        acc = self._timings[name]
+        acc[0] += (time.perf_counter() - started) * 1000
+        acc[1] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        served = self._counts["hits"]
+        total = served + self._counts["misses"] + self._counts["shadow_hits"]
+        return {
+            **self._counts,
+            "mode": self.mode,
+            "hit_ratio": (served / total) if total else 0.0,
+            # В shadow‑режиме — доля запросов, которые были бы отданы из кэша
+            "would_hit_ratio": ((served + self._counts["shadow_hits"]) / total) if total else 0.0,
+            "avg_ms": {name: (acc[0] / acc[1]) if acc[1] else 0.0 for name, acc in self._timings.items()},
+            "scopes": len(self._indexes),
+            "entries": sum(len(ix) for ix in self._indexes.values()),
+        }
+
+    # ------------------------------------------------------------------
+    # Поиск/сохранение
+    # ------------------------------------------------------------------
+
+    def _scope_key(self, ctx: RunContext, model: Optional[str]) -> str:
+        area = f"track:{ctx.scope}" if ctx.scope else f"session:{ctx.session_id}"
+        return f"{ctx.agent_id}:{ctx.version}:{model or self._default_model}:{area}"
+
+    def _index(self, scope: str, create: bool) -> Optional[VectorIndex]:
+        index = self._indexes.get(scope)
+        if index is not None:
+            self._indexes.move_to_end(scope)
+        elif create:
+            index = VectorIndex(self.embedder.dim, self.max_entries)
+            self._indexes[scope] = index
+            while len(self._indexes) > self.max_scopes:
+                self._indexes.popitem(last=False)
+        return index
+
+    async def _lookup(self, model: Optional[str]) -> Tuple[Optional[Tuple[str, Any]], Optional[str]]:
+        """Вернуть (куда сохранить ответ, ответ из кэша для отдачи). (None, None) — кэш не применим."""
+        ctx = current_run()
+        if ctx is None or not ctx.query_text or self.embedder is None or self.mode == "off":
+            self._counts["skipped"] += 1
+            return None, None
+        started = time.perf_counter()
+        try:
+            vec = (await self.embedder.embed([ctx.query_text]))[0]
+        except Exception:
+            self._counts["errors"] += 1
+            logger.debug("semantic cache: embedding failed", exc_info=True)
+            return None, None
+        self._observe("embed_ms", started)
+
+        scope = self._scope_key(ctx, model)
+        index = self._index(scope, create=False)
+        sim, answer = index.search(vec) if index is not None else (0.0, None)
+        hit = answer is not None and sim >= self.threshold
+        if ctx.bypass_cache:
+            status = "bypass"
+            self._counts["bypassed"] += 1
+        elif hit and self.mode == "on":
+            status = "hit"
+            self._counts["hits"] += 1
+        elif hit:
+            status = "shadow_hit"
+            self._counts["shadow_hits"] += 1
+        else:
+            status = "miss"
+            self._counts["misses"] += 1
+        ctx.cache["semantic"] = {"status": status, "similarity": round(sim, 4)}
+        if status == "hit":
+            return None, answer
+        return (scope, vec), None
+
+    def _store(self, target: Optional[Tuple[str, Any]], answer: Any) -> None:
+        if target is None or not isinstance(answer, str) or not answer.strip():
+            return
+        scope, vec = target
+        self._index(scope, create=True).add(vec, answer, self.ttl)
+
+    # ------------------------------------------------------------------
+    # LLMClientBase
+    # ------------------------------------------------------------------
+
+    async def chat(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        model: Optional[str] = None,
+        temperature: float | None = None,
+    ) -> LLMResponse:
+        started = time.perf_counter()
+        target, cached = await self._lookup(model)
+        if cached is not None:
+            self._observe("hit_ms", started)
+            return LLMResponse(result=cached)
+        started = time.perf_counter()
+        response = await self.inner.chat(messages, model=model, temperature=temperature)
+        self._observe("llm_ms", started)
+        self._store(target, response.result)
+        return response
+
+    async def chat_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        model: Optional[str] = None,
+        temperature: float | None = None,
+    ) -> AsyncIterator[str]:
+        started = time.perf_counter()
+        target, cached = await self._lookup(model)
+        if cached is not None:
+            self._observe("hit_ms", started)
+            yield cached
+            return
+        started = time.perf_counter()
+        chunks: List[str] = []
+        async for delta in self.inner.chat_stream(messages, model=model, temperature=temperature):
+            chunks.append(delta)
+            yield delta
+        self._observe("llm_ms", started)
+        # Сохраняем только полностью полученный ответ (прерванный стрим сюда не дойдёт)
+        self._store(target, "".join(chunks))
+
+    async def structured_output(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        schema: Any,
+        model: Optional[str] = None,
+        temperature: float | None = None,
+    ) -> Any:
+        kwargs: Dict[str, Any] = {"schema": schema, "model": model}
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+        return await self.inner.structured_output(messages, **kwargs)
+
+    async def chat_with_tools(
+        self,
+        messages: Sequence[LLMMessage],
+        tools: Sequence[LLMTool],
+        *,
+        model: Optional[str] = None,
+        temperature: float | None = None,
+        max_steps: int = 3,
+    ) -> LLMResponse:
+        return await self.inner.chat_with_tools(messages, tools, model=model, temperature=temperature, max_steps=max_steps)
+
+    async def vision_analyze(self, **kwargs: Any) -> LLMResponse:
+        return await self.inner.vision_analyze(**kwargs)
+
+    async def aclose(self) -> None:
+        # inner — общий клиент контейнера, его закрывает владелец
+        return None
+
+
+__all__ = ["SemanticCachedLLM", "VectorIndex"]
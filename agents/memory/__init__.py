@@ -6,7 +6,10 @@ from .base import BaseMemory  # noqa: F401
 from .redis_short_term import RedisShortTerm  # noqa: F401
 from .backend_memory import BackendMemory  # noqa: F401
 from .in_memory import InMemoryMemory  # noqa: F401
+from .postgres_memory import PostgresMemory  # noqa: F401
+from .summarizing import SummarizingMemory  # noqa: F401
+from .tiered import TieredMemory  # noqa: F401
 
-__all__ = ["BaseMemory", "RedisShortTerm", "BackendMemory", "InMemoryMemory"]
+__all__ = ["BaseMemory", "RedisShortTerm", "BackendMemory", "InMemoryMemory", "PostgresMemory", "SummarizingMemory", "TieredMemory"]
 
 
@@ -6,47 +6,63 @@
 from __future__ import annotations
 
 import os
-from typing import Any
+from typing import Any, Optional
 
 import httpx
 
+from .base import history_limit, idempotency_keys
+
 
 class BackendMemory:
     def __init__(self, base_url: str | None = None, client: httpx.AsyncClient | None = None) -> None:
         self.base_url = base_url or os.getenv("AGENTS_BACKEND_API_URL", "http://localhost:8000")
+        # AICODE-NOTE: Собственный клиент закрываем в aclose(); переданный снаружи — ответственность владельца
+        self._owns_client = client is None
         self.client = client or httpx.AsyncClient(base_url=self.base_url, timeout=15)
 
+    async def aclose(self) -> None:
+        if self._owns_client:
+            await self.client.aclose()
+
     async def load_dialog(self, session_id: str, role_policy: dict) -> list[dict]:
         # Определяем вкладку из политики роли; по умолчанию используем chat
         tab = str(role_policy.get("tab", "chat"))
         if tab not in {"chat", "practice", "simulation"}:
             tab = "chat"
-        r = await self.client.get(f"/sessions/{session_id}/messages/{tab}")
+        # AICODE-NOTE: tail‑режим API — в промпт идут только последние N сообщений, а не вся ветка
+        limit = history_limit(role_policy)
+        params = {"tail": min(limit, 1000)} if limit else None
+        r = await self.client.get(f"/sessions/{session_id}/messages/{tab}", params=params)
         r.raise_for_status()
         messages = r.json()
         # API возвращает массив Message {role, content, ...}; уже готово к прокидке в LLM
         return [{"role": m["role"], "content": m["content"]} for m in messages]
 
-    async def append(self, session_id: str, messages: list[dict]) -> None:
-        # Запишем как assistant‑сообщения. Учитываем вкладку из политики роли (если была сохранена через set_kv).
-        # Для простоты — используем chat по умолчанию.
-        tab = "chat"
-        try:
-            # Попытка получить таб из KV (если агент сохранил его заранее)
-            # KV не реализован в BackendMemory, поэтому оставим chat.
-            pass
-        except Exception:
-            pass
-        for m in messages:
+    async def append(self, session_id: str, messages: list[dict], *, role_policy: dict | None = None) -> None:
+        # Пишем в ветку вкладки из политики роли; ключ идемпотентности — заголовком (повтор не создаёт дубль)
+        tab = str((role_policy or {}).get("tab", "chat"))
+        if tab not in {"chat", "practice", "simulation"}:
+            tab = "chat"
+        for m, key in zip(messages, idempotency_keys(messages)):
             role = m.get("role", "assistant")
             content = m.get("content", "")
             if isinstance(content, dict):
                 # Если пришла форма {"message": "..."} — извлекаем строку
                 content = content.get("message", "")
             body = {"role": role, "content": str(content), "meta": m.get("meta")}
-            r = await self.client.post(f"/sessions/{session_id}/messages/{tab}", json=body)
+            headers = {"Idempotency-Key": key} if key else None
+            r = await self.client.post(f"/sessions/{session_id}/messages/{tab}", json=body, headers=headers)
             r.raise_for_status()
 
+    async def load_synopsis(self, session_id: str) -> Optional[dict]:
+        """Текущий конспект сессии (`GET /sessions/{id}/synopsis`) — источник для retrieval; 404 — None."""
+        r = await self.client.get(f"/sessions/{session_id}/synopsis")
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        data = r.json()
+        return {"version": data.get("lastUpdated"), "items": data.get("items") or []}
+
     async def set_kv(self, session_id: str, key: str, value: Any) -> None:  # pragma: no cover — пока не требуется
         return
 
@@ -4,16 +4,76 @@
 
 from __future__ import annotations
 
-from typing import Any, Protocol
+import os
+import uuid
+from typing import Any, Optional, Protocol
+
+from ..context import current_run
 
 
 class BaseMemory(Protocol):
     async def load_dialog(self, session_id: str, role_policy: dict) -> list[dict]: ...
-    async def append(self, session_id: str, messages: list[dict]) -> None: ...
+    # role_policy — та же политика, что в load_dialog: сообщения пишутся в ветку её вкладки
+    async def append(self, session_id: str, messages: list[dict], *, role_policy: dict | None = None) -> None: ...
     async def set_kv(self, session_id: str, key: str, value: Any) -> None: ...
     async def get_kv(self, session_id: str, key: str) -> Any: ...
 
 
-__all__ = ["BaseMemory"]
+def idempotency_keys(messages: list[dict], agent_id: Optional[str] = None) -> list[Optional[str]]:
+    """Ключи идемпотентности сообщений текущего хода (None — вне запуска агента).
+
+    Ключ — `idempotency_key` сообщения, иначе `{ключ хода}:{agent_id}:{name|role}:{n}`, где ключ хода —
+    `RunContext.idempotency_key` (повтор запроса клиентом) или `trace_id`, `agent_id` — пишущий агент
+    (по умолчанию агент запуска), `n` — счётчик записей этого агента с этой ролью за весь запуск
+    (`RunContext.write_seq`): шаги workflow и итерации цикла получают разные ключи, а повтор хода — те же.
+    Уникальный индекс в `chat_messages` по `(thread_id, idempotency_key)` гарантирует одну запись на ход при повторах.
+    """
+    ctx = current_run()
+    base = (ctx.idempotency_key or ctx.trace_id) if ctx is not None else ""
+    keys: list[Optional[str]] = []
+    for m in messages:
+        key = m.get("idempotency_key")
+        if not key and base:
+            assert ctx is not None
+            counter = f"{agent_id or ctx.agent_id}:{m.get('name') or m.get('role', 'assistant')}"
+            n = ctx.write_seq.get(counter, 0)
+            ctx.write_seq[counter] = n + 1
+            key = f"{base}:{counter}:{n}"
+        keys.append(str(key) if key else None)
+    return keys
+
+
+def with_idempotency_keys(messages: list[dict], agent_id: str) -> list[dict]:
+    """Копии сообщений с проставленным `idempotency_key` от имени `agent_id` (вне запуска — без изменений)."""
+    if current_run() is None:
+        return messages
+    return [{**m, "idempotency_key": key} if key else m for m, key in zip(messages, idempotency_keys(messages, agent_id))]
+
+
+def session_or_ephemeral(session_id: Optional[str]) -> str:
+    """`session_id` запроса или новый одноразовый id (`anon-…`).
+
+    Запрос без сессии не должен делить историю с другими такими же (общая `inmem`‑память процесса): каждый
+    получает свою пустую. Не UUID — PostgresMemory его не найдёт и ничего не запишет, область кэша — сама сессия.
+    """
+    return session_id or f"anon-{uuid.uuid4().hex}"
+
+
+def history_limit(role_policy: dict | None) -> Optional[int]:
+    """Сколько последних сообщений грузить в промпт (tail‑режим `load_dialog`).
+
+    `role_policy["history_limit"]`, иначе env `AGENTS_HISTORY_LIMIT` (по умолчанию 100); `0` — без ограничения.
+    """
+    raw = (role_policy or {}).get("history_limit")
+    if raw is None:
+        raw = os.getenv("AGENTS_HISTORY_LIMIT") or "100"
+    try:
+        limit = int(raw)
+    except (TypeError, ValueError):
+        return None
+    return limit if limit > 0 else None
+
+
+__all__ = ["BaseMemory", "history_limit", "idempotency_keys", "session_or_ephemeral", "with_idempotency_keys"]
 
 
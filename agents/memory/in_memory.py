@@ -1,31 +1,148 @@
 """
-// AICODE-NOTE: InMemoryMemory — простая in-memory реализация для локальных запусков и CLI.
+// AICODE-NOTE: InMemoryMemory — in-memory память для локальных запусков, CLI и долгоживущих процессов (API, воркер).
+
+- Ограничена по объёму: на сессию — последние `max_messages` сообщений (deque), на процесс — `max_sessions`
+  сессий (LRU) и примерно `max_bytes` текста; сессия без обращений дольше `ttl` секунд удаляется.
+- Выселение — «ленивое», на обращениях к памяти: без фоновых задач и таймеров.
+- `stats()` — число сессий/сообщений, оценка занятых байт и счётчики выселений.
 """
 
 from __future__ import annotations
 
-from typing import Any, DefaultDict
-from collections import defaultdict
+import os
+import sys
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Any, Deque, Dict, Optional
+
+from .base import history_limit
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+def _size(message: dict) -> int:
+    """Оценка памяти сообщения: текст + служебные поля (точный `sizeof` дерева объектов здесь не нужен)."""
+    content = message.get("content", "")
+    text = content if isinstance(content, str) else str(content)
+    return sys.getsizeof(text) + 64 * len(message)
+
+
+@dataclass
+class _Session:
+    messages: Deque[dict]
+    kv: Dict[str, Any] = field(default_factory=dict)
+    bytes: int = 0
+    touched: float = 0.0
 
 
 class InMemoryMemory:
-    def __init__(self) -> None:
-        self._messages: DefaultDict[str, list[dict]] = defaultdict(list)
-        self._kv: DefaultDict[str, dict[str, Any]] = defaultdict(dict)
+    """История и KV сессий в памяти процесса с ограничением объёма.
+
+    - `max_messages` (env `AGENTS_INMEM_MAX_MESSAGES`, 200) — сколько последних сообщений хранить на сессию;
+    - `max_sessions` (env `AGENTS_INMEM_MAX_SESSIONS`, 1000) — сколько сессий держать (LRU);
+    - `max_bytes` (env `AGENTS_INMEM_MAX_BYTES`, 64 МБ) — бюджет на все сессии, сверх — выселяются самые старые;
+    - `ttl` (env `AGENTS_INMEM_TTL`, 3600) — сессия без обращений дольше, сек, удаляется; 0 — без TTL.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_messages: Optional[int] = None,
+        max_sessions: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ) -> None:
+        self.max_messages = max(max_messages if max_messages is not None else _env_int("AGENTS_INMEM_MAX_MESSAGES", 200), 1)
+        self.max_sessions = max(max_sessions if max_sessions is not None else _env_int("AGENTS_INMEM_MAX_SESSIONS", 1000), 1)
+        self.max_bytes = max_bytes if max_bytes is not None else _env_int("AGENTS_INMEM_MAX_BYTES", 64 * 1024 * 1024)
+        self.ttl = ttl if ttl is not None else _env_int("AGENTS_INMEM_TTL", 3600)
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._bytes = 0
+        self._counters: Dict[str, int] = {"evicted_lru": 0, "evicted_ttl": 0, "evicted_bytes": 0, "trimmed": 0}
+
+    def _expire(self, now: float) -> None:
+        # Порядок OrderedDict — по последнему обращению, поэтому истёкшие сессии всегда в начале
+        if self.ttl <= 0:
+            return
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.touched < self.ttl:
+                break
+            self._drop(session_id, "evicted_ttl")
+
+    def _drop(self, session_id: str, reason: str) -> None:
+        session = self._sessions.pop(session_id)
+        self._bytes -= session.bytes
+        self._counters[reason] += 1
+
+    def _get(self, session_id: str, *, create: bool) -> Optional[_Session]:
+        now = time.monotonic()
+        self._expire(now)
+        session = self._sessions.get(session_id)
+        if session is None:
+            if not create:
+                return None
+            session = self._sessions[session_id] = _Session(messages=deque(maxlen=self.max_messages))
+            while len(self._sessions) > self.max_sessions:
+                self._drop(next(iter(self._sessions)), "evicted_lru")
+        else:
+            self._sessions.move_to_end(session_id)
+        session.touched = now
+        return session
 
     async def load_dialog(self, session_id: str, role_policy: dict) -> list[dict]:
-        return list(self._messages[session_id])
+        session = self._get(session_id, create=False)
+        if session is None:
+            return []
+        messages = session.messages
+        limit = history_limit(role_policy)
+        if limit and limit < len(messages):
+            return list(islice(messages, len(messages) - limit, None))
+        return list(messages)
 
-    async def append(self, session_id: str, messages: list[dict]) -> None:
-        self._messages[session_id].extend(messages)
+    async def append(self, session_id: str, messages: list[dict], *, role_policy: dict | None = None) -> None:
+        # История одна на сессию (load_dialog вкладку не различает) — role_policy не нужен
+        if not messages:
+            return
+        session = self._get(session_id, create=True)
+        for m in messages:
+            if len(session.messages) == session.messages.maxlen:
+                dropped = _size(session.messages[0])
+                session.bytes -= dropped
+                self._bytes -= dropped
+                self._counters["trimmed"] += 1
+            size = _size(m)
+            session.messages.append(m)
+            session.bytes += size
+            self._bytes += size
+        # Бюджет памяти: выселяем самые давние сессии, текущую — в последнюю очередь
+        while self.max_bytes > 0 and self._bytes > self.max_bytes and len(self._sessions) > 1:
+            self._drop(next(iter(self._sessions)), "evicted_bytes")
 
     async def set_kv(self, session_id: str, key: str, value: Any) -> None:
-        self._kv[session_id][key] = value
+        self._get(session_id, create=True).kv[key] = value
 
     async def get_kv(self, session_id: str, key: str) -> Any:
-        return self._kv[session_id].get(key)
-
+        session = self._get(session_id, create=False)
+        return session.kv.get(key) if session is not None else None
 
-__all__ = ["InMemoryMemory"]
+    def stats(self) -> Dict[str, Any]:
+        self._expire(time.monotonic())
+        return {
+            "sessions": len(self._sessions),
+            "messages": sum(len(s.messages) for s in self._sessions.values()),
+            "bytes": self._bytes,
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            **self._counters,
+        }
 
 
+__all__ = ["InMemoryMemory"]
@@ -0,0 +1,221 @@
+"""
+// AICODE-NOTE: PostgresMemory — читает/пишет `chat_messages` напрямую через общий async‑пул psycopg3.
+// Замена BackendMemory внутри процесса API: без HTTP‑петли к самому себе и JSON encode/decode на каждый ход.
+"""
+
+from __future__ import annotations
+
+import json
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    from psycopg_pool import AsyncConnectionPool  # type: ignore
+except Exception:  # pragma: no cover
+    AsyncConnectionPool = None  # type: ignore
+
+try:
+    from psycopg import errors as pg_errors  # type: ignore
+except Exception:  # pragma: no cover
+    pg_errors = None  # type: ignore
+
+
+from .base import history_limit, idempotency_keys
+
+
+_TABS = {"chat", "practice", "simulation"}
+_ROLES = {"user", "assistant", "tool"}
+# AICODE-NOTE: thread_id для пары (session_id, tab) не меняется (UNIQUE + ON DELETE CASCADE), кэшируем в процессе
+# (LRU); удалённую сессию из кэша убирает `forget_session` или первая неудачная запись в её ветку
+_THREAD_CACHE_LIMIT = 10_000
+
+
+def _is_uuid(value: str) -> bool:
+    try:
+        uuid.UUID(str(value))
+        return True
+    except ValueError:
+        return False
+
+
+class PostgresMemory:
+    """Память диалога поверх таблиц `chat_threads`/`chat_messages`.
+
+    - `pool` — общий `AsyncConnectionPool` приложения; если не передан, создаётся собственный из `DB_URL`
+      (его закрывает `aclose()`).
+    - Сессии без ветки (например, одноразовая `anon-…` у запроса без `session_id`) не ошибка: история пустая, запись пропускается.
+    """
+
+    def __init__(self, pool: Any | None = None, *, dsn: str | None = None) -> None:
+        if pool is None:
+            if AsyncConnectionPool is None:
+                raise RuntimeError("psycopg_pool is not installed")
+            if dsn is None:
+                # Единый источник DSN — backend.app.db (импорт только здесь: с общим пулом API он не нужен)
+                from backend.app.db import build_db_url_from_env
+
+                dsn = build_db_url_from_env()
+            pool = AsyncConnectionPool(dsn, min_size=1, max_size=4, open=False)
+            self._owns_pool = True
+        else:
+            self._owns_pool = False
+        self.pool = pool
+        self._opened = not self._owns_pool
+        self._thread_ids: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+
+    async def _ensure_open(self) -> None:
+        if not self._opened:
+            await self.pool.open()
+            self._opened = True
+
+    async def aclose(self) -> None:
+        if self._owns_pool and self._opened:
+            await self.pool.close()
+            self._opened = False
+
+    @staticmethod
+    def _tab(role_policy: dict | None) -> str:
+        tab = str((role_policy or {}).get("tab", "chat"))
+        return tab if tab in _TABS else "chat"
+
+    async def _thread_id(self, conn, session_id: str, tab: str) -> Optional[str]:
+        key = (session_id, tab)
+        cached = self._thread_ids.get(key)
+        if cached is not None:
+            self._thread_ids.move_to_end(key)
+            return cached
+        if not _is_uuid(session_id):
+            return None
+        cur = await conn.execute(
+            "SELECT id::text FROM chat_threads WHERE session_id = %s::uuid AND tab = %s::chat_tab",
+            (session_id, tab),
+        )
+        row = await cur.fetchone()
+        if row is None:
+            return None
+        self._thread_ids[key] = row[0]
+        while len(self._thread_ids) > _THREAD_CACHE_LIMIT:
+            self._thread_ids.popitem(last=False)
+        return row[0]
+
+    def forget_session(self, session_id: str) -> None:
+        """Убрать закэшированные ветки сессии (сессия удалена)."""
+        for tab in _TABS:
+            self._thread_ids.pop((session_id, tab), None)
+
+    async def load_dialog(self, session_id: str, role_policy: dict, *, with_ids: bool = False) -> list[dict]:
+        """Хвост ветки вкладки; `with_ids=True` — с `id` сообщений (для сверки с горячим уровнем TieredMemory)."""
+        await self._ensure_open()
+        async with self.pool.connection() as conn:
+            thread_id = await self._thread_id(conn, session_id, self._tab(role_policy))
+            if thread_id is None:
+                return []
+            # Последние N по индексу (thread_id, created_at), затем в хронологическом порядке; LIMIT NULL — все
+            cur = await conn.execute(
+                """
+                SELECT role, content, id::text FROM (
+                    SELECT role::text AS role, content, created_at, id
+                    FROM chat_messages
+                    WHERE thread_id = %s::uuid
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                ) AS tail
+                ORDER BY created_at ASC, id ASC
+                """,
+                (thread_id, history_limit(role_policy)),
+            )
+            rows = await cur.fetchall()
+        if with_ids:
+            return [{"id": msg_id, "role": role, "content": content} for role, content, msg_id in rows]
+        return [{"role": role, "content": content} for role, content, _ in rows]
+
+    async def append(self, session_id: str, messages: list[dict], *, role_policy: dict | None = None) -> None:
+        # AICODE-NOTE: Пишем в ветку вкладки из role_policy; повтор хода с тем же ключом идемпотентности — no-op
+        tab = self._tab(role_policy)
+        rows: list[tuple] = []
+        for m, key in zip(messages, idempotency_keys(messages)):
+            role = m.get("role", "assistant")
+            if role not in _ROLES:
+                role = "assistant"
+            content = m.get("content", "")
+            if isinstance(content, dict):
+                # Если пришла форма {"message": "..."} — извлекаем строку
+                content = content.get("message", "")
+            text = str(content)
+            if not text:
+                continue
+            rows.append((role, text, json.dumps(m.get("meta") or {}), key))
+        if not rows:
+            return
+        await self._ensure_open()
+        async with self.pool.connection() as conn:
+            thread_id = await self._thread_id(conn, session_id, tab)
+            if thread_id is None:
+                return
+            # Одна multi-row вставка на все сообщения шага
+            values_sql = ", ".join(["(%s::uuid, %s::message_role, %s, %s::jsonb, %s)"] * len(rows))
+            params: list[Any] = []
+            for row in rows:
+                params.extend((thread_id, *row))
+            try:
+                await conn.execute(
+                    f"""
+                    INSERT INTO chat_messages (thread_id, role, content, meta_json, idempotency_key) VALUES {values_sql}
+                    ON CONFLICT DO NOTHING
+                    """,
+                    params,
+                )
+            except Exception as e:
+                if pg_errors is None or not isinstance(e, pg_errors.ForeignKeyViolation):
+                    raise
+                # Ветку удалили вместе с сессией после того, как её id попал в кэш — писать некуда
+                self.forget_session(session_id)
+
+    async def set_kv(self, session_id: str, key: str, value: Any) -> None:
+        # AICODE-NOTE: KV сессии (конспект диалога и т.п.) — таблица agent_kv, значение в JSONB
+        if not _is_uuid(session_id):
+            return
+        await self._ensure_open()
+        async with self.pool.connection() as conn:
+            await conn.execute(
+                """
+                INSERT INTO agent_kv (session_id, key, value)
+                SELECT id, %s, %s::jsonb FROM track_sessions WHERE id = %s::uuid
+                ON CONFLICT (session_id, key) DO UPDATE SET value = EXCLUDED.value, updated_at = now()
+                """,
+                (key, json.dumps(value, ensure_ascii=False, default=str), session_id),
+            )
+
+    async def get_kv(self, session_id: str, key: str) -> Any:
+        if not _is_uuid(session_id):
+            return None
+        await self._ensure_open()
+        async with self.pool.connection() as conn:
+            cur = await conn.execute(
+                "SELECT value FROM agent_kv WHERE session_id = %s::uuid AND key = %s",
+                (session_id, key),
+            )
+            row = await cur.fetchone()
+        return row[0] if row else None
+
+    async def load_synopsis(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Текущая версия конспекта сессии `{version, items}` (источник для retrieval) или None."""
+        if not _is_uuid(session_id):
+            return None
+        await self._ensure_open()
+        async with self.pool.connection() as conn:
+            cur = await conn.execute(
+                """
+                SELECT sv.id::text, sv.items_json
+                FROM synopses s
+                JOIN synopsis_versions sv ON sv.id = s.current_version_id
+                WHERE s.session_id = %s::uuid
+                """,
+                (session_id,),
+            )
+            row = await cur.fetchone()
+        return {"version": row[0], "items": row[1] or []} if row else None
+
+
+__all__ = ["PostgresMemory"]
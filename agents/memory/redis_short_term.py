@@ -1,47 +1,171 @@
 """
-// AICODE-NOTE: Короткая память на Redis. Простая обёртка, безопасная по умолчанию.
+// AICODE-NOTE: Короткая память на Redis (redis.asyncio) — горячий уровень перед Postgres.
+
+- Ключи: история — список `chat:{session_id}:{tab}` (вкладка из `role_policy["tab"]`), KV — хэш `session:{session_id}`.
+- Список хранится в хронологическом порядке (RPUSH) и обрезается до `max_messages` (LTRIM); хвост истории —
+  `LRANGE -n -1`, ровно n элементов.
+- Чтение истории вместе с KV (`load_dialog_with_kv`) и запись (`append`) — одним пайплайном, один round trip.
+- Сессия истекает по TTL без активности (`AGENTS_REDIS_TTL`): каждое чтение/запись продлевает ключи.
+- Значения — msgpack (если установлен), иначе JSON; чтение понимает оба формата.
+- Один пул соединений на URL на процесс (`shared_pool`), закрывается `aclose_shared_pools()`.
 """
 
 from __future__ import annotations
 
-import os
 import json
-from typing import Any
+import os
+from typing import Any, Dict, Iterable, Optional, Tuple
 
 try:
-    import redis  # type: ignore
-except Exception as e:  # pragma: no cover
-    redis = None  # type: ignore
+    from redis import asyncio as redis_asyncio  # type: ignore
+except Exception:  # pragma: no cover - опциональная зависимость
+    redis_asyncio = None  # type: ignore
+
+try:
+    import msgpack  # type: ignore
+except Exception:  # pragma: no cover - опциональная зависимость
+    msgpack = None  # type: ignore
+
+from .base import history_limit
+
+
+_TABS = {"chat", "practice", "simulation"}
+_POOLS: Dict[str, Any] = {}
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+def shared_pool(url: Optional[str] = None) -> Any:
+    """Общий `ConnectionPool` процесса для URL (по умолчанию `REDIS_URL`)."""
+    if redis_asyncio is None:
+        raise RuntimeError("redis-py is not installed")
+    url = url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    pool = _POOLS.get(url)
+    if pool is None:
+        pool = redis_asyncio.ConnectionPool.from_url(url, max_connections=_env_int("REDIS_MAX_CONNECTIONS", 50))
+        _POOLS[url] = pool
+    return pool
+
+
+async def aclose_shared_pools() -> None:
+    for pool in list(_POOLS.values()):
+        try:
+            await pool.disconnect()
+        except Exception:
+            pass
+    _POOLS.clear()
+
+
+def _dumps(value: Any) -> bytes:
+    if msgpack is not None:
+        return msgpack.packb(value, use_bin_type=True, default=str)
+    return json.dumps(value, ensure_ascii=False, default=str).encode()
+
+
+def _loads(raw: Any) -> Any:
+    if raw is None:
+        return None
+    if msgpack is not None:
+        try:
+            return msgpack.unpackb(raw, raw=False)
+        except Exception:
+            pass  # записано в JSON (до установки msgpack)
+    return json.loads(raw)
 
 
 class RedisShortTerm:
-    def __init__(self, url: str | None = None, max_messages: int = 50) -> None:
-        if redis is None:
-            raise RuntimeError("redis-py is not installed")
-        self.client = redis.from_url(url or os.getenv("REDIS_URL", "redis://localhost:6379/0"))
-        self.max_messages = max_messages
+    """Последние `max_messages` сообщений каждой вкладки сессии + KV сессии в Redis.
+
+    - `client` — готовый `redis.asyncio.Redis` (тесты, своя конфигурация); иначе клиент на общем пуле `url`;
+    - `max_messages` (env `AGENTS_REDIS_MAX_MESSAGES`, 50) — сколько сообщений хранить на вкладку;
+    - `ttl` (env `AGENTS_REDIS_TTL`, 86400) — истечение сессии без активности, сек; 0 — без TTL.
+    """
+
+    def __init__(
+        self,
+        url: str | None = None,
+        max_messages: int | None = None,
+        *,
+        client: Any = None,
+        ttl: int | None = None,
+    ) -> None:
+        if client is None:
+            client = redis_asyncio.Redis(connection_pool=shared_pool(url))
+        self.client = client
+        self.max_messages = max_messages if max_messages is not None else _env_int("AGENTS_REDIS_MAX_MESSAGES", 50)
+        self.ttl = ttl if ttl is not None else _env_int("AGENTS_REDIS_TTL", 86400)
+
+    @staticmethod
+    def _tab(role_policy: dict | None) -> str:
+        tab = str((role_policy or {}).get("tab", "chat"))
+        return tab if tab in _TABS else "chat"
+
+    @staticmethod
+    def _chat_key(session_id: str, tab: str) -> str:
+        return f"chat:{session_id}:{tab}"
+
+    @staticmethod
+    def _kv_key(session_id: str) -> str:
+        return f"session:{session_id}"
+
+    def _limit(self, role_policy: dict | None) -> int:
+        limit = history_limit(role_policy)
+        return min(limit, self.max_messages) if limit else self.max_messages
+
+    def _touch(self, pipe: Any, *keys: str) -> None:
+        if self.ttl > 0:
+            for key in keys:
+                pipe.expire(key, self.ttl)
+
+    async def load_dialog_with_kv(
+        self, session_id: str, role_policy: dict, keys: Iterable[str]
+    ) -> Tuple[list[dict], Dict[str, Any]]:
+        """История вкладки и значения KV одним round trip."""
+        keys = list(keys)
+        chat_key = self._chat_key(session_id, self._tab(role_policy))
+        kv_key = self._kv_key(session_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.lrange(chat_key, -self._limit(role_policy), -1)
+        if keys:
+            pipe.hmget(kv_key, keys)
+        self._touch(pipe, chat_key, kv_key)
+        results = await pipe.execute()
+        dialog = [_loads(raw) for raw in results[0]]
+        values = results[1] if keys else []
+        return dialog, {k: _loads(v) for k, v in zip(keys, values)}
 
     async def load_dialog(self, session_id: str, role_policy: dict) -> list[dict]:
-        key = f"chat:{session_id}"
-        data = self.client.lrange(key, 0, self.max_messages)
-        return [json.loads(x) for x in data[::-1]]
-
-    async def append(self, session_id: str, messages: list[dict]) -> None:
-        key = f"chat:{session_id}"
-        pipe = self.client.pipeline()
-        for m in messages:
-            pipe.lpush(key, json.dumps(m))
-        pipe.ltrim(key, 0, self.max_messages - 1)
-        pipe.execute()
+        dialog, _ = await self.load_dialog_with_kv(session_id, role_policy, ())
+        return dialog
+
+    async def append(self, session_id: str, messages: list[dict], *, role_policy: dict | None = None) -> None:
+        if not messages:
+            return
+        chat_key = self._chat_key(session_id, self._tab(role_policy))
+        pipe = self.client.pipeline(transaction=False)
+        pipe.rpush(chat_key, *[_dumps(m) for m in messages])
+        pipe.ltrim(chat_key, -self.max_messages, -1)
+        self._touch(pipe, chat_key, self._kv_key(session_id))
+        await pipe.execute()
 
     async def set_kv(self, session_id: str, key: str, value: Any) -> None:
-        self.client.hset(f"session:{session_id}", key, json.dumps(value))
+        kv_key = self._kv_key(session_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hset(kv_key, key, _dumps(value))
+        self._touch(pipe, kv_key)
+        await pipe.execute()
 
     async def get_kv(self, session_id: str, key: str) -> Any:
-        raw = self.client.hget(f"session:{session_id}", key)
-        return json.loads(raw) if raw else None
-
+        return _loads(await self.client.hget(self._kv_key(session_id), key))
 
-__all__ = ["RedisShortTerm"]
+    async def aclose(self) -> None:
+        # Пул общий на процесс — закрывается `aclose_shared_pools()`
+        return None
 
 
+__all__ = ["RedisShortTerm", "aclose_shared_pools", "shared_pool"]
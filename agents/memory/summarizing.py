@@ -0,0 +1,232 @@
+"""
+// AICODE-NOTE: SummarizingMemory — декоратор памяти со скользящим конспектом старой части диалога.
+
+- В промпт уходят: конспект (system‑сообщение) + ещё не свёрнутые последние ходы.
+- Конспект хранится во внутренней памяти через `set_kv` по ключу `summary:{tab}`.
+- Обновление конспекта (LLM‑вызов) — только в фоне: через `scheduler` (в API — задача RQ
+  `summarize_dialog_job`), иначе `asyncio.create_task`. На пути запроса LLM не вызывается.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+logger = logging.getLogger("agents.memory.summarizing")
+
+# Планировщик фонового обновления: (session_id, role_policy) -> None | awaitable
+SummaryScheduler = Callable[[str, dict], Optional[Awaitable[None]]]
+
+# Якорь конспекта — отпечаток последних ANCHOR_SPAN свёрнутых сообщений (одно короткое «ок» неоднозначно)
+_ANCHOR_SPAN = 2
+# Не планировать повторное обновление той же ветки чаще, чем раз в N секунд
+_SCHEDULE_COOLDOWN_S = 60.0
+
+_DEFAULT_SYSTEM = (
+    "Ты ведёшь краткий конспект диалога студента с наставником. Сохраняй факты о студенте, его цели, "
+    "договорённости, открытые вопросы и ключевые выводы. Пиши сжато, по‑русски, без вступлений."
+)
+_DEFAULT_DEVELOPER = (
+    "Текущий конспект:\n{summary}\n\nНовые сообщения диалога:\n{dialog}\n\n"
+    "Обнови конспект с учётом новых сообщений. Верни только текст конспекта."
+)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+def _fingerprint(messages: list[dict]) -> str:
+    raw = json.dumps([(m.get("role"), m.get("content")) for m in messages], ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _split_at_anchor(window: list[dict], anchor: Optional[str]) -> Tuple[bool, list[dict]]:
+    """Найти якорь в окне истории: (найден ли, сообщения после якоря)."""
+    if anchor:
+        # Короче ANCHOR_SPAN якорь бывает только в самом начале ветки
+        for end in range(len(window), 0, -1):
+            if _fingerprint(window[max(end - _ANCHOR_SPAN, 0):end]) == anchor:
+                return True, window[end:]
+    return False, window
+
+
+def _prompt(prompt_id: str, default: str) -> str:
+    try:
+        from ..registry import get_prompt
+
+        return get_prompt(prompt_id)
+    except Exception:
+        return default
+
+
+class SummarizingMemory:
+    """Память с конспектом старых ходов поверх любой `BaseMemory`.
+
+    - `keep_recent` (env `AGENTS_SUMMARY_KEEP_RECENT`, 12) — сколько последних ходов всегда идут дословно;
+    - `threshold` (env `AGENTS_SUMMARY_THRESHOLD`, 20) — сколько несвёрнутых ходов сверх `keep_recent`
+      накапливается до фонового обновления конспекта;
+    - `llm` — клиент для обновления конспекта (нужен только там, где вызывается `refresh_summary`);
+    - `scheduler` — как поставить обновление в фон; по умолчанию `asyncio.create_task(refresh_summary(...))`.
+    """
+
+    def __init__(
+        self,
+        inner: Any,
+        *,
+        llm: Any = None,
+        model: Optional[str] = None,
+        keep_recent: Optional[int] = None,
+        threshold: Optional[int] = None,
+        scheduler: Optional[SummaryScheduler] = None,
+    ) -> None:
+        self.inner = inner
+        self.llm = llm
+        self.model = model or os.getenv("AGENTS_SUMMARY_MODEL") or os.getenv("AGENTS_DEFAULT_MODEL") or "gpt-4o-mini"
+        self.keep_recent = keep_recent if keep_recent is not None else _env_int("AGENTS_SUMMARY_KEEP_RECENT", 12)
+        self.threshold = threshold if threshold is not None else _env_int("AGENTS_SUMMARY_THRESHOLD", 20)
+        self.scheduler = scheduler
+        # Время последнего планирования по (session_id, tab), по возрастанию; старше кулдауна — удаляются
+        self._scheduled: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._tasks: set[asyncio.Task] = set()
+
+    @staticmethod
+    def _tab(role_policy: dict | None) -> str:
+        return str((role_policy or {}).get("tab", "chat"))
+
+    def _key(self, role_policy: dict | None) -> str:
+        return f"summary:{self._tab(role_policy)}"
+
+    async def load_dialog(self, session_id: str, role_policy: dict) -> list[dict]:
+        key = self._key(role_policy)
+        # Окно истории: несвёрнутый хвост до порога + запас, чтобы найти якорь даже при отстающем обновлении
+        window_policy = {**(role_policy or {}), "history_limit": self.keep_recent + 2 * self.threshold}
+        load_with_kv = getattr(self.inner, "load_dialog_with_kv", None)
+        if load_with_kv is not None:
+            # История и состояние конспекта — одним round trip (Redis‑пайплайн)
+            window, kv = await load_with_kv(session_id, window_policy, [key])
+            state = kv.get(key) or {}
+        else:
+            state = await self.inner.get_kv(session_id, key) or {}
+            window = await self.inner.load_dialog(session_id, window_policy)
+
+        found, pending = _split_at_anchor(window, state.get("anchor"))
+        if state.get("anchor") and not found:
+            # Якорь не в окне: неизвестно, какие ходы уже в конспекте — отдаём только свежий хвост
+            # (иначе свёрнутые ходы попали бы в промпт дважды), обновление конспекта догонит
+            pending = pending[-self.keep_recent:] if self.keep_recent > 0 else []
+            self._schedule(session_id, role_policy)
+        elif len(pending) > self.keep_recent + self.threshold:
+            self._schedule(session_id, role_policy)
+
+        summary = str(state.get("text") or "")
+        if not summary:
+            return pending
+        return [{"role": "system", "content": f"Краткое содержание предыдущей части диалога:\n{summary}"}] + pending
+
+    def _schedule(self, session_id: str, role_policy: dict) -> None:
+        key = (session_id, self._tab(role_policy))
+        now = time.monotonic()
+        if now - self._scheduled.get(key, float("-inf")) < _SCHEDULE_COOLDOWN_S:
+            return
+        # Записи с истёкшим кулдауном ничего не блокируют: словарь держит только сессии последней минуты
+        while self._scheduled:
+            oldest_key, at = next(iter(self._scheduled.items()))
+            if now - at < _SCHEDULE_COOLDOWN_S:
+                break
+            del self._scheduled[oldest_key]
+        self._scheduled[key] = now
+        self._scheduled.move_to_end(key)
+        try:
+            if self.scheduler is not None:
+                result = self.scheduler(session_id, dict(role_policy or {}))
+                if asyncio.iscoroutine(result):
+                    self._spawn(result)
+            else:
+                self._spawn(self.refresh_summary(session_id, role_policy))
+        except Exception:
+            logger.exception("failed to schedule summary refresh for %s", key)
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def refresh_summary(self, session_id: str, role_policy: dict | None = None) -> bool:
+        """Свернуть в конспект все несвёрнутые ходы, кроме последних `keep_recent`. Вызывается в фоне.
+
+        Возвращает True, если конспект обновлён.
+        """
+        if self.llm is None:
+            raise RuntimeError("SummarizingMemory.refresh_summary requires an llm")
+        role_policy = dict(role_policy or {})
+        key = self._key(role_policy)
+        state = await self.inner.get_kv(session_id, key) or {}
+
+        window = await self.inner.load_dialog(session_id, {**role_policy, "history_limit": self.keep_recent + 4 * self.threshold})
+        found, pending = _split_at_anchor(window, state.get("anchor"))
+        if state.get("anchor") and not found:
+            # Якорь вне окна — перечитываем всю ветку (редкий случай: долго не обновляли)
+            window = await self.inner.load_dialog(session_id, {**role_policy, "history_limit": 0})
+            found, pending = _split_at_anchor(window, state.get("anchor"))
+        fold = pending[: max(len(pending) - self.keep_recent, 0)]
+        if not fold:
+            return False
+
+        dialog = "\n".join(f"{m.get('role', 'user')}: {m.get('content', '')}" for m in fold)
+        messages = [
+            {"role": "system", "content": _prompt("memory.summary.system", _DEFAULT_SYSTEM)},
+            {
+                "role": "user",
+                "content": _prompt("memory.summary.developer", _DEFAULT_DEVELOPER).format(
+                    summary=state.get("text") or "(пока пусто)", dialog=dialog
+                ),
+            },
+        ]
+        response = await self.llm.chat(messages=messages, model=self.model)
+        text = response.result if isinstance(response.result, str) else str(response.result or "")
+        if not text.strip():
+            return False
+
+        # Якорь — последние свёрнутые сообщения (с учётом контекста до них, если fold короче span)
+        folded_until = len(window) - len(pending) + len(fold)
+        anchor = _fingerprint(window[max(folded_until - _ANCHOR_SPAN, 0):folded_until])
+        await self.inner.set_kv(
+            session_id,
+            key,
+            {"text": text.strip(), "anchor": anchor, "folded": int(state.get("folded", 0)) + len(fold), "updated_at": time.time()},
+        )
+        return True
+
+    async def append(self, session_id: str, messages: list[dict], *, role_policy: dict | None = None) -> None:
+        await self.inner.append(session_id, messages, role_policy=role_policy)
+
+    async def load_synopsis(self, session_id: str) -> Optional[Dict[str, Any]]:
+        load = getattr(self.inner, "load_synopsis", None)
+        return await load(session_id) if load is not None else None
+
+    async def set_kv(self, session_id: str, key: str, value: Any) -> None:
+        await self.inner.set_kv(session_id, key, value)
+
+    async def get_kv(self, session_id: str, key: str) -> Any:
+        return await self.inner.get_kv(session_id, key)
+
+    async def aclose(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        close = getattr(self.inner, "aclose", None)
+        if close is not None:
+            await close()
+
+
+__all__ = ["SummarizingMemory", "SummaryScheduler"]
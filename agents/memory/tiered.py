@@ -0,0 +1,197 @@
+"""
+// AICODE-NOTE: TieredMemory — двухуровневая память: горячий Redis (`RedisShortTerm`) + надёжный Postgres.
+
+- `load_dialog` читается из Redis. Ветка «прогрета» (маркер `chatwarm:{session}:{tab}`) — Postgres не трогаем.
+  Иначе read‑through: хвост из Postgres + ещё не сброшенные сообщения горячего уровня → прогрев Redis.
+- `append` не пишет в БД на пути запроса: сообщения (с заранее выданным `id`) одним пайплайном идут в список
+  вкладки и в очередь write‑behind `memory:writebehind`; сброс в `chat_messages` батчами делает задача воркера
+  `flush_memory_job` (идемпотентно по `id`). Первое сообщение после сброса ставит задачу (`scheduler`),
+  последующие в пределах `flush_delay` секунд — едут тем же батчем.
+- Повтор хода (тот же `idempotency_key`) в Redis не попадает: маркер `chatidem:{session}:{tab}:{key}` (SET NX)
+  отсекает запись в горячий список и очередь, иначе дубль ответа жил бы в промптах до перепрогрева ветки.
+- Сообщения, записанные в БД мимо агентов (POST user‑сообщений в API), добавляются в прогретую ветку через `record`.
+- KV и конспект — напрямую в Postgres (малый объём, редкие обращения).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .base import idempotency_keys
+from .redis_short_term import RedisShortTerm, _dumps, _loads
+
+
+logger = logging.getLogger("agents.memory.tiered")
+
+# AICODE-NOTE: Ключи очереди write‑behind — общие для API (производитель) и воркера (потребитель)
+WRITE_BEHIND_QUEUE = "memory:writebehind"
+WRITE_BEHIND_SCHEDULED = "memory:writebehind:scheduled"
+WRITE_BEHIND_LOCK = "memory:writebehind:lock"
+
+_ROLES = {"user", "assistant", "tool"}
+
+# Поставить сброс очереди write‑behind в фон (в API — задача RQ)
+FlushScheduler = Callable[[], Optional[Awaitable[None]]]
+
+
+def _public(m: dict) -> dict:
+    return {"role": m.get("role", "assistant"), "content": m.get("content", "")}
+
+
+def _normalize(messages: list[dict]) -> list[dict]:
+    """Как `PostgresMemory.append`: допустимая роль, текст из `{"message": ...}`, пустые — пропускаем."""
+    records: list[dict] = []
+    now = time.time()
+    for i, (m, key) in enumerate(zip(messages, idempotency_keys(messages))):
+        role = m.get("role", "assistant")
+        if role not in _ROLES:
+            role = "assistant"
+        content = m.get("content", "")
+        if isinstance(content, dict):
+            content = content.get("message", "")
+        text = str(content)
+        if not text:
+            continue
+        # ts — время записи (порядок в chat_messages), микросдвиг сохраняет порядок внутри шага
+        records.append(
+            {"id": str(uuid.uuid4()), "role": role, "content": text, "meta": m.get("meta") or {}, "ts": now + i * 1e-6, "idempotency_key": key}
+        )
+    return records
+
+
+class TieredMemory:
+    """Память «Redis спереди, Postgres сзади» с отложенной записью.
+
+    - `hot` — `RedisShortTerm` (его `max_messages`/`ttl` задают окно и жизнь горячей ветки);
+    - `durable` — `PostgresMemory` (read‑through, KV, конспект);
+    - `scheduler` — как поставить сброс очереди (обязателен: без воркера сообщения останутся в очереди);
+    - `flush_delay` (env `AGENTS_MEMORY_FLUSH_DELAY`, 1 c) — окно батчирования сброса.
+    """
+
+    def __init__(self, hot: RedisShortTerm, durable: Any, *, scheduler: FlushScheduler, flush_delay: Optional[int] = None) -> None:
+        self.hot = hot
+        self.durable = durable
+        self.scheduler = scheduler
+        self.flush_delay = flush_delay if flush_delay is not None else max(int(os.getenv("AGENTS_MEMORY_FLUSH_DELAY") or 1), 1)
+        self.stats: Dict[str, int] = {"hot_hits": 0, "read_through": 0, "queued": 0, "flush_scheduled": 0}
+        self._tasks: set[asyncio.Task] = set()
+
+    @staticmethod
+    def _warm_key(session_id: str, tab: str) -> str:
+        return f"chatwarm:{session_id}:{tab}"
+
+    @staticmethod
+    def _idem_key(session_id: str, tab: str, key: str) -> str:
+        return f"chatidem:{session_id}:{tab}:{key}"
+
+    async def _drop_seen(self, session_id: str, tab: str, records: list[dict]) -> list[dict]:
+        """Отбросить записи, чей `idempotency_key` уже был записан в эту ветку (повтор хода)."""
+        keyed = [r for r in records if r.get("idempotency_key")]
+        if not keyed:
+            return records
+        hot = self.hot
+        # Маркер живёт как горячая ветка (без TTL у ветки — сутки): дольше окна повторов клиента
+        ttl = hot.ttl if hot.ttl > 0 else 86400
+        pipe = hot.client.pipeline(transaction=False)
+        for r in keyed:
+            pipe.set(self._idem_key(session_id, tab, r["idempotency_key"]), b"1", nx=True, ex=ttl)
+        fresh = {r["id"] for r, ok in zip(keyed, await pipe.execute()) if ok}
+        return [r for r in records if not r.get("idempotency_key") or r["id"] in fresh]
+
+    async def load_dialog(self, session_id: str, role_policy: dict) -> list[dict]:
+        hot = self.hot
+        tab = hot._tab(role_policy)
+        chat_key, warm_key = hot._chat_key(session_id, tab), self._warm_key(session_id, tab)
+        limit = hot._limit(role_policy)
+
+        pipe = hot.client.pipeline(transaction=False)
+        pipe.lrange(chat_key, 0, -1)
+        pipe.exists(warm_key)
+        hot._touch(pipe, chat_key, warm_key)
+        raw, warm = (await pipe.execute())[:2]
+        cached = [_loads(x) for x in raw]
+        if warm:
+            self.stats["hot_hits"] += 1
+            return [_public(m) for m in cached[-limit:]]
+
+        # Read‑through: Postgres + сообщения, ещё не сброшенные write‑behind'ом
+        self.stats["read_through"] += 1
+        rows = await self.durable.load_dialog(session_id, {**(role_policy or {}), "history_limit": hot.max_messages}, with_ids=True)
+        known = {r["id"] for r in rows}
+        merged = (rows + [m for m in cached if m.get("id") not in known])[-hot.max_messages:]
+
+        pipe = hot.client.pipeline(transaction=True)
+        pipe.delete(chat_key)
+        if merged:
+            pipe.rpush(chat_key, *[_dumps(m) for m in merged])
+        pipe.set(warm_key, b"1", ex=hot.ttl if hot.ttl > 0 else None)
+        hot._touch(pipe, chat_key)
+        await pipe.execute()
+        return [_public(m) for m in merged[-limit:]]
+
+    async def append(self, session_id: str, messages: list[dict], *, role_policy: dict | None = None) -> None:
+        records = _normalize(messages)
+        if not records:
+            return
+        hot = self.hot
+        tab = hot._tab(role_policy)
+        chat_key = hot._chat_key(session_id, tab)
+        records = await self._drop_seen(session_id, tab, records)
+        if not records:
+            return
+
+        pipe = hot.client.pipeline(transaction=False)
+        pipe.rpush(chat_key, *[_dumps(r) for r in records])
+        pipe.ltrim(chat_key, -hot.max_messages, -1)
+        hot._touch(pipe, chat_key)
+        pipe.rpush(WRITE_BEHIND_QUEUE, *[_dumps({**r, "session_id": session_id, "tab": tab}) for r in records])
+        pipe.set(WRITE_BEHIND_SCHEDULED, b"1", nx=True, ex=self.flush_delay)
+        scheduled = (await pipe.execute())[-1]
+        self.stats["queued"] += len(records)
+        if scheduled:
+            self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        self.stats["flush_scheduled"] += 1
+        try:
+            result = self.scheduler()
+            if asyncio.iscoroutine(result):
+                task = asyncio.get_running_loop().create_task(result)
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        except Exception:
+            logger.exception("failed to schedule write-behind flush")
+
+    async def record(self, session_id: str, tab: str, message: dict) -> None:
+        """Сообщение уже записано в БД (с её `id`) — добавить в горячую ветку, если она прогрета."""
+        hot = self.hot
+        chat_key = hot._chat_key(session_id, tab)
+        if not await hot.client.exists(self._warm_key(session_id, tab)):
+            return  # холодная ветка прочитается из Postgres целиком
+        pipe = hot.client.pipeline(transaction=False)
+        pipe.rpush(chat_key, _dumps({"id": message.get("id"), "role": message.get("role"), "content": message.get("content")}))
+        pipe.ltrim(chat_key, -hot.max_messages, -1)
+        await pipe.execute()
+
+    async def set_kv(self, session_id: str, key: str, value: Any) -> None:
+        await self.durable.set_kv(session_id, key, value)
+
+    async def get_kv(self, session_id: str, key: str) -> Any:
+        return await self.durable.get_kv(session_id, key)
+
+    async def load_synopsis(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return await self.durable.load_synopsis(session_id)
+
+    async def aclose(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await self.hot.aclose()
+        await self.durable.aclose()
+
+
+__all__ = ["TieredMemory", "FlushScheduler", "WRITE_BEHIND_QUEUE", "WRITE_BEHIND_SCHEDULED", "WRITE_BEHIND_LOCK"]
@@ -0,0 +1,132 @@
+"""
+// AICODE-NOTE: Метрики запуска агента: время по фазам и токены LLM.
+
+- `RunMetrics` живёт в `RunContext.metrics` (раннер создаёт его на каждый запуск), поэтому слои ниже агента
+  (DialogueBuilder, память, LLM‑клиент) отмечают фазы без протаскивания объекта через сигнатуры:
+  `with phase("memory_load"): ...`. Вне запуска агента `phase()` ничего не делает.
+- Фазы: `memory_load`, `retrieval`, `prompt_build`, `llm`, `structured_parse`, `memory_append`, `side_effects`.
+  Фазы не вкладываются друг в друга; время вне фаз (логика агента, отдача событий) — `other_ms`.
+- Вызовы LLM — `with llm_call(model) as call: ...; call["usage"] = resp.usage`: фаза `llm`, токены из `usage`
+  ответа провайдера (последний чанк стрима), ошибки; итоги — всего и по моделям (`llm.by_model`).
+"""
+
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, Optional
+
+from .callbacks import callbacks
+from .context import current_run
+
+
+@dataclass
+class RunMetrics:
+    started: float = field(default_factory=time.perf_counter)
+    # фаза -> [суммарное время, мс; число входов]
+    phases: Dict[str, list] = field(default_factory=dict)
+    llm: Dict[str, int] = field(
+        default_factory=lambda: {"calls": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    )
+    # модель -> {calls, errors, ms, prompt_tokens, completion_tokens}
+    llm_by_model: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    # Время до первой дельты первого стримингового вызова LLM (от начала запуска)
+    first_token_ms: Optional[float] = None
+
+    def add(self, name: str, ms: float) -> None:
+        slot = self.phases.setdefault(name, [0.0, 0])
+        slot[0] += ms
+        slot[1] += 1
+
+    def add_llm_call(self, model: str, ms: float, usage: Any, *, error: bool = False) -> None:
+        """Учесть вызов LLM: `usage` — объект SDK или dict (может отсутствовать)."""
+        per_model = self.llm_by_model.setdefault(
+            model, {"calls": 0, "errors": 0, "ms": 0.0, "prompt_tokens": 0, "completion_tokens": 0}
+        )
+        self.llm["calls"] += 1
+        per_model["calls"] += 1
+        per_model["ms"] = round(per_model["ms"] + ms, 3)
+        if error:
+            self.llm["errors"] += 1
+            per_model["errors"] += 1
+        if usage is None:
+            return
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            value = usage.get(key) if isinstance(usage, dict) else getattr(usage, key, None)
+            if isinstance(value, int):
+                self.llm[key] += value
+                if key in per_model:
+                    per_model[key] += value
+
+    def mark_first_token(self) -> None:
+        if self.first_token_ms is None:
+            self.first_token_ms = round((time.perf_counter() - self.started) * 1000, 3)
+
+    def as_dict(self) -> Dict[str, Any]:
+        total_ms = (time.perf_counter() - self.started) * 1000
+        phases = {name: {"ms": round(ms, 3), "count": count} for name, (ms, count) in self.phases.items()}
+        accounted = sum(ms for ms, _ in self.phases.values())
+        return {
+            "total_ms": round(total_ms, 3),
+            "phases": phases,
+            "other_ms": round(max(total_ms - accounted, 0.0), 3),
+            "llm": {**self.llm, "by_model": {m: dict(v) for m, v in self.llm_by_model.items()}},
+            "first_token_ms": self.first_token_ms,
+        }
+
+
+def current_metrics() -> Optional[RunMetrics]:
+    ctx = current_run()
+    return ctx.metrics if ctx is not None else None
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Засечь фазу текущего запуска (no-op вне запуска)."""
+    metrics = current_metrics()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(name, (time.perf_counter() - started) * 1000)
+
+
+@contextmanager
+def llm_call(model: Optional[str]) -> Iterator[Dict[str, Any]]:
+    """Засечь вызов LLM: фаза `llm` + учёт вызова; в `call["usage"]` кладётся usage ответа.
+
+    Хуки `llm_start`/`llm_end` (agents/callbacks.py) срабатывают всегда, метрики — только внутри запуска.
+    """
+    run = current_run()
+    metrics = run.metrics if run is not None else None
+    model = model or "default"
+    call: Dict[str, Any] = {"usage": None}
+    callbacks.fire("llm_start", "llm", run=run, model=model)
+    started = time.perf_counter()
+    error: Optional[BaseException] = None
+    try:
+        yield call
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        ms = (time.perf_counter() - started) * 1000
+        if metrics is not None:
+            metrics.add("llm", ms)
+            metrics.add_llm_call(model, ms, call["usage"], error=error is not None)
+        callbacks.fire("llm_end", "llm", run=run, model=model, ms=ms, usage=call["usage"], error=error)
+
+
+def add_phase_ms(metrics: Dict[str, Any], name: str, ms: float) -> None:
+    """Дописать фазу в уже сериализованные метрики (`payload["metrics"]`) — для работы после `final_result`."""
+    slot = metrics.setdefault("phases", {}).setdefault(name, {"ms": 0.0, "count": 0})
+    slot["ms"] = round(slot["ms"] + ms, 3)
+    slot["count"] += 1
+    metrics["total_ms"] = round(metrics.get("total_ms", 0.0) + ms, 3)
+
+
+__all__ = ["RunMetrics", "add_phase_ms", "current_metrics", "llm_call", "phase"]
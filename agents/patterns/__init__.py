@@ -4,12 +4,13 @@
 """
 
 from .react import ReActAgentBase
-from .workflow import SequentialWorkflowAgentBase, LoopWorkflowAgentBase
+from .workflow import SequentialWorkflowAgentBase, LoopWorkflowAgentBase, DAGWorkflowAgentBase
 
 __all__ = [
     "ReActAgentBase",
     "SequentialWorkflowAgentBase",
     "LoopWorkflowAgentBase",
+    "DAGWorkflowAgentBase",
 ]
 
 
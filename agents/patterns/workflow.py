@@ -1,21 +1,44 @@
 """
-// AICODE-NOTE: Скелеты workflow‑агентов: последовательный и циклический.
+// AICODE-NOTE: Скелеты workflow‑агентов: последовательный, циклический и DAG (параллельные независимые шаги).
 // AICODE-NOTE: Каждый step — это отдельный агент (наследник AgentABC) со своей LLM и архитектурой.
+// AICODE-NOTE: События шагов пробрасываются наружу с префиксом `{step_id}/` (`plan/token`, `plan/final_result`),
+// результат шага — payload его `final_result`.
 """
 
 from __future__ import annotations
 
-from typing import Any, AsyncIterator
+import asyncio
+import os
+import time
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, Optional, Sequence
 
 from ..base import AgentABC, Event
 
 
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+async def _forward_step(agent: AgentABC, step_id: str, session_id: str, out: Dict[str, Any], **kwargs: Any) -> AsyncIterator[Event]:
+    """Стрим событий агента‑шага с префиксом `{step_id}/`; payload его `final_result` кладётся в `out["result"]`."""
+    out["result"] = {}
+    async with aclosing(agent.run_with_events(session_id=session_id, **kwargs)) as events:
+        async for ev in events:
+            if ev.event == "final_result":
+                out["result"] = ev.payload or {}
+            yield Event(event=f"{step_id}/{ev.event}", session_id=ev.session_id, trace_id=ev.trace_id, payload=ev.payload)
+
+
 class SequentialWorkflowAgentBase(AgentABC):
     """Выполняет набор шагов последовательно.
 
     steps: список кортежей (step_id, agent_instance).
-    Каждый агент шага получает общий контекст `**ctx` и возвращает свой результат `dict`.
-    Результаты шагов накапливаются в `history`.
+    Каждый агент шага получает общий контекст `**ctx` и `history`; его события стримятся как `{step_id}/{event}`,
+    результат шага (payload `final_result`) накапливается в `history`.
     """
 
     id = "sequential_workflow_base"
@@ -29,9 +52,11 @@ class SequentialWorkflowAgentBase(AgentABC):
         history: list[dict[str, Any]] = []
         for idx, (step_id, agent) in enumerate(self.steps, start=1):
             yield self.emit("workflow_step_start", session_id, payload={"step": idx, "id": step_id})
-            # AICODE-NOTE: Каждый step — агент. Вызываем его run() и получаем финальный результат шага.
-            result: Any = await agent.run(history=history, **ctx)
-            item = {"step": idx, "id": step_id, "result": result}
+            # AICODE-NOTE: Каждый step — агент. Пробрасываем его события и забираем финальный результат шага.
+            out: Dict[str, Any] = {}
+            async for ev in _forward_step(agent, step_id, session_id, out, history=history, **ctx):
+                yield ev
+            item = {"step": idx, "id": step_id, "result": out["result"]}
             history.append(item)
             yield self.emit("workflow_step_done", session_id, payload=item)
         yield self.emit("final_result", session_id, payload={"history": history})
@@ -40,7 +65,8 @@ class SequentialWorkflowAgentBase(AgentABC):
 class LoopWorkflowAgentBase(AgentABC):
     """Выполняет цикл шагов, пока check_fn не вернёт done=True или не достигнут max_steps.
 
-    plan_agent, act_agent, check_agent — агенты‑шаги, совместимые по контракту AgentABC.
+    plan_agent, act_agent, check_agent — агенты‑шаги, совместимые по контракту AgentABC; их события стримятся
+    как `plan/…`, `act/…`, `check/…`, результаты — payload их `final_result`.
     """
 
     id = "loop_workflow_base"
@@ -57,9 +83,16 @@ class LoopWorkflowAgentBase(AgentABC):
         history: list[dict[str, Any]] = []
         for step in range(self.max_steps):
             yield self.emit("loop_step_start", session_id, payload={"step": step + 1})
-            plan = await self.plan_agent.run(history=history, **ctx)
-            act = await self.act_agent.run(plan=plan, history=history, **ctx)
-            check = await self.check_agent.run(result=act, plan=plan, history=history, **ctx)
+            out: Dict[str, Any] = {}
+            async for ev in _forward_step(self.plan_agent, "plan", session_id, out, history=history, **ctx):
+                yield ev
+            plan = out["result"]
+            async for ev in _forward_step(self.act_agent, "act", session_id, out, plan=plan, history=history, **ctx):
+                yield ev
+            act = out["result"]
+            async for ev in _forward_step(self.check_agent, "check", session_id, out, result=act, plan=plan, history=history, **ctx):
+                yield ev
+            check = out["result"]
             item = {"step": step + 1, "plan": plan, "act": act, "check": check}
             history.append(item)
             yield self.emit("loop_step_done", session_id, payload=item)
@@ -69,6 +102,126 @@ class LoopWorkflowAgentBase(AgentABC):
         yield self.emit("final_result", session_id, payload={"history": history})
 
 
-__all__ = ["SequentialWorkflowAgentBase", "LoopWorkflowAgentBase"]
+class DAGWorkflowAgentBase(AgentABC):
+    """Выполняет шаги по графу зависимостей: независимые шаги — параллельно.
+
+    steps: список кортежей (step_id, agent_instance, depends_on) — `depends_on` перечисляет step_id,
+    результаты которых нужны шагу. Шаг стартует, как только готовы все его зависимости, и получает
+    в `history` их элементы (в порядке `depends_on`). Одновременно выполняется не больше
+    `max_concurrency` шагов (env `AGENTS_WORKFLOW_CONCURRENCY`, 4).
+
+    События шагов (`workflow_step_start`/`_done`/`_error`/`_cancelled` и события агентов‑шагов `{step_id}/{event}`)
+    идут вперемешку по мере выполнения.
+    Ошибка шага отменяет остальные (asyncio.TaskGroup) и пробрасывается из запуска как исходное исключение.
+    Латентность — критический путь графа, а не сумма шагов.
+    """
+
+    id = "dag_workflow_base"
+    version = "v1"
+
+    def __init__(
+        self,
+        memory,
+        steps: list[tuple[str, AgentABC, Sequence[str]]],
+        *,
+        max_concurrency: Optional[int] = None,
+        role_policy: dict | None = None,
+        meta: dict | None = None,
+    ):
+        super().__init__(memory, role_policy=role_policy, meta=meta)
+        self.steps = [(step_id, agent, tuple(deps)) for step_id, agent, deps in steps]
+        self.max_concurrency = max(
+            max_concurrency if max_concurrency is not None else _env_int("AGENTS_WORKFLOW_CONCURRENCY", 4), 1
+        )
+        self._validate()
+
+    def _validate(self) -> None:
+        ids = [step_id for step_id, _, _ in self.steps]
+        if len(set(ids)) != len(ids):
+            raise ValueError(f"duplicate workflow step ids: {ids}")
+        known = set(ids)
+        for step_id, _, deps in self.steps:
+            unknown = [d for d in deps if d not in known]
+            if unknown:
+                raise ValueError(f"workflow step {step_id!r} depends on unknown steps {unknown}")
+        # Топологическая проверка: если за проход ничего не разрешилось — цикл
+        resolved: set[str] = set()
+        pending = {step_id: set(deps) for step_id, _, deps in self.steps}
+        while pending:
+            ready = [step_id for step_id, deps in pending.items() if deps <= resolved]
+            if not ready:
+                raise ValueError(f"workflow steps form a cycle: {sorted(pending)}")
+            resolved.update(ready)
+            for step_id in ready:
+                del pending[step_id]
+
+    async def _run(self, *, session_id: str, **ctx) -> AsyncIterator[Event]:
+        queue: asyncio.Queue[Optional[Event]] = asyncio.Queue()
+        driver = asyncio.create_task(self._drive(session_id, queue, ctx))
+        driver.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while (ev := await queue.get()) is not None:
+                yield ev
+            try:
+                history = await driver
+            except BaseExceptionGroup as group:
+                raise _first_error(group) from None
+        finally:
+            # Потребитель прервал стрим (disconnect, aclose) — отменяем шаги, не оставляя висящих задач
+            if not driver.done():
+                driver.cancel()
+                try:
+                    await driver
+                except BaseException:
+                    pass
+        yield self.emit("final_result", session_id, payload={"history": history})
+
+    async def _drive(self, session_id: str, queue: "asyncio.Queue[Optional[Event]]", ctx: Dict[str, Any]) -> list[dict[str, Any]]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        done: dict[str, dict[str, Any]] = {}
+        history: list[dict[str, Any]] = []
+        started: set[str] = set()
+
+        async with asyncio.TaskGroup() as tg:
+
+            def schedule() -> None:
+                for idx, (step_id, agent, deps) in enumerate(self.steps, start=1):
+                    if step_id not in started and all(d in done for d in deps):
+                        started.add(step_id)
+                        tg.create_task(run_step(idx, step_id, agent, deps), name=f"workflow-step-{step_id}")
+
+            async def run_step(idx: int, step_id: str, agent: AgentABC, deps: tuple[str, ...]) -> None:
+                async with semaphore:
+                    queue.put_nowait(self.emit("workflow_step_start", session_id, payload={"step": idx, "id": step_id, "depends_on": list(deps)}))
+                    t0 = time.perf_counter()
+                    out: Dict[str, Any] = {}
+                    try:
+                        async for ev in _forward_step(agent, step_id, session_id, out, history=[done[d] for d in deps], **ctx):
+                            queue.put_nowait(ev)
+                    except asyncio.CancelledError:
+                        queue.put_nowait(self.emit("workflow_step_cancelled", session_id, payload={"step": idx, "id": step_id}))
+                        raise
+                    except Exception as exc:
+                        queue.put_nowait(self.emit("workflow_step_error", session_id, payload={"step": idx, "id": step_id, "error": repr(exc)}))
+                        raise
+                item = {"step": idx, "id": step_id, "result": out["result"]}
+                done[step_id] = item
+                history.append(item)
+                queue.put_nowait(self.emit("workflow_step_done", session_id, payload={**item, "ms": round((time.perf_counter() - t0) * 1000, 1)}))
+                schedule()
+
+            schedule()
+        return history
+
+
+def _first_error(group: BaseExceptionGroup) -> BaseException:
+    # TaskGroup оборачивает ошибки в ExceptionGroup; наружу отдаём первую исходную (как при последовательном запуске)
+    exc: BaseException = group
+    while isinstance(exc, BaseExceptionGroup):
+        exc = exc.exceptions[0]
+    return exc
+
+
+__all__ = ["SequentialWorkflowAgentBase", "LoopWorkflowAgentBase", "DAGWorkflowAgentBase"]
 
 
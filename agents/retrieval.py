@@ -0,0 +1,293 @@
+"""
+// AICODE-NOTE: Retrieval по конспекту сессии: в промпт идут только релевантные вопросу фрагменты, а не весь конспект.
+
+- `chunk_synopsis(items)` — режет элементы конспекта (`so_schema.py`: heading/text/definition/list/code/note)
+  на фрагменты; заголовок раздела не отдельный фрагмент, а контекст следующих за ним элементов.
+- `SynopsisRetriever` — индекс на сессию: эмбеддинги фрагментов (батчами) в `{dir}/{session}.npy` (float16,
+  читается через mmap) + `{session}.json` с текстами и отпечатком конспекта. Индекс пересобирается, только если
+  конспект изменился (отпечаток), а сверка с источником — не чаще раза в `recheck_s` секунд. Выселенный из LRU
+  (или оставшийся без конспекта) индекс удаляется вместе с файлами и lock'ом сессии.
+- Источник конспекта — `memory.load_synopsis(session_id)` (Postgres/Backend‑память); нет метода — нет retrieval.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .llm.embeddings import Embedder, get_embedder
+
+try:
+    import numpy as np  # type: ignore
+except Exception:  # pragma: no cover - опциональная зависимость
+    np = None  # type: ignore
+
+
+logger = logging.getLogger("agents.retrieval")
+
+# Источник конспекта: session_id -> {"items": [...]} | None
+SynopsisSource = Callable[[str], Awaitable[Optional[Dict[str, Any]]]]
+
+_FORMAT_VERSION = 1
+_EMBED_BATCH = 64
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+# ----------------------------------------------------------------------------
+# Нарезка конспекта
+# ----------------------------------------------------------------------------
+
+
+def _split_long(text: str, max_chars: int) -> List[str]:
+    """Разбить длинный текст по строкам/предложениям на куски не длиннее `max_chars` (примерно)."""
+    if len(text) <= max_chars:
+        return [text]
+    parts = re.split(r"(?<=\n)|(?<=[.!?])\s+", text)
+    chunks: List[str] = []
+    buf = ""
+    for part in parts:
+        if buf and len(buf) + len(part) > max_chars:
+            chunks.append(buf.strip())
+            buf = ""
+        buf += part if buf.endswith("\n") or not buf else " " + part
+    if buf.strip():
+        chunks.append(buf.strip())
+    return chunks
+
+
+def _render_item(item: Dict[str, Any]) -> str:
+    kind = item.get("type")
+    if kind == "definition":
+        return f"{item.get('term', '')} — {item.get('description', '')}".strip(" —")
+    if kind == "list":
+        return "\n".join(f"- {x}" for x in item.get("items") or [])
+    if kind == "code":
+        return f"```{item.get('language') or ''}\n{item.get('code', '')}\n```"
+    if kind == "note":
+        return f"Заметка: {item.get('text', '')}"
+    return str(item.get("text") or "")
+
+
+def chunk_synopsis(items: List[Dict[str, Any]], *, max_chars: int = 800) -> List[Dict[str, Any]]:
+    """Фрагменты конспекта: `{text, section, type, item}`; `item` — индекс исходного элемента."""
+    chunks: List[Dict[str, Any]] = []
+    section = ""
+    for i, item in enumerate(items or []):
+        if not isinstance(item, dict):
+            continue
+        if item.get("type") == "heading":
+            section = str(item.get("text") or "").strip()
+            continue
+        text = _render_item(item).strip()
+        if not text:
+            continue
+        for part in _split_long(text, max_chars):
+            chunks.append({"text": part, "section": section, "type": item.get("type") or "text", "item": i})
+    return chunks
+
+
+def _embed_text(chunk: Dict[str, Any]) -> str:
+    return f"{chunk['section']}. {chunk['text']}" if chunk.get("section") else chunk["text"]
+
+
+def _fingerprint(items: Any, embedder: Embedder) -> str:
+    raw = json.dumps({"v": _FORMAT_VERSION, "embedder": embedder.name, "items": items}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+# ----------------------------------------------------------------------------
+# Индекс
+# ----------------------------------------------------------------------------
+
+
+@dataclass
+class _SessionIndex:
+    fingerprint: str
+    vectors: Any  # (n, dim) float16, mmap
+    chunks: List[Dict[str, Any]]
+    checked_at: float
+
+
+class SynopsisRetriever:
+    """Top‑k фрагментов конспекта сессии по близости к запросу.
+
+    - `directory` (env `AGENTS_RETRIEVAL_DIR`, по умолчанию `$TMP/agents-retrieval`) — где лежат индексы;
+    - `recheck_s` (env `AGENTS_RETRIEVAL_RECHECK_S`, 10) — как часто сверять индекс с источником конспекта;
+    - `min_score` (env `AGENTS_RETRIEVAL_MIN_SCORE`, 0.2) — фрагменты ниже порога близости не отдаются;
+    - `max_sessions` (env `AGENTS_RETRIEVAL_CACHE`, 256) — сколько индексов держать открытыми (LRU).
+    """
+
+    def __init__(
+        self,
+        *,
+        embedder: Optional[Embedder] = None,
+        directory: Optional[str] = None,
+        recheck_s: Optional[float] = None,
+        min_score: Optional[float] = None,
+        max_sessions: Optional[int] = None,
+        max_chars: Optional[int] = None,
+    ) -> None:
+        self.embedder = embedder if embedder is not None else get_embedder()
+        self.directory = directory or os.getenv("AGENTS_RETRIEVAL_DIR") or os.path.join(tempfile.gettempdir(), "agents-retrieval")
+        self.recheck_s = recheck_s if recheck_s is not None else _env_float("AGENTS_RETRIEVAL_RECHECK_S", 10.0)
+        self.min_score = min_score if min_score is not None else _env_float("AGENTS_RETRIEVAL_MIN_SCORE", 0.2)
+        self.max_sessions = max_sessions if max_sessions is not None else _env_int("AGENTS_RETRIEVAL_CACHE", 256)
+        self.max_chars = max_chars if max_chars is not None else _env_int("AGENTS_RETRIEVAL_CHUNK_CHARS", 800)
+        self._indexes: "OrderedDict[str, _SessionIndex]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _paths(self, session_id: str) -> tuple[str, str]:
+        safe = re.sub(r"[^\w-]", "_", session_id)
+        return os.path.join(self.directory, f"{safe}.npy"), os.path.join(self.directory, f"{safe}.json")
+
+    def _remember(self, session_id: str, index: _SessionIndex) -> _SessionIndex:
+        self._indexes[session_id] = index
+        self._indexes.move_to_end(session_id)
+        while len(self._indexes) > self.max_sessions:
+            evicted, _ = self._indexes.popitem(last=False)
+            self._forget(evicted)
+        return index
+
+    def _forget(self, session_id: str) -> None:
+        """Убрать индекс сессии целиком: запись LRU, её lock и файлы на диске."""
+        self._indexes.pop(session_id, None)
+        lock = self._locks.get(session_id)
+        if lock is not None and not lock.locked():
+            del self._locks[session_id]
+        for path in self._paths(session_id):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.debug("cannot remove %s: %s", path, e)
+
+    def _load_from_disk(self, session_id: str) -> Optional[_SessionIndex]:
+        npy_path, meta_path = self._paths(session_id)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            vectors = np.load(npy_path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        if len(vectors) != len(meta.get("chunks", [])):
+            return None
+        return _SessionIndex(fingerprint=meta.get("fingerprint", ""), vectors=vectors, chunks=meta["chunks"], checked_at=0.0)
+
+    def _save_to_disk(self, session_id: str, fingerprint: str, vectors: Any, chunks: List[Dict[str, Any]]) -> Any:
+        npy_path, meta_path = self._paths(session_id)
+        os.makedirs(self.directory, exist_ok=True)
+        # Атомарная замена: читатели других процессов видят либо старый, либо новый индекс
+        tmp_npy = f"{npy_path}.{os.getpid()}.tmp"
+        with open(tmp_npy, "wb") as f:
+            np.save(f, vectors.astype(np.float16))
+        os.replace(tmp_npy, npy_path)
+        tmp_meta = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": fingerprint, "dim": int(vectors.shape[1]), "chunks": chunks}, f, ensure_ascii=False)
+        os.replace(tmp_meta, meta_path)
+        return np.load(npy_path, mmap_mode="r")
+
+    async def index(self, session_id: str, items: List[Dict[str, Any]]) -> _SessionIndex:
+        """Построить (или взять готовый) индекс для данного содержимого конспекта."""
+        fingerprint = _fingerprint(items, self.embedder)
+        current = self._indexes.get(session_id) or self._load_from_disk(session_id)
+        if current is not None and current.fingerprint == fingerprint:
+            current.checked_at = time.monotonic()
+            return self._remember(session_id, current)
+
+        chunks = chunk_synopsis(items, max_chars=self.max_chars)
+        texts = [_embed_text(c) for c in chunks]
+        batches = [await self.embedder.embed(texts[i:i + _EMBED_BATCH], passage=True) for i in range(0, len(texts), _EMBED_BATCH)]
+        vectors = np.concatenate(batches) if batches else np.zeros((0, self.embedder.dim), dtype=np.float32)
+        vectors = await asyncio.to_thread(self._save_to_disk, session_id, fingerprint, vectors, chunks)
+        logger.debug("synopsis index rebuilt for %s: %d chunks", session_id, len(chunks))
+        return self._remember(session_id, _SessionIndex(fingerprint, vectors, chunks, time.monotonic()))
+
+    async def _current(self, session_id: str, source: SynopsisSource) -> Optional[_SessionIndex]:
+        index = self._indexes.get(session_id)
+        if index is not None and time.monotonic() - index.checked_at < self.recheck_s:
+            self._indexes.move_to_end(session_id)
+            return index
+        lock = self._locks.setdefault(session_id, asyncio.Lock())
+        try:
+            async with lock:
+                index = self._indexes.get(session_id)
+                if index is not None and time.monotonic() - index.checked_at < self.recheck_s:
+                    return index
+                synopsis = await source(session_id)
+                items = (synopsis or {}).get("items") or []
+                if not items:
+                    self._forget(session_id)
+                    return None
+                return await self.index(session_id, items)
+        finally:
+            # Lock живёт, пока живёт запись индекса: сессии без конспекта (или выселенные) не копят locks
+            if session_id not in self._indexes and not lock.locked() and self._locks.get(session_id) is lock:
+                del self._locks[session_id]
+
+    async def retrieve(self, session_id: str, query: str, k: int, *, source: SynopsisSource) -> List[Dict[str, Any]]:
+        """До `k` фрагментов конспекта (в порядке конспекта) с полем `score`; [] — нет конспекта/эмбеддингов."""
+        if self.embedder is None or k <= 0 or not query.strip():
+            return []
+        index = await self._current(session_id, source)
+        if index is None or not index.chunks:
+            return []
+        q = (await self.embedder.embed([query]))[0]
+        sims = np.asarray(index.vectors, dtype=np.float32) @ q
+        top = np.argsort(-sims)[:k] if len(sims) <= k else np.argpartition(-sims, k)[:k]
+        picked = sorted(int(i) for i in top if sims[i] >= self.min_score)
+        return [{**index.chunks[i], "score": round(float(sims[i]), 4)} for i in picked]
+
+
+@lru_cache(maxsize=1)
+def get_retriever() -> Optional[SynopsisRetriever]:
+    """Процессный retriever; None — нет NumPy/эмбеддингов."""
+    if np is None or get_embedder() is None:
+        return None
+    return SynopsisRetriever()
+
+
+def retrieval_k(role_policy: dict | None) -> int:
+    """Сколько фрагментов конспекта добавлять: `role_policy["retrieval_k"]`, иначе env `AGENTS_RETRIEVAL_K` (4); 0 — выкл."""
+    raw = (role_policy or {}).get("retrieval_k")
+    if raw is None:
+        raw = os.getenv("AGENTS_RETRIEVAL_K") or "4"
+    try:
+        return max(int(raw), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def format_chunks(chunks: List[Dict[str, Any]]) -> str:
+    lines = ["Фрагменты конспекта студента, относящиеся к вопросу (опирайся на них, если уместно):"]
+    for n, c in enumerate(chunks, 1):
+        head = f"[{n}] {c['section']}: " if c.get("section") else f"[{n}] "
+        lines.append(head + c["text"])
+    return "\n".join(lines)
+
+
+__all__ = ["SynopsisRetriever", "chunk_synopsis", "format_chunks", "get_retriever", "retrieval_k"]
@@ -4,7 +4,21 @@
 
 from __future__ import annotations
 
-from pydantic import BaseModel
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from pydantic import BaseModel, Field
+
+from ..callbacks import callbacks
+from ..context import current_run
+from ..metrics import phase
+from ..retrieval import format_chunks, get_retriever, retrieval_k
+from .tokens import TOKENS_PER_REPLY, count_message_tokens
+
+
+logger = logging.getLogger("agents.roles.policy")
 
 
 class RolePolicy(BaseModel):
@@ -12,22 +26,135 @@ class RolePolicy(BaseModel):
     synthetic_user_between_steps: bool = False
     inject_system: bool = True
     assistant_name_by_step: bool = True
+    # Сколько последних сообщений истории грузить (None — env AGENTS_HISTORY_LIMIT, 0 — все)
+    history_limit: Optional[int] = None
+    # Бюджет промпта в токенах (None — env AGENTS_CONTEXT_BUDGET, 0 — без ограничения)
+    context_budget: Optional[int] = None
+    # Бюджеты по моделям: {"gpt-4o-mini": 16000, "gpt-4.1": 32000}; ключ — точное имя или префикс модели
+    context_budgets: Dict[str, int] = Field(default_factory=dict)
+    # Запас под ответ модели — вычитается из бюджета
+    reserve_tokens: int = 1024
+    # Сколько релевантных фрагментов конспекта добавлять в промпт (None — env AGENTS_RETRIEVAL_K, 0 — выкл.)
+    retrieval_k: Optional[int] = None
+
+
+def context_budget(role_policy: dict, model: Optional[str] = None) -> Optional[int]:
+    """Бюджет промпта для модели: `context_budgets` (точное имя, затем самый длинный префикс) →
+    `context_budget` → env `AGENTS_CONTEXT_BUDGET` (16000). `None` — без ограничения."""
+    budget = None
+    per_model = role_policy.get("context_budgets") or {}
+    if model and per_model:
+        if model in per_model:
+            budget = per_model[model]
+        else:
+            prefixes = [k for k in per_model if model.startswith(k)]
+            if prefixes:
+                budget = per_model[max(prefixes, key=len)]
+    if budget is None:
+        budget = role_policy.get("context_budget")
+    if budget is None:
+        budget = os.getenv("AGENTS_CONTEXT_BUDGET") or "16000"
+    try:
+        value = int(budget)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def _omission_note(count: int) -> dict:
+    return {"role": "system", "content": f"(Опущено более ранних сообщений диалога: {count} — не поместились в контекст.)"}
+
+
+def fit_history(prior: list[dict], *, available: int, model: Optional[str] = None) -> list[dict]:
+    """Оставить самые новые ходы истории, укладывающиеся в `available` токенов.
+
+    Системные сообщения истории (закреплённые) сохраняются всегда; вместо отброшенных
+    старых ходов ставится короткая пометка, чтобы модель знала о пропуске.
+    """
+    pinned = [m for m in prior if m.get("role") == "system"]
+    turns = [m for m in prior if m.get("role") != "system"]
+    costs = [count_message_tokens(m, model) for m in turns]
+    available -= sum(count_message_tokens(m, model) for m in pinned)
+    if sum(costs) <= available:
+        return pinned + turns
+
+    # Место под пометку о пропуске резервируем с запасом (максимально возможное число)
+    available -= count_message_tokens(_omission_note(len(turns)), model)
+    kept = 0
+    used = 0
+    for cost in reversed(costs):
+        if used + cost > available:
+            break
+        used += cost
+        kept += 1
+    dropped = len(turns) - kept
+    logger.debug("context trimmed: dropped %d of %d turns (budget %d tokens)", dropped, len(turns), available)
+    return pinned + [_omission_note(dropped)] + turns[len(turns) - kept:]
+
+
+async def _retrieved_context(memory, session_id: str, role_policy: dict, query: str) -> Optional[dict]:
+    """Релевантные запросу фрагменты конспекта сессии одним system‑сообщением (или None)."""
+    k = retrieval_k(role_policy)
+    load_synopsis = getattr(memory, "load_synopsis", None)
+    retriever = get_retriever() if k and load_synopsis is not None else None
+    if retriever is None:
+        return None
+    try:
+        chunks = await retriever.retrieve(session_id, query, k, source=load_synopsis)
+    except Exception:
+        # Retrieval — улучшение промпта, а не условие ответа
+        logger.warning("synopsis retrieval failed for %s", session_id, exc_info=True)
+        return None
+    return {"role": "system", "content": format_chunks(chunks)} if chunks else None
 
 
 class DialogueBuilder:
     @staticmethod
-    async def build(memory, session_id: str, role_policy: dict, step_name: str, system_text: str, developer_text: str):
-        messages: list[dict] = []
+    async def build(
+        memory,
+        session_id: str,
+        role_policy: dict,
+        step_name: str,
+        system_text: str,
+        developer_text: str,
+        model: Optional[str] = None,
+        query: Optional[str] = None,
+    ):
+        """Собрать промпт: system → [фрагменты конспекта] → история → текущий запрос.
+
+        История укладывается в бюджет токенов (`context_budget`, см. RolePolicy): системный промпт и текущий
+        запрос сохраняются всегда, из истории — самые новые ходы; старые заменяются пометкой о пропуске.
+        `query` — текст вопроса пользователя: по нему в промпт добавляются top‑k фрагментов конспекта
+        (`retrieval_k`), а не весь конспект.
+        """
+        head: list[dict] = []
         if role_policy.get("inject_system", True):
-            messages.append({"role": "system", "content": system_text})
+            head.append({"role": "system", "content": system_text})
+        if query:
+            with phase("retrieval"):
+                grounding = await _retrieved_context(memory, session_id, role_policy, query)
+            if grounding is not None:
+                head.append(grounding)
         # Историю сообщений загружаем ПЕРЕД текущим запросом, чтобы LLM учитывал контекст,
         # а затем добавляем текущий user-запрос последним.
-        prior = await memory.load_dialog(session_id, role_policy)
-        messages.extend(prior)
-        messages.append({"role": "user", "content": developer_text})
-        if role_policy.get("synthetic_user_between_steps", False):
-            messages.append({"role": "user", "content": f"continue:{step_name}"})
-        return messages
+        started = time.perf_counter()
+        with phase("memory_load"):
+            prior = await memory.load_dialog(session_id, role_policy)
+        callbacks.fire(
+            "memory_load", "memory",
+            run=current_run(), session_id=session_id, messages=len(prior), ms=(time.perf_counter() - started) * 1000,
+        )
+        with phase("prompt_build"):
+            tail: list[dict] = [{"role": "user", "content": developer_text}]
+            if role_policy.get("synthetic_user_between_steps", False):
+                tail.append({"role": "user", "content": f"continue:{step_name}"})
+
+            budget = context_budget(role_policy, model)
+            if budget is not None and prior:
+                reserve = int(role_policy.get("reserve_tokens", 1024))
+                fixed = sum(count_message_tokens(m, model) for m in head + tail) + TOKENS_PER_REPLY
+                prior = fit_history(prior, available=budget - reserve - fixed, model=model)
+        return head + prior + tail
 
 
 def to_openai_chat_messages(messages: list[dict]) -> list[dict]:
@@ -53,6 +180,6 @@ def to_openai_chat_messages(messages: list[dict]) -> list[dict]:
     return converted
 
 
-__all__ = ["RolePolicy", "DialogueBuilder", "to_openai_chat_messages"]
+__all__ = ["RolePolicy", "DialogueBuilder", "context_budget", "fit_history", "to_openai_chat_messages"]
 
 
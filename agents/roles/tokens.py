@@ -0,0 +1,104 @@
+"""
+// AICODE-NOTE: Подсчёт токенов для сборки контекста (бюджет промпта в DialogueBuilder).
+
+- Локальный токенизатор `tiktoken`, если установлен и словарь доступен; иначе — эвристика по символам.
+- Подсчёт кэшируется по тексту сообщения (LRU): история между ходами почти не меняется.
+- Словарь BPE tiktoken при первом обращении читается с диска или скачивается (синхронно). API грузит его
+  при старте (`preload_encodings` из `AgentContainer.warmup`); сбой загрузки запоминается — дальше эвристика.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+from functools import lru_cache
+from typing import Any, Iterable, Optional
+
+try:
+    import tiktoken  # type: ignore
+except Exception:  # pragma: no cover - опциональная зависимость
+    tiktoken = None  # type: ignore
+
+
+logger = logging.getLogger("agents.roles.tokens")
+
+# Служебные токены chat‑формата на сообщение и на «затравку» ответа (оценка OpenAI для gpt‑4o‑семейства)
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+_FALLBACK_ENCODING = "o200k_base"
+
+# Словарь не загрузился (нет файла и сети, таймаут прогрева) — не пробуем снова на каждом запросе
+_unavailable = False
+
+
+def disable_encodings(reason: str) -> None:
+    """Перейти на эвристику до конца жизни процесса."""
+    global _unavailable
+    if not _unavailable:
+        logger.warning("tiktoken encodings are unavailable (%s): counting tokens heuristically", reason)
+    _unavailable = True
+
+
+@lru_cache(maxsize=32)
+def _encoding(model: Optional[str]) -> Any:
+    """tiktoken‑кодировка для модели; `None` — считать эвристикой."""
+    if tiktoken is None or _unavailable:
+        return None
+    try:
+        name = tiktoken.encoding_name_for_model(model or "")
+    except KeyError:
+        name = _FALLBACK_ENCODING
+    except Exception:
+        return None
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        # Нет словаря локально и нет сети — работаем эвристикой
+        disable_encodings(repr(e))
+        return None
+
+
+def preload_encodings(models: Iterable[Optional[str]]) -> bool:
+    """Загрузить кодировки моделей заранее (блокирующий вызов — из потока). False — работаем эвристикой."""
+    for model in models:
+        _encoding(model)
+    return tiktoken is not None and not _unavailable
+
+
+@lru_cache(maxsize=8192)
+def _count_text(text: str, model: Optional[str]) -> int:
+    enc = _encoding(model)
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    # Эвристика: ~4 символа на токен для латиницы, кириллица плотнее — берём 3 с запасом
+    return math.ceil(len(text) / 3)
+
+
+def _as_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    return json.dumps(content, ensure_ascii=False, default=str)
+
+
+def count_tokens(text: Any, model: Optional[str] = None) -> int:
+    return _count_text(_as_text(text), model)
+
+
+def count_message_tokens(message: dict, model: Optional[str] = None) -> int:
+    """Токены одного chat‑сообщения с учётом служебной разметки (роль, name)."""
+    tokens = TOKENS_PER_MESSAGE + count_tokens(message.get("content", ""), model)
+    name = message.get("name")
+    if isinstance(name, str) and name:
+        tokens += 1 + count_tokens(name, model)
+    return tokens
+
+
+__all__ = [
+    "TOKENS_PER_MESSAGE",
+    "TOKENS_PER_REPLY",
+    "count_tokens",
+    "count_message_tokens",
+    "disable_encodings",
+    "preload_encodings",
+]
@@ -6,12 +6,19 @@ from __future__ import annotations
 
 from typing import AsyncIterator
 
-from .base import Event
+from .base import Event, is_token_event
 from .callbacks import callbacks
+from .context import RunContext, run_context
+from .metrics import RunMetrics
 from .tracing import Trace
 
 
 async def run_agent_with_events(agent, /, **payload) -> AsyncIterator[Event]:
+    # Служебные ключи запуска (не передаются агенту): область кэшей, обход кэшей, идемпотентность и запись в историю
+    cache_scope = payload.pop("cache_scope", None)
+    no_cache = bool(payload.pop("no_cache", False))
+    idempotency_key = payload.pop("idempotency_key", None)
+    persist = bool(payload.pop("persist", True))
     # AICODE-NOTE: Сохраняем информацию о типе LLM и модели в payload трейса (без сериализации объекта LLM)
     llm_type = type(getattr(agent, "llm", None)).__name__ if getattr(agent, "llm", None) is not None else None
     model_name = None
@@ -26,19 +33,43 @@ async def run_agent_with_events(agent, /, **payload) -> AsyncIterator[Event]:
         version=getattr(agent, "version", "unknown"),
         payload=trace_payload,
     )
-    try:
-        callbacks.fire("before", "agent", trace=trace, agent=agent, payload=payload)
-        async for ev in agent.run_with_events(**payload):
-            # Сохраняем событие в трейс и отдаём наружу
-            Trace.event(trace, ev)
-            yield ev
-        callbacks.fire("after", "agent", trace=trace, agent=agent, payload=payload)
-        Trace.finish(trace, status="success")
-    except Exception as e:  # pragma: no cover - ошибки пробрасываем, но формируем событие
-        err = Event(event="error", session_id=payload.get("session_id", ""), trace_id=str(trace.id), payload={"message": str(e)})
-        Trace.event(trace, err)
-        Trace.finish(trace, status="error")
-        yield err
+    user_message = payload.get("user_message")
+    ctx = RunContext(
+        agent_id=trace.entity_id,
+        version=trace.version,
+        session_id=str(payload.get("session_id", "")),
+        trace_id=str(trace.id),
+        scope=str(cache_scope) if cache_scope else None,
+        query_text=(user_message.strip() or None) if isinstance(user_message, str) else None,
+        bypass_cache=no_cache,
+        idempotency_key=str(idempotency_key) if idempotency_key else None,
+        persist=persist,
+        metrics=RunMetrics(),
+    )
+    with run_context(ctx):
+        try:
+            callbacks.fire("before", "agent", trace=trace, agent=agent, payload=payload)
+            async for ev in agent.run_with_events(**payload):
+                if ev.event == "final_result" and isinstance(ev.payload, dict):
+                    # Метрики запуска (фазы, токены) — в финальном событии, на момент его отдачи
+                    ev = Event(event=ev.event, session_id=ev.session_id, trace_id=ev.trace_id, payload={**ev.payload, "metrics": ctx.metrics.as_dict()})
+                # Сохраняем событие в трейс и отдаём наружу; дельты токенов в трейс не пишем — только стримим
+                if not is_token_event(ev.event):
+                    Trace.event(trace, ev)
+                callbacks.fire("event", "agent", trace=trace, agent=agent, event=ev)
+                yield ev
+            callbacks.fire("after", "agent", trace=trace, agent=agent, payload=payload)
+            if ctx.cache:
+                trace.payload["cache"] = ctx.cache
+            # В трейсе — полные метрики, включая то, что выполнилось после final_result (побочные эффекты)
+            trace.payload["metrics"] = ctx.metrics.as_dict()
+            Trace.finish(trace, status="success")
+        except Exception as e:  # pragma: no cover - ошибки пробрасываем, но формируем событие
+            err = Event(event="error", session_id=payload.get("session_id", ""), trace_id=str(trace.id), payload={"message": str(e)})
+            Trace.event(trace, err)
+            trace.payload["metrics"] = ctx.metrics.as_dict()
+            Trace.finish(trace, status="error")
+            yield err
 
 
 __all__ = ["run_agent_with_events"]
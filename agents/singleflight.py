@@ -0,0 +1,308 @@
+"""
+// AICODE-NOTE: Single-flight для запусков агентов: одинаковые конкурентные запросы присоединяются к одному запуску.
+
+- Ключ — агент/версия/сессия/хэш запроса (`run_key`). Первый запрос ведёт запуск, дубликаты получают
+  тот же поток событий (с начала: уже выданные события проигрываются из буфера).
+- В процессе — общий буфер событий и Condition. Между репликами API — Redis: лидер берёт лок `SET NX PX`
+  и публикует события в Redis Stream, реплики‑последователи читают его `XREAD BLOCK`.
+- Если лидер‑реплика пропала (лок истёк без события конца) или Redis недоступен — запуск выполняется локально;
+  если последователи уже получили часть событий лидера — поток завершается событием `error` (без повторного запуска).
+- Запуск идёт в фоновой задаче: отключение одного клиента не прерывает генерацию для остальных.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from .base import Event
+from .runner import run_agent_with_events
+
+try:
+    from redis import asyncio as redis_asyncio  # type: ignore
+except Exception:  # pragma: no cover - опциональная зависимость
+    redis_asyncio = None  # type: ignore
+
+
+logger = logging.getLogger("agents.singleflight")
+
+EventFactory = Callable[[], AsyncIterator[Event]]
+
+
+def run_key(agent_id: str, version: str, session_id: str, payload: Dict[str, Any]) -> str:
+    raw = json.dumps(
+        {"agent": agent_id, "version": version, "session": session_id, "payload": payload},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return f"{agent_id}:{version}:" + hashlib.sha256(raw.encode()).hexdigest()
+
+
+class _Flight:
+    """Буфер событий одного запуска + ожидание новых событий подписчиками."""
+
+    def __init__(self) -> None:
+        self.events: List[Event] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._cond = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+    async def push(self, ev: Event) -> None:
+        async with self._cond:
+            self.events.append(ev)
+            self._cond.notify_all()
+
+    async def finish(self, error: Optional[BaseException] = None) -> None:
+        async with self._cond:
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Event]:
+        i = 0
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: i < len(self.events) or self.done)
+                batch = self.events[i:]
+                done, error = self.done, self.error
+            i += len(batch)
+            for ev in batch:
+                yield ev
+            if done and i >= len(self.events):
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    """Коалесинг одинаковых запусков.
+
+    - `redis` — клиент `redis.asyncio` для координации реплик; `None` — только в процессе;
+    - `lock_ttl_ms` — TTL лока лидера (продлевается, пока запуск идёт);
+    - `stream_ttl_s` — сколько живёт Redis Stream после последнего события.
+    """
+
+    def __init__(self, *, redis: Any = None, prefix: str = "sf:", lock_ttl_ms: int = 15_000, stream_ttl_s: int = 60) -> None:
+        self.redis = redis
+        self.prefix = prefix
+        self.lock_ttl_ms = lock_ttl_ms
+        self.stream_ttl_s = stream_ttl_s
+        self._flights: Dict[str, _Flight] = {}
+        self.stats: Dict[str, int] = {"leader": 0, "joined_local": 0, "joined_remote": 0, "fallback_local": 0, "leader_lost": 0}
+
+    async def stream(self, key: str, factory: EventFactory) -> AsyncIterator[Event]:
+        """События запуска `factory()` по ключу; конкурентные вызовы с тем же ключом делят один запуск."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.get_running_loop().create_task(self._drive(key, flight, factory))
+        else:
+            self.stats["joined_local"] += 1
+        async for ev in flight.subscribe():
+            yield ev
+
+    async def run_agent(self, agent: Any, /, *, flight_key: Optional[str] = None, **payload: Any) -> AsyncIterator[Event]:
+        """`run_agent_with_events` с коалесингом по (агент, версия, session_id, payload); `flight_key` — свой ключ."""
+        key = flight_key
+        if key is None:
+            # Тип памяти — в ключ: один и тот же запрос с inmem и postgres — разные запуски
+            key_payload = {**payload, "memory": type(getattr(agent, "memory", None)).__name__}
+            key = run_key(getattr(agent, "id", "unknown"), getattr(agent, "version", "unknown"), str(payload.get("session_id", "")), key_payload)
+        async for ev in self.stream(key, lambda: run_agent_with_events(agent, **payload)):
+            yield ev
+
+    async def aclose(self) -> None:
+        for flight in list(self._flights.values()):
+            if flight.task is not None:
+                flight.task.cancel()
+        if self.redis is not None:
+            try:
+                await self.redis.aclose()
+            except Exception:
+                pass
+
+    # ------------------------------------------------------------------
+    # Выполнение запуска: локально или следуя за лидером на другой реплике
+    # ------------------------------------------------------------------
+
+    async def _drive(self, key: str, flight: _Flight, factory: EventFactory) -> None:
+        try:
+            if self.redis is None:
+                self.stats["leader"] += 1
+                await self._run_local(flight, factory, publish=None)
+            else:
+                await self._drive_shared(key, flight, factory)
+            await flight.finish()
+        except BaseException as e:
+            await flight.finish(e if isinstance(e, Exception) else RuntimeError("single-flight run cancelled"))
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    async def _drive_shared(self, key: str, flight: _Flight, factory: EventFactory) -> None:
+        flight_id = uuid.uuid4().hex
+        role = await self._acquire_or_follow(key, flight_id)
+        if role is None:
+            self.stats["fallback_local"] += 1
+            await self._run_local(flight, factory, publish=None)
+        elif role == flight_id:
+            self.stats["leader"] += 1
+            await self._lead(key, flight_id, flight, factory)
+        else:
+            self.stats["joined_remote"] += 1
+            if not await self._follow(key, role, flight):
+                if not flight.events:
+                    # Лидер пропал, ничего не выдав, — выполняем сами
+                    self.stats["fallback_local"] += 1
+                    await self._run_local(flight, factory, publish=None)
+                    return
+                # Часть событий уже у подписчиков: повторный запуск дал бы второй start_agent/токены/final_result.
+                # Завершаем поток ошибкой, как раннер при сбое запуска.
+                self.stats["leader_lost"] += 1
+                head = flight.events[0]
+                await flight.push(
+                    Event(event="error", session_id=head.session_id, trace_id=head.trace_id, payload={"message": "single-flight leader lost mid-stream"})
+                )
+
+    async def _run_local(self, flight: _Flight, factory: EventFactory, publish: Optional[Callable[[Dict[str, str]], Any]]) -> None:
+        async for ev in factory():
+            await flight.push(ev)
+            if publish is not None:
+                await publish({"e": ev.model_dump_json()})
+
+    def _lock_key(self, key: str) -> str:
+        return f"{self.prefix}lock:{key}"
+
+    def _stream_key(self, key: str, flight_id: str) -> str:
+        return f"{self.prefix}stream:{key}:{flight_id}"
+
+    async def _acquire_or_follow(self, key: str, flight_id: str) -> Optional[str]:
+        """Вернуть свой `flight_id`, если стали лидером, id чужого запуска — если он уже идёт, `None` — Redis недоступен."""
+        lock = self._lock_key(key)
+        try:
+            for _ in range(3):
+                if await self.redis.set(lock, flight_id, nx=True, px=self.lock_ttl_ms):
+                    return flight_id
+                current = await self.redis.get(lock)
+                if current is not None:
+                    return current.decode() if isinstance(current, bytes) else str(current)
+                # Лидер только что закончил и снял лок — пробуем снова
+        except Exception:
+            logger.warning("single-flight: Redis unavailable, running locally", exc_info=True)
+        return None
+
+    async def _lead(self, key: str, flight_id: str, flight: _Flight, factory: EventFactory) -> None:
+        lock = self._lock_key(key)
+        stream = self._stream_key(key, flight_id)
+        redis_ok = True
+
+        async def publish(fields: Dict[str, str]) -> None:
+            nonlocal redis_ok
+            if not redis_ok:
+                return
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.xadd(stream, fields, maxlen=10_000, approximate=True)
+                pipe.expire(stream, self.stream_ttl_s)
+                await pipe.execute()
+            except Exception:
+                # Последователи увидят истёкший лок и выполнят запуск сами
+                redis_ok = False
+                logger.warning("single-flight: publish to Redis failed", exc_info=True)
+
+        async def keepalive() -> None:
+            while True:
+                await asyncio.sleep(self.lock_ttl_ms / 3000)
+                try:
+                    await self.redis.pexpire(lock, self.lock_ttl_ms)
+                except Exception:
+                    pass
+
+        refresher = asyncio.get_running_loop().create_task(keepalive())
+        try:
+            await self._run_local(flight, factory, publish=publish)
+            await publish({"end": "1"})
+        except Exception as e:
+            await publish({"error": str(e)})
+            raise
+        finally:
+            refresher.cancel()
+            try:
+                current = await self.redis.get(lock)
+                if current is not None and (current.decode() if isinstance(current, bytes) else str(current)) == flight_id:
+                    await self.redis.delete(lock)
+            except Exception:
+                pass
+
+    async def _follow(self, key: str, flight_id: str, flight: _Flight) -> bool:
+        """Проиграть поток лидера с другой реплики. False — лидер пропал до конца потока."""
+        lock = self._lock_key(key)
+        stream = self._stream_key(key, flight_id)
+        last_id = "0-0"
+        while True:
+            try:
+                resp = await self.redis.xread({stream: last_id}, count=100, block=1000)
+            except Exception:
+                logger.warning("single-flight: reading leader stream failed", exc_info=True)
+                return False
+            if not resp:
+                # Нет новых событий: жив ли лидер?
+                try:
+                    if not await self.redis.exists(lock):
+                        # Лок снят — возможно, поток уже дописан; дочитываем без ожидания
+                        tail = await self.redis.xread({stream: last_id}, count=1000)
+                        if not tail:
+                            return False
+                        resp = tail
+                    else:
+                        continue
+                except Exception:
+                    return False
+            for _stream, entries in resp:
+                for entry_id, fields in entries:
+                    last_id = entry_id
+                    data = {(k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v) for k, v in fields.items()}
+                    if "e" in data:
+                        await flight.push(Event.model_validate_json(data["e"]))
+                    elif "error" in data:
+                        raise RuntimeError(data["error"])
+                    elif "end" in data:
+                        return True
+
+
+_DEFAULT: Optional[SingleFlight] = None
+
+
+def get_singleflight() -> SingleFlight:
+    """Процессный экземпляр: с Redis, если задан `REDIS_URL` и не выключен `AGENTS_SINGLEFLIGHT_REDIS=0`."""
+    global _DEFAULT
+    if _DEFAULT is None:
+        redis = None
+        if (
+            redis_asyncio is not None
+            and os.getenv("REDIS_URL")
+            and os.getenv("AGENTS_SINGLEFLIGHT_REDIS", "1") not in {"0", "false", "False", "no"}
+        ):
+            redis = redis_asyncio.Redis.from_url(os.environ["REDIS_URL"], socket_connect_timeout=0.5)
+        _DEFAULT = SingleFlight(redis=redis)
+    return _DEFAULT
+
+
+async def aclose_singleflight() -> None:
+    global _DEFAULT
+    if _DEFAULT is not None:
+        await _DEFAULT.aclose()
+        _DEFAULT = None
+
+
+__all__ = ["SingleFlight", "get_singleflight", "aclose_singleflight", "run_key"]
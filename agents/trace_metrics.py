@@ -0,0 +1,101 @@
+"""
+// AICODE-NOTE: PrometheusTraceSink — метрики запусков агентов и вызовов LLM для Prometheus.
+
+- Источник — итог запуска: `trace.payload["metrics"]` (см. agents/metrics.py), который раннер кладёт в трейс
+  на `final_result` и на ошибке. Сам приёмник ничего не замеряет и на пути запуска только обновляет счётчики.
+- Метрики (метки `agent`, `model`):
+  `agents_runs_total{agent,status}`, `agents_run_seconds{agent}`, `agents_first_token_seconds{agent}`,
+  `agents_phase_seconds{agent,phase}`, `agents_llm_calls_total{agent,model}`, `agents_llm_errors_total{agent,model}`,
+  `agents_llm_seconds{agent,model}` (суммарное время LLM за запуск), `agents_llm_tokens_total{agent,model,kind}`.
+- `prometheus_client` — опциональная зависимость: без неё `install_trace_metrics()` возвращает False.
+- Реестр — общий процессный (`prometheus_client.REGISTRY`); в воркере с форком — multiprocess‑режим
+  (`PROMETHEUS_MULTIPROC_DIR`, см. backend/worker/metrics.py).
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+
+try:
+    import prometheus_client  # type: ignore
+    from prometheus_client import Counter, Histogram  # type: ignore
+except Exception:  # pragma: no cover - опциональная зависимость
+    prometheus_client = None  # type: ignore
+
+from .tracing import Trace
+
+
+# Запуски агентов — от долей секунды (кэш) до минут (цепочки LLM)
+_RUN_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+class PrometheusTraceSink:
+    """Приёмник `Trace`, переводящий итоговые метрики запуска в счётчики и гистограммы Prometheus."""
+
+    def __init__(self, registry: Any = None) -> None:
+        if prometheus_client is None:
+            raise RuntimeError("prometheus_client is not installed")
+        kwargs: Dict[str, Any] = {"registry": registry} if registry is not None else {}
+        self.runs = Counter("agents_runs_total", "Agent runs by final status", ["agent", "status"], **kwargs)
+        self.run_seconds = Histogram(
+            "agents_run_seconds", "Agent run duration", ["agent"], buckets=_RUN_BUCKETS, **kwargs
+        )
+        self.first_token_seconds = Histogram(
+            "agents_first_token_seconds", "Time from run start to first streamed LLM token", ["agent"],
+            buckets=_RUN_BUCKETS, **kwargs,
+        )
+        self.phase_seconds = Histogram(
+            "agents_phase_seconds", "Time spent in a run phase (per run)", ["agent", "phase"],
+            buckets=_RUN_BUCKETS, **kwargs,
+        )
+        self.llm_calls = Counter("agents_llm_calls_total", "LLM calls", ["agent", "model"], **kwargs)
+        self.llm_errors = Counter("agents_llm_errors_total", "Failed LLM calls", ["agent", "model"], **kwargs)
+        self.llm_seconds = Histogram(
+            "agents_llm_seconds", "LLM time per run and model", ["agent", "model"], buckets=_RUN_BUCKETS, **kwargs
+        )
+        self.llm_tokens = Counter("agents_llm_tokens_total", "LLM tokens", ["agent", "model", "kind"], **kwargs)
+
+    def trace_started(self, trace: Trace) -> None:
+        return None
+
+    def trace_event(self, trace: Trace, ev: Any) -> None:
+        return None
+
+    def trace_finished(self, trace: Trace) -> None:
+        agent = trace.entity_id
+        self.runs.labels(agent, trace.status).inc()
+        if trace.duration_ms is not None:
+            self.run_seconds.labels(agent).observe(trace.duration_ms / 1000)
+        metrics: Optional[Dict[str, Any]] = trace.payload.get("metrics")
+        if not isinstance(metrics, dict):
+            return
+        if metrics.get("first_token_ms") is not None:
+            self.first_token_seconds.labels(agent).observe(metrics["first_token_ms"] / 1000)
+        for name, value in (metrics.get("phases") or {}).items():
+            self.phase_seconds.labels(agent, name).observe(value.get("ms", 0.0) / 1000)
+        for model, value in ((metrics.get("llm") or {}).get("by_model") or {}).items():
+            self.llm_calls.labels(agent, model).inc(value.get("calls", 0))
+            if value.get("errors"):
+                self.llm_errors.labels(agent, model).inc(value["errors"])
+            self.llm_seconds.labels(agent, model).observe(value.get("ms", 0.0) / 1000)
+            for kind in ("prompt", "completion"):
+                tokens = value.get(f"{kind}_tokens") or 0
+                if tokens:
+                    self.llm_tokens.labels(agent, model, kind).inc(tokens)
+
+
+_SINK: Optional[PrometheusTraceSink] = None
+
+
+def install_trace_metrics() -> bool:
+    """Подключить процессный `PrometheusTraceSink` к `Trace` (идемпотентно); False — нет prometheus_client."""
+    global _SINK
+    if prometheus_client is None:
+        return False
+    if _SINK is None:
+        _SINK = PrometheusTraceSink()
+    Trace.add_sink(_SINK)
+    return True
+
+
+__all__ = ["PrometheusTraceSink", "install_trace_metrics"]
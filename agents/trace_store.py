@@ -0,0 +1,221 @@
+"""
+// AICODE-NOTE: PostgresTraceSink — хранилище трейсов/событий агентов в Postgres (`agent_traces`/`agent_events`).
+
+- На пути запуска агента — только `deque.append` (O(1), без await и без I/O): запуск не ждёт БД. В очередь идут
+  сырые объекты (payload — как есть), JSON-сериализация — в фоновом сбросе.
+- Очередь ограничена (`max_queue`): при переполнении запись отбрасывается и считается в `dropped` — лучше потерять
+  трейс, чем память процесса или задержку ответа.
+- Фоновая задача (`start()`) раз в `flush_interval` секунд или при наборе `batch_size` записей пишет батч:
+  трейсы — одним multi-row upsert (старт и финиш одного трейса в батче схлопываются), события — через COPY.
+- Дельты токенов (`token`) не пишутся: их много и для диагностики они не нужны.
+- `aclose()` дописывает остаток очереди и останавливает задачу.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .base import Event, is_token_event
+from .tracing import Trace
+
+
+logger = logging.getLogger("agents.trace_store")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+def _json(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+class PostgresTraceSink:
+    """Приёмник `Trace` с батчевой асинхронной записью в Postgres.
+
+    - `pool` — `AsyncConnectionPool` (psycopg3) приложения;
+    - `max_queue` (env `AGENTS_TRACE_QUEUE`, 10000) — предел очереди записей, сверх — отбрасываются;
+    - `batch_size` (env `AGENTS_TRACE_BATCH`, 500) — сколько записей писать за раз;
+    - `flush_interval` (env `AGENTS_TRACE_FLUSH_MS`, 500 мс) — как часто сбрасывать неполный батч.
+    """
+
+    def __init__(
+        self,
+        pool: Any,
+        *,
+        max_queue: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+    ) -> None:
+        self.pool = pool
+        self.max_queue = max_queue if max_queue is not None else _env_int("AGENTS_TRACE_QUEUE", 10_000)
+        self.batch_size = max(batch_size if batch_size is not None else _env_int("AGENTS_TRACE_BATCH", 500), 1)
+        self.flush_interval = flush_interval if flush_interval is not None else _env_int("AGENTS_TRACE_FLUSH_MS", 500) / 1000
+        # ("trace", row) | ("event", row)
+        self._queue: Deque[Tuple[str, tuple]] = deque()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._stats: Dict[str, Any] = {
+            "enqueued": 0,
+            "dropped": 0,
+            "written": 0,
+            "batches": 0,
+            "errors": 0,
+            "last_flush_ms": 0.0,
+            "max_depth": 0,
+        }
+
+    # ------------------------------------------------------------------
+    # TraceSink: вызывается синхронно из раннера — только очередь
+    # ------------------------------------------------------------------
+
+    def _put(self, kind: str, row: tuple) -> None:
+        if self._closing or len(self._queue) >= self.max_queue:
+            self._stats["dropped"] += 1
+            return
+        self._queue.append((kind, row))
+        self._stats["enqueued"] += 1
+        depth = len(self._queue)
+        if depth > self._stats["max_depth"]:
+            self._stats["max_depth"] = depth
+        if depth >= self.batch_size and self._wake is not None:
+            self._wake.set()
+
+    def _trace_row(self, trace: Trace) -> tuple:
+        return (
+            str(trace.id),
+            trace.entity_type,
+            trace.entity_id,
+            trace.version,
+            str(trace.payload.get("session_id") or "") or None,
+            trace.status,
+            trace.started_at,
+            trace.finished_at,
+            trace.duration_ms,
+            trace.events,
+            # Поверхностная копия: раннер дописывает payload после старта, а сериализуем мы позже
+            dict(trace.payload),
+        )
+
+    def trace_started(self, trace: Trace) -> None:
+        self._put("trace", self._trace_row(trace))
+
+    def trace_event(self, trace: Trace, ev: Event) -> None:
+        if is_token_event(ev.event):
+            return
+        self._put("event", (str(trace.id), trace.events, ev.event, ev.session_id or None, ev.payload or {}, time.time()))
+
+    def trace_finished(self, trace: Trace) -> None:
+        self._put("trace", self._trace_row(trace))
+
+    # ------------------------------------------------------------------
+    # Фоновая запись
+    # ------------------------------------------------------------------
+
+    def start(self) -> None:
+        """Запустить фоновую задачу записи в текущем event loop (идемпотентно)."""
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._wake = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="trace-store-flush")
+
+    async def _run(self) -> None:
+        assert self._wake is not None
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Записать всё, что накопилось в очереди, батчами; возвращает число записанных записей."""
+        written = 0
+        while self._queue:
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            started = time.perf_counter()
+            try:
+                await self._write(batch)
+            except Exception:
+                # Батч теряем: повтор с тем же содержимым, скорее всего, упадёт так же, а очередь должна двигаться
+                self._stats["errors"] += 1
+                self._stats["dropped"] += len(batch)
+                logger.warning("failed to write %d trace records", len(batch), exc_info=True)
+                continue
+            self._stats["batches"] += 1
+            self._stats["written"] += len(batch)
+            self._stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            written += len(batch)
+        return written
+
+    async def _write(self, batch: List[Tuple[str, tuple]]) -> None:
+        traces: Dict[str, tuple] = {}
+        events: List[tuple] = []
+        for kind, row in batch:
+            if kind == "trace":
+                # Старт и финиш одного трейса в батче — одна строка upsert (последнее состояние)
+                traces[row[0]] = row
+            else:
+                events.append(row)
+        async with self.pool.connection() as conn:
+            async with conn.transaction():
+                if traces:
+                    values_sql = ", ".join(
+                        ["(%s::uuid, %s, %s, %s, %s, %s, to_timestamp(%s), to_timestamp(%s), %s, %s, %s::jsonb)"] * len(traces)
+                    )
+                    params: List[Any] = [v for row in traces.values() for v in (*row[:-1], _json(row[-1]))]
+                    await conn.execute(
+                        f"""
+                        INSERT INTO agent_traces
+                            (id, entity_type, entity_id, version, session_id, status,
+                             started_at, finished_at, duration_ms, event_count, payload)
+                        VALUES {values_sql}
+                        ON CONFLICT (id) DO UPDATE SET
+                            status = EXCLUDED.status,
+                            finished_at = EXCLUDED.finished_at,
+                            duration_ms = EXCLUDED.duration_ms,
+                            event_count = EXCLUDED.event_count,
+                            payload = EXCLUDED.payload
+                        """,
+                        params,
+                    )
+                if events:
+                    async with conn.cursor() as cur:
+                        async with cur.copy(
+                            "COPY agent_events (trace_id, seq, event, session_id, payload, created_at) FROM STDIN"
+                        ) as copy:
+                            for trace_id, seq, event, session_id, payload, ts in events:
+                                await copy.write_row(
+                                    (trace_id, seq, event, session_id, _json(payload), datetime.fromtimestamp(ts, tz=timezone.utc))
+                                )
+
+    async def aclose(self) -> None:
+        """Остановить фоновую задачу и дописать остаток очереди."""
+        self._closing = True
+        task, self._task = self._task, None
+        if task is not None:
+            if self._wake is not None:
+                self._wake.set()
+            try:
+                await task
+            except Exception:
+                logger.exception("trace store flush task failed")
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "queue_depth": len(self._queue), "max_queue": self.max_queue}
+
+
+__all__ = ["PostgresTraceSink"]
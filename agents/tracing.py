@@ -1,16 +1,35 @@
 """
-// AICODE-NOTE: Интерфейс трейсинга. Фактическую запись делает бэкенд через адаптеры.
+// AICODE-NOTE: Интерфейс трейсинга. Фактическую запись делают подключаемые приёмники (`Trace.add_sink/set_sink`).
+
+- Без приёмников `start/event/finish` только обновляют объект трейса (как раньше — no-op для хранилища).
+- Приёмники (хранилище в Postgres, метрики Prometheus) вызываются по очереди синхронно на пути запуска агента,
+  поэтому обязаны быть неблокирующими: положить запись в очередь / обновить счётчик и вернуться
+  (см. `agents/trace_store.py`, `agents/trace_metrics.py`). Ошибки приёмника запуск агента не роняют.
 """
 
 from __future__ import annotations
 
+import logging
+import time
 import uuid
 from dataclasses import dataclass, field
-from typing import Any
+from typing import Any, Optional, Protocol
 
 from .base import Event
 
 
+logger = logging.getLogger("agents.tracing")
+
+
+class TraceSink(Protocol):
+    def trace_started(self, trace: "Trace") -> None: ...
+    def trace_event(self, trace: "Trace", ev: Event) -> None: ...
+    def trace_finished(self, trace: "Trace") -> None: ...
+
+
+_SINKS: tuple[TraceSink, ...] = ()
+
+
 @dataclass
 class Trace:
     id: uuid.UUID
@@ -19,23 +38,58 @@ class Trace:
     version: str
     payload: dict[str, Any] = field(default_factory=dict)
     status: str = "running"
+    started_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    # Число записанных событий (порядковый номер следующего события)
+    events: int = 0
+
+    @staticmethod
+    def set_sink(sink: Optional[TraceSink]) -> None:
+        """Заменить все приёмники трейсов процесса одним (None — отключить все)."""
+        global _SINKS
+        _SINKS = (sink,) if sink is not None else ()
+
+    @staticmethod
+    def add_sink(sink: TraceSink) -> None:
+        global _SINKS
+        if sink not in _SINKS:
+            _SINKS = (*_SINKS, sink)
+
+    @staticmethod
+    def remove_sink(sink: TraceSink) -> None:
+        global _SINKS
+        _SINKS = tuple(s for s in _SINKS if s is not sink)
 
     @staticmethod
     def start(entity_type: str, entity_id: str, version: str, payload: dict | None = None) -> "Trace":
-        # AICODE-NOTE: В минимальной версии просто возвращаем объект; бэкенд‑интеграция добавится позже
-        return Trace(id=uuid.uuid4(), entity_type=entity_type, entity_id=entity_id, version=version, payload=payload or {})
+        trace = Trace(id=uuid.uuid4(), entity_type=entity_type, entity_id=entity_id, version=version, payload=payload or {})
+        _notify("trace_started", trace)
+        return trace
 
     @staticmethod
     def event(trace: "Trace", ev: Event) -> None:
-        # AICODE-NOTE: Хук для записи событий в БД через бэкенд (будет добавлено позже)
-        return
+        _notify("trace_event", trace, ev)
+        trace.events += 1
 
     @staticmethod
     def finish(trace: "Trace", status: str = "success") -> None:
         trace.status = status
-        return
+        trace.finished_at = time.time()
+        _notify("trace_finished", trace)
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.finished_at is None:
+            return None
+        return round((self.finished_at - self.started_at) * 1000, 3)
 
 
-__all__ = ["Trace"]
+def _notify(method: str, *args: Any) -> None:
+    for sink in _SINKS:
+        try:
+            getattr(sink, method)(*args)
+        except Exception:
+            logger.exception("trace sink %s failed", method)
 
 
+__all__ = ["Trace", "TraceSink"]
@@ -57,6 +57,7 @@ class LearningPlannerAgent(AgentABC):
 
         system_text = get_prompt("learning_planner.system")
         developer_text = get_prompt("learning_planner.developer").format(topic=topic_text)
+        model = self.meta.get("model") or os.getenv("AGENTS_DEFAULT_MODEL", "gpt-4.1-mini")
         dialog = await DialogueBuilder.build(
             self.memory,
             session_id,
@@ -64,10 +65,10 @@ class LearningPlannerAgent(AgentABC):
             "planning",
             system_text=system_text,
             developer_text=developer_text,
+            model=model,
         )
 
         # Минимальный LLM‑вызов
-        model = self.meta.get("model") or os.getenv("AGENTS_DEFAULT_MODEL", "gpt-4.1-mini")
         messages = to_openai_chat_messages(dialog)
 
 
@@ -77,7 +78,7 @@ class LearningPlannerAgent(AgentABC):
         plan = response.result
 
         result = {"plan": plan, "sources": []}
-        await self.memory.append(session_id, [{"role": "assistant", "name": "planning", "content": result}])
+        await self.remember(session_id, [{"role": "assistant", "name": "planning", "content": result}])
         yield self.emit("final_result", session_id, payload=result)
 
 
@@ -39,6 +39,7 @@ class MentorChatAgent(AgentABC):
         # Сбор диалога
         system_text = get_prompt("mentor_chat.system")
         developer_text = get_prompt("mentor_chat.developer").format(message=effective_message)
+        model = self.meta.get("model") or os.getenv("AGENTS_DEFAULT_MODEL", "gpt-4o-mini")
         dialog = await DialogueBuilder.build(
             self.memory,
             session_id,
@@ -46,16 +47,21 @@ class MentorChatAgent(AgentABC):
             step,
             system_text=system_text,
             developer_text=developer_text,
+            model=model,
+            query=user_message.strip() or None,
         )
 
-        # Вызов LLM без структурированного ответа
-        model = self.meta.get("model") or os.getenv("AGENTS_DEFAULT_MODEL", "gpt-4o-mini")
+        # Вызов LLM без структурированного ответа (стрим токенов)
         messages = to_openai_chat_messages(dialog)
-        response = await self.llm.chat(messages=messages, model=model)
-        text = response.result if isinstance(response.result, str) else str(response.result)
+        # Стримим дельты наружу по мере генерации (time-to-first-token), финал — полный текст
+        chunks: list[str] = []
+        async for delta in self.llm.chat_stream(messages=messages, model=model):
+            chunks.append(delta)
+            yield self.emit_token(session_id, delta)
+        text = "".join(chunks)
 
         # Пишем в память и отдаём финал
-        await self.memory.append(session_id, [{"role": "assistant", "content": text, "meta": {"agentId": self.id, "version": self.version}}])
+        await self.remember(session_id, [{"role": "assistant", "content": text, "meta": {"agentId": self.id, "version": self.version}}])
         yield self.emit("final_result", session_id, payload={"message": text})
 
 
@@ -33,6 +33,7 @@ class PracticeCoachAgent(AgentABC):
 
         system_text = get_prompt("practice_coach.system")
         developer_text = get_prompt("practice_coach.developer").format(message=effective_message)
+        model = self.meta.get("model") or os.getenv("AGENTS_DEFAULT_MODEL", "gpt-4o-mini")
         dialog = await DialogueBuilder.build(
             self.memory,
             session_id,
@@ -40,14 +41,19 @@ class PracticeCoachAgent(AgentABC):
             step,
             system_text=system_text,
             developer_text=developer_text,
+            model=model,
+            query=user_message.strip() or None,
         )
 
-        model = self.meta.get("model") or os.getenv("AGENTS_DEFAULT_MODEL", "gpt-4o-mini")
         messages = to_openai_chat_messages(dialog)
-        response = await self.llm.chat(messages=messages, model=model)
-        text = response.result if isinstance(response.result, str) else str(response.result)
-
-        await self.memory.append(session_id, [{"role": "assistant", "content": text, "meta": {"agentId": self.id, "version": self.version}}])
+        # Стримим дельты наружу по мере генерации (time-to-first-token), финал — полный текст
+        chunks: list[str] = []
+        async for delta in self.llm.chat_stream(messages=messages, model=model):
+            chunks.append(delta)
+            yield self.emit_token(session_id, delta)
+        text = "".join(chunks)
+
+        await self.remember(session_id, [{"role": "assistant", "content": text, "meta": {"agentId": self.id, "version": self.version}}])
         yield self.emit("final_result", session_id, payload={"message": text})
 
 
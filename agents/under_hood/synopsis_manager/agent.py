@@ -68,11 +68,12 @@ class SynopsisManagerAgent(AgentABC):
         # Попытка через LLM (LLM‑дружественная схема)
         system_text = get_prompt("synopsis_manager.system")
         developer_text = get_prompt("synopsis_manager.developer").format(topic=topic_text, plan=plan_text)
+        model = self.meta.get("model") or os.getenv("AGENTS_DEFAULT_MODEL", "gpt-4.1-mini")
         dialog = await DialogueBuilder.build(
-            self.memory, session_id, self.role_policy, step, system_text=system_text, developer_text=developer_text
+            self.memory, session_id, self.role_policy, step, system_text=system_text, developer_text=developer_text,
+            model=model,
         )
 
-        model = self.meta.get("model") or os.getenv("AGENTS_DEFAULT_MODEL", "gpt-4.1-mini")
         messages = to_openai_chat_messages(dialog)
 
         # Совместимо с реализацией в learning_planner; используем упрощённую схему
@@ -82,7 +83,7 @@ class SynopsisManagerAgent(AgentABC):
             result["lastUpdated"] = self._now_str()
 
         payload: dict[str, Any] = {"synopsis": result, "sources": []}
-        await self.memory.append(session_id, [{"role": "assistant", "name": step, "content": payload}])
+        await self.remember(session_id, [{"role": "assistant", "name": step, "content": payload}])
         yield self.emit("final_result", session_id, payload=payload)
 
 
@@ -0,0 +1,95 @@
+"""
+// AICODE-NOTE: Async-пул PostgreSQL (psycopg3) для FastAPI.
+
+- Один `AsyncConnectionPool` на процесс: открывается в lifespan приложения, закрывается при остановке.
+- Размер и таймауты пула настраиваются через env (см. `pool_settings_from_env`).
+- Prepared statements: psycopg3 подготавливает запрос на сервере после `DB_PREPARE_THRESHOLD` выполнений на соединении.
+- Health-check: соединение проверяется перед выдачей из пула (`check_connection`), битые — пересоздаются.
+
+Переменные окружения БД: DB_URL или DB_HOST/DB_PORT/DB_USER/DB_PASSWORD/DB_NAME
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Any, Dict, Optional
+
+from psycopg_pool import AsyncConnectionPool
+
+
+def build_db_url_from_env() -> str:
+    db_url = os.getenv("DB_URL")
+    if db_url:
+        return db_url
+    host = os.getenv("DB_HOST", "localhost")
+    port = os.getenv("DB_PORT", "5432")
+    user = os.getenv("DB_USER", "user")
+    password = os.getenv("DB_PASSWORD", "password")
+    name = os.getenv("DB_NAME", "ai_learning_db")
+    return f"postgresql://{user}:{password}@{host}:{port}/{name}"
+
+
+def pool_settings_from_env() -> Dict[str, Any]:
+    """Параметры пула из окружения.
+
+    - `DB_POOL_MIN_SIZE` (2), `DB_POOL_MAX_SIZE` (20) — размер пула;
+    - `DB_POOL_TIMEOUT` (10 c) — ожидание свободного соединения, затем `PoolTimeout`;
+    - `DB_POOL_MAX_IDLE` (300 c), `DB_POOL_MAX_LIFETIME` (3600 c) — ротация соединений;
+    - `DB_PREPARE_THRESHOLD` (5) — после скольких выполнений запрос готовится на сервере (пусто — выключить).
+    """
+    prepare_raw = os.getenv("DB_PREPARE_THRESHOLD", "5")
+    return {
+        "min_size": int(os.getenv("DB_POOL_MIN_SIZE") or "2"),
+        "max_size": int(os.getenv("DB_POOL_MAX_SIZE") or "20"),
+        "timeout": float(os.getenv("DB_POOL_TIMEOUT") or "10"),
+        "max_idle": float(os.getenv("DB_POOL_MAX_IDLE") or "300"),
+        "max_lifetime": float(os.getenv("DB_POOL_MAX_LIFETIME") or "3600"),
+        "prepare_threshold": int(prepare_raw) if prepare_raw else None,
+    }
+
+
+_POOL: Optional[AsyncConnectionPool] = None
+
+
+async def open_pool() -> AsyncConnectionPool:
+    """Создать и открыть пул (идемпотентно). Не ждёт БД: соединения набираются в фоне."""
+    global _POOL
+    if _POOL is None:
+        settings = pool_settings_from_env()
+        prepare_threshold = settings.pop("prepare_threshold")
+        _POOL = AsyncConnectionPool(
+            build_db_url_from_env(),
+            open=False,
+            check=AsyncConnectionPool.check_connection,
+            kwargs={"prepare_threshold": prepare_threshold},
+            name="ai_learning_api",
+            **settings,
+        )
+        await _POOL.open(wait=False)
+    return _POOL
+
+
+def get_pool() -> AsyncConnectionPool:
+    if _POOL is None:
+        raise RuntimeError("DB pool is not initialized (see app lifespan)")
+    return _POOL
+
+
+def db():
+    """Соединение из пула на время блока: commit при успехе, rollback при исключении.
+
+    Использование: `async with db() as conn: ...`
+    """
+    return get_pool().connection()
+
+
+async def close_pool() -> None:
+    global _POOL
+    if _POOL is not None:
+        try:
+            await _POOL.close()
+        finally:
+            _POOL = None
+
+
+__all__ = ["build_db_url_from_env", "pool_settings_from_env", "open_pool", "get_pool", "db", "close_pool"]
@@ -2,7 +2,8 @@
 // AICODE-NOTE: FastAPI-приложение для фронтенда AI Learning.
 
 - Совместимо с фронтом (`frontend/src/lib/api.ts`).
-- Подключение к PostgreSQL через psycopg2 с ленивым пулом соединений.
+- Подключение к PostgreSQL через async-пул psycopg3 (`backend/app/db.py`), SQL — в `backend/app/repository.py`.
+- Все обработчики `async def`: запросы к БД не занимают поток из threadpool FastAPI.
 - Эндпоинты:
   - GET /health
   - GET /tracks
@@ -18,24 +19,26 @@
 
 from __future__ import annotations
 
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
-import json
+import hashlib
 import os
 import re
 import logging
+import uuid
 from urllib.parse import unquote
 from typing import Any, Dict, Iterable, List, Optional, AsyncIterator
 
-from fastapi import FastAPI, HTTPException, Path, Body, Query, Request
+from fastapi import FastAPI, HTTPException, Path, Body, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from starlette.responses import StreamingResponse
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 
-# AICODE-NOTE: psycopg2 пул соединений и словарный курсор
-import psycopg2
-from psycopg2.pool import SimpleConnectionPool
-from psycopg2.extras import RealDictCursor
+from backend.app import metrics as app_metrics
+from backend.app import repository as repo
+from backend.app.db import close_pool, db, get_pool, open_pool
 
 
 # ----------------------------------------------------------------------------
@@ -43,18 +46,6 @@ from psycopg2.extras import RealDictCursor
 # ----------------------------------------------------------------------------
 
 
-def build_db_url_from_env() -> str:
-    db_url = os.getenv("DB_URL")
-    if db_url:
-        return db_url
-    host = os.getenv("DB_HOST", "localhost")
-    port = os.getenv("DB_PORT", "5432")
-    user = os.getenv("DB_USER", "user")
-    password = os.getenv("DB_PASSWORD", "password")
-    name = os.getenv("DB_NAME", "ai_learning_db")
-    return f"postgresql://{user}:{password}@{host}:{port}/{name}"
-
-
 ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://127.0.0.1:3000",
@@ -62,43 +53,17 @@ ALLOWED_ORIGINS = [
 
 
 class AppState:
-    db_pool: Optional[SimpleConnectionPool] = None
+    # AICODE-NOTE: Контейнер агентов (LLM/память/инстансы) живёт всё время работы приложения, см. lifespan
+    agents: Optional[Any] = None
+    # Горячий уровень памяти (TieredMemory), если включён: в него дописываются сообщения, сохранённые через API
+    hot_memory: Optional[Any] = None
+    # Хранилище трейсов запусков агентов (PostgresTraceSink), если включено
+    trace_sink: Optional[Any] = None
 
 
 state = AppState()
 
 
-def get_db_pool() -> SimpleConnectionPool:
-    """Ленивая инициализация пула соединений к БД."""
-    if state.db_pool is None:
-        dsn = build_db_url_from_env()
-        state.db_pool = SimpleConnectionPool(minconn=1, maxconn=8, dsn=dsn)
-    return state.db_pool
-
-
-class DB:
-    """Примитивная обёртка для работы с БД (контекст курсора)."""
-
-    def __init__(self) -> None:
-        self._conn = None
-
-    def __enter__(self):
-        pool = get_db_pool()
-        self._conn = pool.getconn()
-        return self._conn
-
-    def __exit__(self, exc_type, exc, tb):
-        assert self._conn is not None
-        try:
-            if exc_type is None:
-                self._conn.commit()
-            else:
-                self._conn.rollback()
-        finally:
-            get_db_pool().putconn(self._conn)
-            self._conn = None
-
-
 # ----------------------------------------------------------------------------
 # Pydantic-схемы
 # ----------------------------------------------------------------------------
@@ -125,6 +90,8 @@ class MessageOut(BaseModel):
     content: str
     created_at: str
     meta: Optional[Dict[str, Any]] = None
+    # Keyset-курсор сообщения для `before`/`after` (см. GET .../messages/{tab})
+    cursor: Optional[str] = None
 
 
 class CreateSessionIn(BaseModel):
@@ -147,7 +114,67 @@ class PostMessageIn(BaseModel):
 # ----------------------------------------------------------------------------
 
 
-app = FastAPI(title="AI Learning API", version="0.1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):  # pragma: no cover - простая инициализация
+    # AICODE-NOTE: Один async-пул на процесс: роуты API и PostgresMemory агентов
+    pool = await open_pool()
+    # AICODE-NOTE: /metrics снимает состояние пула/кэшей/очереди трейсов в момент скрейпа (см. backend/app/metrics.py)
+    app_metrics.install_app_metrics(lambda: {"pool": pool, "agents": state.agents, "trace_sink": state.trace_sink})
+    if _AGENTS_AVAILABLE:
+        try:
+            autodiscover()
+            autodiscover_prompts()
+        except Exception:
+            pass
+        container = state.agents = AgentContainer()
+
+        def postgres_memory():
+            # Память агентов читает/пишет chat_messages напрямую через этот пул (без HTTP к себе)
+            memory = PostgresMemory(pool=pool)
+            if _tiered_memory_enabled():
+                # AICODE-NOTE: История — из Redis, запись в БД — write‑behind задачей воркера (не на пути ответа)
+                memory = state.hot_memory = TieredMemory(RedisShortTerm(), memory, scheduler=_schedule_memory_flush)
+            if os.getenv("AGENTS_SUMMARY_ENABLED", "1") not in {"1", "true", "True", "yes"}:
+                return memory
+            # AICODE-NOTE: В промпт — конспект старых ходов + свежий хвост; конспект обновляет воркер
+            # (без воркера — фоновая задача в этом же процессе)
+            return SummarizingMemory(
+                memory,
+                llm=container.llm(),
+                scheduler=_schedule_summary_job if _JOBS_AVAILABLE else None,
+            )
+
+        container.register_memory("postgres", postgres_memory)
+        # Модель эмбеддингов — до приёма запросов (иначе первая загрузка заблокировала бы loop)
+        await container.warmup()
+        # Запуски/LLM по агентам и моделям — в Prometheus (no-op без prometheus_client)
+        install_trace_metrics()
+        if os.getenv("AGENTS_TRACE_STORE", "1") in {"1", "true", "True", "yes"}:
+            # AICODE-NOTE: Трейсы/события запусков — в agent_traces/agent_events фоновой батчевой записью
+            sink = state.trace_sink = PostgresTraceSink(pool)
+            sink.start()
+            Trace.add_sink(sink)
+    try:
+        yield
+    finally:
+        # Грейсфул-шатдаун: трейсы (дописать очередь), LLM-клиенты/память агентов и пул БД
+        if state.trace_sink is not None:
+            Trace.remove_sink(state.trace_sink)
+            try:
+                await state.trace_sink.aclose()
+            finally:
+                state.trace_sink = None
+        if state.agents is not None:
+            try:
+                await aclose_singleflight()
+                await state.agents.aclose()
+            finally:
+                state.agents = None
+                state.hot_memory = None
+        await close_pool()
+
+
+app = FastAPI(title="AI Learning API", version="0.1.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -155,6 +182,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Заголовки пагинации и кэширования истории сообщений должны быть видны фронтенду
+    expose_headers=["ETag", "X-Next-Cursor", "X-Prev-Cursor", "X-Has-More"],
 )
 
 logger = logging.getLogger("ai_learning.api")
@@ -171,44 +200,52 @@ async def decoded_path_logger(request: Request, call_next):  # pragma: no cover
     return response
 
 
+if app_metrics.prometheus_client is not None:
+    app.middleware("http")(app_metrics.http_metrics_middleware)
+
+
 @app.get("/health")
-def health() -> Dict[str, str]:
+async def health() -> Dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/health/db")
+async def health_db() -> Dict[str, Any]:
+    """Готовность БД: `SELECT 1` через пул + статистика пула (размер, ожидающие, ошибки)."""
+    pool = get_pool()
+    try:
+        async with pool.connection(timeout=5) as conn:
+            await conn.execute("SELECT 1")
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "error": str(e), "pool": pool.get_stats()})
+    return {"status": "ok", "pool": pool.get_stats()}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    """Метрики процесса в формате Prometheus: латентность маршрутов, пул БД, LLM/агенты, кэши, очередь трейсов."""
+    if app_metrics.prometheus_client is None:
+        raise HTTPException(status_code=501, detail="prometheus_client is not installed")
+    body, content_type = app_metrics.render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
 # ----------------------------------------------------------------------------
 # Tracks
 # ----------------------------------------------------------------------------
 
 
 @app.get("/tracks", response_model=List[TrackOut])
-def list_tracks() -> List[TrackOut]:
-    with DB() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                """
-                SELECT id::text AS id, slug, title, description, goal
-                FROM tracks
-                ORDER BY created_at ASC
-                """
-            )
-            rows = cur.fetchall()
+async def list_tracks() -> List[TrackOut]:
+    async with db() as conn:
+        rows = await repo.list_tracks(conn)
     return [TrackOut(**row) for row in rows]
 
 
 @app.get("/tracks/{slug}", response_model=TrackOut)
-def get_track(slug: str = Path(..., min_length=1)) -> TrackOut:
-    with DB() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                """
-                SELECT id::text AS id, slug, title, description, goal
-                FROM tracks
-                WHERE slug = %s
-                """,
-                (slug,),
-            )
-            row = cur.fetchone()
+async def get_track(slug: str = Path(..., min_length=1)) -> TrackOut:
+    async with db() as conn:
+        row = await repo.get_track(conn, slug)
     if not row:
         raise HTTPException(status_code=404, detail="Track not found")
     return TrackOut(**row)
@@ -231,67 +268,24 @@ def _slugify_base(value: str) -> str:
 
 
 @app.post("/tracks", response_model=TrackOut)
-def create_track(body: CreateTrackIn) -> TrackOut:
-    title = body.title
-    description = body.description or None
-    goal = body.goal or None
-    desired_slug = body.slug or _slugify_base(title)
+async def create_track(body: CreateTrackIn) -> TrackOut:
     roadmap = [t for t in (body.roadmap or []) if isinstance(t, str) and t.strip()]
-
-    with DB() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Подбираем уникальный slug
-            slug = desired_slug
-            suffix = 2
-            while True:
-                cur.execute("SELECT 1 FROM tracks WHERE slug = %s", (slug,))
-                if cur.fetchone() is None:
-                    break
-                slug = f"{desired_slug}-{suffix}"
-                suffix += 1
-
-            # Вставка трека
-            cur.execute(
-                """
-                INSERT INTO tracks (slug, title, description, goal)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id::text AS id, slug, title, description, goal
-                """,
-                (slug, title, description, goal),
-            )
-            row = cur.fetchone()
-            track_id = row["id"]
-
-            # Вставка роадмапа
-            position = 1
-            for text in roadmap:
-                cur.execute(
-                    """
-                    INSERT INTO track_roadmap_items (track_id, position, text, done)
-                    VALUES (%s::uuid, %s, %s, false)
-                    """,
-                    (track_id, position, text.strip()),
-                )
-                position += 1
-
+    async with db() as conn:
+        row = await repo.create_track(
+            conn,
+            title=body.title,
+            description=body.description or None,
+            goal=body.goal or None,
+            desired_slug=body.slug or _slugify_base(body.title),
+            roadmap=roadmap,
+        )
     return TrackOut(**row)
 
 
 @app.get("/tracks/{slug}/roadmap", response_model=List[RoadmapItemOut])
-def get_track_roadmap(slug: str = Path(..., min_length=1)) -> List[RoadmapItemOut]:
-    with DB() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                """
-                SELECT tri.id::text AS id, tri.position, tri.text, tri.done
-                FROM track_roadmap_items tri
-                JOIN tracks t ON t.id = tri.track_id
-                WHERE t.slug = %s
-                ORDER BY tri.position ASC
-                """,
-                (slug,),
-            )
-            rows = cur.fetchall()
+async def get_track_roadmap(slug: str = Path(..., min_length=1)) -> List[RoadmapItemOut]:
+    async with db() as conn:
+        rows = await repo.get_track_roadmap(conn, slug)
     return [RoadmapItemOut(**row) for row in rows]
 
 
@@ -301,61 +295,11 @@ def get_track_roadmap(slug: str = Path(..., min_length=1)) -> List[RoadmapItemOu
 
 
 @app.post("/sessions", response_model=CreateSessionOut)
-def create_or_get_session(payload: CreateSessionIn = Body(...)) -> CreateSessionOut:
-    device_id = payload.deviceId
-    track_slug = payload.trackSlug
-
-    with DB() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # AICODE-NOTE: Upsert пользователя по device_id
-            cur.execute(
-                """
-                INSERT INTO users (device_id) VALUES (%s)
-                ON CONFLICT (device_id) DO UPDATE SET updated_at = now()
-                RETURNING id::text AS id
-                """,
-                (device_id,),
-            )
-            user_id = cur.fetchone()["id"]
-
-            # Найти трек
-            cur.execute(
-                """
-                SELECT id::text AS id
-                FROM tracks
-                WHERE slug = %s
-                """,
-                (track_slug,),
-            )
-            row_track = cur.fetchone()
-            if not row_track:
-                raise HTTPException(status_code=404, detail="Track not found")
-            track_id = row_track["id"]
-
-            # Upsert сессии
-            cur.execute(
-                """
-                INSERT INTO track_sessions (user_id, track_id)
-                VALUES (%s::uuid, %s::uuid)
-                ON CONFLICT (user_id, track_id)
-                DO UPDATE SET updated_at = now()
-                RETURNING id::text AS id
-                """,
-                (user_id, track_id),
-            )
-            session_id = cur.fetchone()["id"]
-
-            # Обеспечить ветки чатов (chat|practice|simulation)
-            for tab in ("chat", "practice", "simulation"):
-                cur.execute(
-                    """
-                    INSERT INTO chat_threads (session_id, tab)
-                    VALUES (%s::uuid, %s::chat_tab)
-                    ON CONFLICT (session_id, tab) DO NOTHING
-                    """,
-                    (session_id, tab),
-                )
-
+async def create_or_get_session(payload: CreateSessionIn = Body(...)) -> CreateSessionOut:
+    async with db() as conn:
+        session_id = await repo.upsert_session(conn, device_id=payload.deviceId, track_slug=payload.trackSlug)
+    if session_id is None:
+        raise HTTPException(status_code=404, detail="Track not found")
     return CreateSessionOut(sessionId=session_id)
 
 
@@ -364,74 +308,99 @@ def create_or_get_session(payload: CreateSessionIn = Body(...)) -> CreateSession
 # ----------------------------------------------------------------------------
 
 
-def _get_thread_id_or_404(cur, session_id: str, tab: str) -> str:
-    cur.execute(
-        """
-        SELECT id::text AS id
-        FROM chat_threads
-        WHERE session_id = %s::uuid AND tab = %s::chat_tab
-        """,
-        (session_id, tab),
-    )
-    row = cur.fetchone()
-    if not row:
+async def _get_thread_id_or_404(conn, session_id: str, tab: str) -> str:
+    thread_id = await repo.get_thread_id(conn, session_id, tab)
+    if thread_id is None:
         raise HTTPException(status_code=404, detail="Thread not found for session/tab")
-    return row["id"]
+    return thread_id
+
+
+MESSAGES_PAGE_MAX = 1000
+# AICODE-NOTE: Одно правило для заголовка Idempotency-Key во всех маршрутах: длиннее — 422, без усечения
+# (усечённые разные ключи могли бы совпасть)
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+
+def _decode_cursor_or_400(value: Optional[str]) -> Optional[repo.Cursor]:
+    if value is None:
+        return None
+    try:
+        return repo.decode_cursor(value)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Сравнение слабое (RFC 9110): префикс W/ не учитываем
+    tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+    return etag.removeprefix("W/") in tags
 
 
 @app.get("/sessions/{session_id}/messages/{tab}", response_model=List[MessageOut])
-def list_messages(
+async def list_messages(
+    request: Request,
+    response: Response,
     session_id: str = Path(..., description="Track session id (UUID as string)"),
     tab: str = Path(..., pattern="^(chat|practice|simulation)$"),
+    before: Optional[str] = Query(None, description="Курсор: сообщения старше этого"),
+    after: Optional[str] = Query(None, description="Курсор: сообщения новее этого"),
+    limit: Optional[int] = Query(None, ge=1, le=MESSAGES_PAGE_MAX, description="Размер страницы"),
+    tail: Optional[int] = Query(None, ge=1, le=MESSAGES_PAGE_MAX, description="Последние N сообщений"),
 ) -> List[MessageOut]:
-    with DB() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            thread_id = _get_thread_id_or_404(cur, session_id, tab)
-            cur.execute(
-                """
-                SELECT id::text AS id,
-                       role::text AS role,
-                       content,
-                       to_char(created_at AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS created_at,
-                       meta_json AS meta
-                FROM chat_messages
-                WHERE thread_id = %s::uuid
-                ORDER BY created_at ASC
-                """,
-                (thread_id,),
-            )
-            rows = cur.fetchall()
+    if tail is not None and (before is not None or after is not None or limit is not None):
+        raise HTTPException(status_code=400, detail="tail cannot be combined with before/after/limit")
+    before_key = _decode_cursor_or_400(before)
+    after_key = _decode_cursor_or_400(after)
+
+    async with db() as conn:
+        thread_id = await _get_thread_id_or_404(conn, session_id, tab)
+        # AICODE-NOTE: ETag = версия ветки + параметры запроса; проверяем до выборки строк,
+        # чтобы неизменившиеся ветки отдавать 304 без чтения истории
+        count, last = await repo.thread_version(conn, thread_id)
+        version = f"{thread_id}:{count}:{last.isoformat() if last else ''}:{request.url.query}"
+        etag = 'W/"' + hashlib.sha1(version.encode()).hexdigest() + '"'
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        rows, has_more = await repo.list_messages(
+            conn,
+            thread_id,
+            before=before_key,
+            after=after_key,
+            limit=tail if tail is not None else limit,
+            tail=tail is not None,
+        )
+
+    response.headers["ETag"] = etag
+    if rows:
+        response.headers["X-Prev-Cursor"] = rows[0]["cursor"]
+        response.headers["X-Next-Cursor"] = rows[-1]["cursor"]
+    response.headers["X-Has-More"] = "1" if has_more else "0"
     # Pydantic конвертирует dict→модель
     return [MessageOut(**row) for row in rows]
 
 
 @app.post("/sessions/{session_id}/messages/{tab}", response_model=MessageOut)
-def post_message(
+async def post_message(
     session_id: str = Path(..., description="Track session id (UUID as string)"),
     tab: str = Path(..., pattern="^(chat|practice|simulation)$"),
     payload: PostMessageIn = Body(...),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=IDEMPOTENCY_KEY_MAX_LENGTH),
 ) -> MessageOut:
-    role = payload.role
-    content = payload.content
-    meta = payload.meta or {}
-
-    with DB() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            thread_id = _get_thread_id_or_404(cur, session_id, tab)
-            cur.execute(
-                """
-                INSERT INTO chat_messages (thread_id, role, content, meta_json)
-                VALUES (%s::uuid, %s::message_role, %s, %s::jsonb)
-                RETURNING id::text AS id,
-                          role::text AS role,
-                          content,
-                          to_char(created_at AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS created_at,
-                          meta_json AS meta
-                """,
-                (thread_id, role, content, json.dumps(meta)),
-            )
-            row = cur.fetchone()
-
+    async with db() as conn:
+        thread_id = await _get_thread_id_or_404(conn, session_id, tab)
+        row = await repo.insert_message(
+            conn, thread_id, role=payload.role, content=payload.content, meta=payload.meta, idempotency_key=idempotency_key
+        )
+    if state.hot_memory is not None:
+        try:
+            await state.hot_memory.record(session_id, tab, row)
+        except Exception:
+            # Не критично: ветка перечитается из БД, когда истечёт горячий кэш
+            logger.warning("failed to record message in hot memory", exc_info=True)
     return MessageOut(**row)
 
 
@@ -452,71 +421,19 @@ class SynopsisOut(BaseModel):
 
 
 @app.get("/sessions/{session_id}/synopsis", response_model=SynopsisOut)
-def get_synopsis(session_id: str = Path(...)) -> SynopsisOut:
-    with DB() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                """
-                SELECT s.title,
-                       sv.items_json AS items,
-                       to_char(sv.created_at AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS last_updated
-                FROM synopses s
-                JOIN synopsis_versions sv ON sv.id = s.current_version_id
-                WHERE s.session_id = %s::uuid
-                """,
-                (session_id,),
-            )
-            row = cur.fetchone()
+async def get_synopsis(session_id: str = Path(...)) -> SynopsisOut:
+    async with db() as conn:
+        row = await repo.get_current_synopsis(conn, session_id)
     if not row:
         raise HTTPException(status_code=404, detail="Synopsis not found")
-    return SynopsisOut(title=row["title"], items=row["items"], lastUpdated=row["last_updated"])  # type: ignore[index]
+    return SynopsisOut(title=row["title"], items=row["items"], lastUpdated=row["last_updated"])
 
 
 @app.post("/sessions/{session_id}/synopsis", response_model=SynopsisOut)
-def upsert_synopsis(session_id: str, body: SynopsisIn) -> SynopsisOut:
-    with DB() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Ensure container
-            cur.execute("SELECT id::text AS id FROM synopses WHERE session_id = %s::uuid", (session_id,))
-            row = cur.fetchone()
-            if row is None:
-                cur.execute(
-                    """
-                    INSERT INTO synopses (session_id, title)
-                    VALUES (%s::uuid, %s)
-                    RETURNING id::text AS id
-                    """,
-                    (session_id, body.title),
-                )
-                syn_id = cur.fetchone()["id"]
-            else:
-                syn_id = row["id"]
-
-            # New version number
-            cur.execute("SELECT COALESCE(MAX(version_num), 0) + 1 AS v FROM synopsis_versions WHERE synopsis_id = %s::uuid", (syn_id,))
-            v = cur.fetchone()["v"]
-
-            # Insert version
-            cur.execute(
-                """
-                INSERT INTO synopsis_versions (synopsis_id, version_num, items_json, kind)
-                VALUES (%s::uuid, %s, %s::jsonb, 'generated')
-                RETURNING id::text AS id, to_char(created_at AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS created
-                """,
-                (syn_id, v, json.dumps(body.items)),
-            )
-            version_row = cur.fetchone()
-
-            # Update pointer
-            cur.execute(
-                """
-                UPDATE synopses SET title = %s, current_version_id = %s::uuid, updated_at = now()
-                WHERE id = %s::uuid
-                """,
-                (body.title, version_row["id"], syn_id),
-            )
-
-            return SynopsisOut(title=body.title, items=body.items, lastUpdated=version_row["created"])  # type: ignore[index]
+async def upsert_synopsis(session_id: str, body: SynopsisIn) -> SynopsisOut:
+    async with db() as conn:
+        version = await repo.save_synopsis_version(conn, session_id, title=body.title, items=body.items)
+    return SynopsisOut(title=body.title, items=body.items, lastUpdated=version["created"])
 
 
 # ----------------------------------------------------------------------------
@@ -526,12 +443,16 @@ def upsert_synopsis(session_id: str, body: SynopsisIn) -> SynopsisOut:
 try:
     # Подключаем пакет агентов, если доступен
     from agents import autodiscover, autodiscover_prompts
-    from agents.registry import get_agent
+    from agents.metrics import phase
+    from agents.base import Event
     from agents.runner import run_agent_with_events
-    from agents.memory.in_memory import InMemoryMemory
-    from agents.memory.backend_memory import BackendMemory
-    from agents.llm.base import LLMResponse
-    from agents.llm.openai_llm import OpenAILLM
+    from agents.singleflight import aclose_singleflight, get_singleflight, run_key
+    from agents.container import AgentContainer
+    from agents.memory import PostgresMemory, RedisShortTerm, SummarizingMemory, TieredMemory
+    from agents.memory.base import session_or_ephemeral
+    from agents.trace_metrics import install_trace_metrics
+    from agents.trace_store import PostgresTraceSink
+    from agents.tracing import Trace
     _AGENTS_AVAILABLE = True
 except Exception:  # pragma: no cover - пакет агентов может быть недоступен
     _AGENTS_AVAILABLE = False
@@ -539,48 +460,80 @@ except Exception:  # pragma: no cover - пакет агентов может б
 try:
     # AICODE-NOTE: Очередь фоновых заданий (Redis/RQ)
     from backend.worker.queue import get_redis_and_queue
-    from backend.worker.tasks import run_agent_job
+    from backend.worker.tasks import flush_memory_job, run_agent_job, summarize_dialog_job
     _JOBS_AVAILABLE = True
 except Exception:
     _JOBS_AVAILABLE = False
 
 
-@app.on_event("startup")
-def _agents_autodiscover_startup() -> None:  # pragma: no cover - простая инициализация
-    if _AGENTS_AVAILABLE:
-        try:
-            autodiscover()
-            autodiscover_prompts()
-        except Exception:
-            pass
+def _agents() -> "AgentContainer":
+    """Контейнер агентов из lifespan; 501, если пакет агентов недоступен."""
+    if not _AGENTS_AVAILABLE or state.agents is None:
+        raise HTTPException(status_code=501, detail="Agents package is not available")
+    return state.agents
+
+
+def _enqueue_job(func, job_payload: Dict[str, Any]) -> str:
+    """Положить задачу в очередь RQ (синхронный Redis — вызывать через run_in_threadpool)."""
+    _, rq_queue = get_redis_and_queue()
+    job_timeout = int(os.getenv("AGENT_JOB_TIMEOUT", "900"))
+    result_ttl = int(os.getenv("AGENT_RESULT_TTL", "600"))
+    job = rq_queue.enqueue(func, job_payload, job_timeout=job_timeout, result_ttl=result_ttl)
+    return job.id
+
+
+def _enqueue_agent_job(job_payload: Dict[str, Any]) -> str:
+    return _enqueue_job(run_agent_job, job_payload)
+
+
+def _tiered_memory_enabled() -> bool:
+    return (
+        _JOBS_AVAILABLE
+        and bool(os.getenv("REDIS_URL"))
+        and os.getenv("AGENTS_MEMORY_TIERED", "0") in {"1", "true", "True", "yes"}
+    )
+
+
+async def _schedule_memory_flush() -> None:
+    """Планировщик TieredMemory: сброс очереди write‑behind в chat_messages — задачей воркера."""
+    try:
+        await run_in_threadpool(_enqueue_job, flush_memory_job, {})
+    except Exception:
+        logger.exception("failed to enqueue write-behind flush")
+
+
+async def _schedule_summary_job(session_id: str, role_policy: Dict[str, Any]) -> None:
+    """Планировщик SummarizingMemory: обновление конспекта диалога — задачей воркера, не в запросе."""
+    try:
+        await run_in_threadpool(
+            _enqueue_job,
+            summarize_dialog_job,
+            {"session_id": session_id, "role_policy": role_policy, "memory": "postgres"},
+        )
+    except Exception:
+        logger.exception("Failed to enqueue summarize_dialog_job for %s", session_id)
 
 
 class RunPlannerIn(BaseModel):
     session_id: Optional[str] = None
     query: Dict[str, Any]
-    memory: Optional[str] = Field(default="inmem", pattern="^(backend|inmem)$")
+    memory: Optional[str] = Field(default="inmem", pattern="^(backend|inmem|postgres)$")
 
 
 @app.post("/agents/learning_planner/v1/plan")
 async def run_learning_planner_plan(body: RunPlannerIn) -> Dict[str, Any]:
-    if not _AGENTS_AVAILABLE:
-        raise HTTPException(status_code=501, detail="Agents package is not available")
-
-    # Память
-    if body.memory == "backend":
-        memory = BackendMemory()
-        session_id = body.session_id or "dev-session"
-    else:
-        memory = InMemoryMemory()
-        session_id = body.session_id or "dev-session"
-
-    llm = OpenAILLM()
+    container = _agents()
+    session_id = session_or_ephemeral(body.session_id)
+    memory = body.memory or "inmem"
 
-    # Агент
-    agent = get_agent("learning_planner", "v1", memory=memory, llm=llm)
+    # Агент (общий инстанс с памятью по флагу и общим LLM)
+    agent = container.agent("learning_planner", "v1", memory=memory)
 
+    # AICODE-NOTE: Одинаковые конкурентные запросы (двойной клик, ретраи) делят один запуск — и между репликами.
+    # Без session_id память изолирована случайной сессией, но ключ коалесинга от неё не зависит
+    flight_key = None if body.session_id else run_key("learning_planner", "v1", "", {"query": body.query, "memory": memory})
     final_payload: Optional[Dict[str, Any]] = None
-    async for ev in run_agent_with_events(agent, session_id=session_id, query=body.query):
+    async for ev in get_singleflight().run_agent(agent, flight_key=flight_key, session_id=session_id, query=body.query):
         if ev.event == "final_result":
             final_payload = ev.payload or {}
 
@@ -593,7 +546,7 @@ async def run_learning_planner_plan(body: RunPlannerIn) -> Dict[str, Any]:
 class RunSynopsisIn(BaseModel):
     session_id: Optional[str] = None
     query: Dict[str, Any]
-    memory: Optional[str] = Field(default="inmem", pattern="^(backend|inmem)$")
+    memory: Optional[str] = Field(default="inmem", pattern="^(backend|inmem|postgres)$")
 
 
 @app.post("/agents/synopsis_manager/v1/synopsis")
@@ -601,20 +554,15 @@ async def run_synopsis_manager_synopsis(
     body: RunSynopsisIn,
     mode: str = Query("sync", pattern="^(background|sync)$"),
 ) -> Dict[str, Any]:
-    if not _AGENTS_AVAILABLE:
-        raise HTTPException(status_code=501, detail="Agents package is not available")
+    container = _agents()
 
     # AICODE-NOTE: background режим — кладём задачу в очередь и сразу возвращаем 202 + jobId
     if mode == "background":
         if not _JOBS_AVAILABLE:
             raise HTTPException(status_code=501, detail="Jobs/worker is not available")
         try:
-            _, rq_queue = get_redis_and_queue()
-            from os import getenv
-            job_timeout = int(getenv("AGENT_JOB_TIMEOUT", "900"))
-            result_ttl = int(getenv("AGENT_RESULT_TTL", "600"))
-            job = rq_queue.enqueue(
-                run_agent_job,
+            job_id = await run_in_threadpool(
+                _enqueue_agent_job,
                 {
                     "agent_id": "synopsis_manager",
                     "version": "v1",
@@ -623,131 +571,165 @@ async def run_synopsis_manager_synopsis(
                     "query": body.query,
                     "apply_side_effects": True,
                 },
-                job_timeout=job_timeout,
-                result_ttl=result_ttl,
             )
-            return JSONResponse(status_code=202, content={"jobId": job.id})
+            return JSONResponse(status_code=202, content={"jobId": job_id})
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to enqueue job: {e}")
 
-    # Память
-    if body.memory == "backend":
-        memory = BackendMemory()
-        session_id = body.session_id or "dev-session"
-    else:
-        memory = InMemoryMemory()
-        session_id = body.session_id or "dev-session"
-
+    session_id = session_or_ephemeral(body.session_id)
+    memory = body.memory or "inmem"
+    agent = container.agent("synopsis_manager", "v1", memory=memory)
 
-    llm = OpenAILLM()
-
-    agent = get_agent("synopsis_manager", "v1", memory=memory, llm=llm)
+    async def synopsis_flight():
+        # Запись live‑конспекта — часть запуска: при коалесинге дубликатов версия сохраняется один раз
+        async for ev in run_agent_with_events(agent, session_id=session_id, query=body.query):
+            if ev.event == "final_result":
+                # Запуск ещё идёт (контекст раннера): время записи попадёт в метрики трейса
+                with phase("side_effects"):
+                    await _save_live_synopsis(session_id, body.query, ev.payload or {})
+            yield ev
 
     final_payload: Optional[Dict[str, Any]] = None
-    async for ev in run_agent_with_events(agent, session_id=session_id, query=body.query):
+    # Без session_id ключ не включает случайную сессию: дубликаты без сессии тоже склеиваются
+    key = run_key("synopsis_manager", "v1", body.session_id or "", {"query": body.query, "memory": memory})
+    async for ev in get_singleflight().stream(key, synopsis_flight):
         if ev.event == "final_result":
             final_payload = ev.payload or {}
 
     if not final_payload:
         raise HTTPException(status_code=500, detail="Agent did not produce a result")
 
-    # AICODE-NOTE: Сохраняем live‑конспект в БД (версионная схема)
-    synopsis = (final_payload or {}).get("synopsis") or {}
-    title = str(((body.query.get("params") or body.query).get("title")) or "Конспект")
-    items = synopsis.get("items", [])
-    with DB() as conn:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Проверим, что сессия существует (иначе могли использовать inmem)
-            cur.execute(
-                """
-                SELECT ts.id::text AS id
-                FROM track_sessions ts
-                WHERE ts.id = %s::uuid
-                """,
-                (session_id,),
-            )
-            if cur.fetchone() is None:
-                return final_payload
-
-            # Контейнер синопсиса
-            cur.execute("SELECT id::text AS id FROM synopses WHERE session_id = %s::uuid", (session_id,))
-            row = cur.fetchone()
-            if row is None:
-                cur.execute(
-                    """
-                    INSERT INTO synopses (session_id, title)
-                    VALUES (%s::uuid, %s)
-                    RETURNING id::text AS id
-                    """,
-                    (session_id, title),
-                )
-                syn_id = cur.fetchone()["id"]
-            else:
-                syn_id = row["id"]
-
-            # Следующий номер версии
-            cur.execute(
-                "SELECT COALESCE(MAX(version_num), 0) + 1 AS v FROM synopsis_versions WHERE synopsis_id = %s::uuid",
-                (syn_id,),
-            )
-            v = cur.fetchone()["v"]
-
-            # Новая версия и перенос указателя current_version_id
-            cur.execute(
-                """
-                INSERT INTO synopsis_versions (synopsis_id, version_num, items_json, kind)
-                VALUES (%s::uuid, %s, %s::jsonb, 'generated')
-                RETURNING id::text AS id
-                """,
-                (syn_id, v, json.dumps(items)),
-            )
-            ver_id = cur.fetchone()["id"]
-            cur.execute(
-                "UPDATE synopses SET title = %s, current_version_id = %s::uuid, updated_at = now() WHERE id = %s::uuid",
-                (title, ver_id, syn_id),
-            )
-
     return final_payload
 
 
+async def _save_live_synopsis(session_id: str, query: Dict[str, Any], final_payload: Dict[str, Any]) -> None:
+    """AICODE-NOTE: Сохраняем live‑конспект в БД (версионная схема)."""
+    synopsis = final_payload.get("synopsis") or {}
+    if not synopsis:
+        return
+    title = str(((query.get("params") or query).get("title")) or "Конспект")
+    items = synopsis.get("items", [])
+    try:
+        uuid.UUID(session_id)
+    except ValueError:
+        return  # одноразовая/dev‑сессия без записи в БД
+    async with db() as conn:
+        # Проверим, что сессия существует (иначе могли использовать inmem)
+        if await repo.session_exists(conn, session_id):
+            await repo.save_synopsis_version(conn, session_id, title=title, items=items)
+
+
 @app.post("/run/agent/{agent_id}/{version}")
 async def run_agent_sse(
     request: Request,
     agent_id: str,
     version: str,
-    memory: str = Query("inmem", pattern="^(backend|inmem)$"),
+    memory: str = Query("inmem", pattern="^(backend|inmem|postgres)$"),
     body: Dict[str, Any] = Body(..., example={"session_id": "...", "query": {}}),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=IDEMPOTENCY_KEY_MAX_LENGTH),
 ):
-    if not _AGENTS_AVAILABLE:
-        raise HTTPException(status_code=501, detail="Agents package is not available")
-
-    # Память
-    if memory == "backend":
-        mem = BackendMemory()
-        session_id = body.get("session_id") or "dev-session"
-    else:
-        mem = InMemoryMemory()
-        session_id = body.get("session_id") or "dev-session"
-
-    llm = OpenAILLM()
+    container = _agents()
+    session_id = session_or_ephemeral(body.get("session_id"))
+    try:
+        agent = container.agent(agent_id, version, memory=memory)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
-    agent = get_agent(agent_id, version, memory=mem, llm=llm)
+    run_payload = {k: v for k, v in body.items() if k not in {"session_id", "cache_scope", "no_cache"}}
+    run_payload.update(await _cache_run_options(request, agent_id, session_id, no_cache=bool(body.get("no_cache"))))
+    # Повтор хода с тем же ключом не создаёт второе сообщение в истории
+    if idempotency_key:
+        run_payload["idempotency_key"] = idempotency_key
 
-    async def event_stream() -> AsyncIterator[str]:
+    async def event_stream() -> AsyncIterator[bytes]:
         try:
-            async for ev in run_agent_with_events(agent, session_id=session_id, **{k: v for k, v in body.items() if k != "session_id"}):
-                yield f"event: {ev.event}\n"
-                yield "data: " + json.dumps({
-                    "event": ev.event,
-                    "session_id": ev.session_id,
-                    "trace_id": ev.trace_id,
-                    "payload": ev.payload or {},
-                }) + "\n\n"
+            async for ev in run_agent_with_events(agent, session_id=session_id, **run_payload):
+                # Готовый кадр события (кодируется один раз, orjson) — без промежуточных dict/str на каждую дельту
+                yield ev.sse()
         except Exception as e:
-            yield "event: error\n"
-            yield "data: " + json.dumps({"event": "error", "payload": {"message": str(e)}}) + "\n\n"
+            yield Event(event="error", session_id=session_id, trace_id="", payload={"message": str(e)}).sse()
+
+    # AICODE-NOTE: Отключаем буферизацию прокси, чтобы события `token` доходили до клиента сразу
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _cache_run_options(request: Request, agent_id: str, session_id: str, *, no_cache: bool = False) -> Dict[str, Any]:
+    """Параметры кэшей LLM для запуска агента (SSE и JSON‑маршруты).
+
+    AICODE-NOTE: Обход кэшей — `no_cache: true` в теле или `Cache-Control: no-cache`; семантический кэш делится
+    ответами в пределах трека: область — slug трека сессии.
+    """
+    options: Dict[str, Any] = {}
+    if no_cache or "no-cache" in request.headers.get("cache-control", ""):
+        options["no_cache"] = True
+    if _agents().uses_semantic_cache(agent_id):
+        options["cache_scope"] = await _session_track_slug(session_id)
+    return options
+
+
+async def _session_track_slug(session_id: str) -> Optional[str]:
+    try:
+        uuid.UUID(session_id)
+    except ValueError:
+        return None  # dev/inmem‑сессия — область кэша ограничится самой сессией
+    try:
+        async with db() as conn:
+            return await repo.get_session_track_slug(conn, session_id)
+    except Exception:
+        logger.warning("failed to resolve track for session %s", session_id, exc_info=True)
+        return None
+
+
+@app.get("/agents/cache/stats")
+async def agents_cache_stats() -> Dict[str, Any]:
+    """Метрики кэшей LLM (точного и семантического): попадания, промахи, средние задержки."""
+    return _agents().cache_stats()
+
+
+@app.get("/agents/traces/stats")
+async def agents_trace_stats() -> Dict[str, Any]:
+    """Метрики записи трейсов: очередь, записано, отброшено (переполнение/ошибки БД), время последнего батча."""
+    if state.trace_sink is None:
+        raise HTTPException(status_code=404, detail="Trace store is disabled")
+    return state.trace_sink.stats()
+
+
+@app.get("/agents/traces")
+async def list_agent_traces(
+    limit: int = Query(50, ge=1, le=500),
+    agent_id: Optional[str] = Query(None),
+    min_duration_ms: Optional[float] = Query(None, ge=0),
+) -> List[Dict[str, Any]]:
+    """Последние запуски агентов; `min_duration_ms` — только медленные (для разбора задержек)."""
+    async with db() as conn:
+        return await repo.list_agent_traces(conn, limit=limit, entity_id=agent_id, min_duration_ms=min_duration_ms)
+
+
+@app.get("/agents/traces/{trace_id}")
+async def get_agent_trace(trace_id: str) -> Dict[str, Any]:
+    """Трейс запуска с payload и событиями по порядку (без дельт токенов)."""
+    try:
+        uuid.UUID(trace_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    async with db() as conn:
+        trace = await repo.get_agent_trace(conn, trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace
 
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.get("/agents/memory/stats")
+async def agents_memory_stats() -> Dict[str, Any]:
+    """Метрики памяти агентов процесса: объём и выселения `inmem`, счётчики горячего уровня `TieredMemory`."""
+    stats = _agents().memory_stats()
+    if state.hot_memory is not None:
+        stats["tiered"] = dict(state.hot_memory.stats)
+    return stats
 
 
 # ----------------------------------------------------------------------------
@@ -757,7 +739,7 @@ async def run_agent_sse(
 
 class EnqueueAgentJobIn(BaseModel):
     session_id: Optional[str] = None
-    memory: Optional[str] = Field(default="inmem", pattern="^(backend|inmem)$")
+    memory: Optional[str] = Field(default="inmem", pattern="^(backend|inmem|postgres)$")
     query: Dict[str, Any]
     apply_side_effects: Optional[bool] = True
 
@@ -767,16 +749,12 @@ class EnqueueAgentJobOut(BaseModel):
 
 
 @app.post("/jobs/agents/{agent_id}/{version}", response_model=EnqueueAgentJobOut, status_code=202)
-def enqueue_agent_job(agent_id: str, version: str, body: EnqueueAgentJobIn) -> EnqueueAgentJobOut:
+async def enqueue_agent_job(agent_id: str, version: str, body: EnqueueAgentJobIn) -> EnqueueAgentJobOut:
     if not _JOBS_AVAILABLE:
         raise HTTPException(status_code=501, detail="Jobs/worker is not available")
     try:
-        _, rq_queue = get_redis_and_queue()
-        from os import getenv
-        job_timeout = int(getenv("AGENT_JOB_TIMEOUT", "900"))
-        result_ttl = int(getenv("AGENT_RESULT_TTL", "600"))
-        job = rq_queue.enqueue(
-            run_agent_job,
+        job_id = await run_in_threadpool(
+            _enqueue_agent_job,
             {
                 "agent_id": agent_id,
                 "version": version,
@@ -785,10 +763,8 @@ def enqueue_agent_job(agent_id: str, version: str, body: EnqueueAgentJobIn) -> E
                 "query": body.query,
                 "apply_side_effects": bool(body.apply_side_effects) if body.apply_side_effects is not None else True,
             },
-            job_timeout=job_timeout,
-            result_ttl=result_ttl,
         )
-        return EnqueueAgentJobOut(jobId=job.id)
+        return EnqueueAgentJobOut(jobId=job_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to enqueue job: {e}")
 
@@ -799,10 +775,8 @@ class JobStatusOut(BaseModel):
     error: Optional[str] = None
 
 
-@app.get("/jobs/{job_id}", response_model=JobStatusOut)
-def get_job_status(job_id: str) -> JobStatusOut:
-    if not _JOBS_AVAILABLE:
-        raise HTTPException(status_code=501, detail="Jobs/worker is not available")
+def _job_status(job_id: str) -> JobStatusOut:
+    # Синхронные обращения к Redis (fetch/status/result) — выполняется в threadpool
     try:
         from rq.job import Job  # type: ignore
         redis, _ = get_redis_and_queue()
@@ -839,18 +813,11 @@ def get_job_status(job_id: str) -> JobStatusOut:
     return JobStatusOut(status=status, result=result, error=error)
 
 
-# ----------------------------------------------------------------------------
-# Грейсфул-шатдаун пула БД
-# ----------------------------------------------------------------------------
-
-
-@app.on_event("shutdown")
-def shutdown_event() -> None:
-    if state.db_pool is not None:
-        try:
-            state.db_pool.closeall()
-        finally:
-            state.db_pool = None
+@app.get("/jobs/{job_id}", response_model=JobStatusOut)
+async def get_job_status(job_id: str) -> JobStatusOut:
+    if not _JOBS_AVAILABLE:
+        raise HTTPException(status_code=501, detail="Jobs/worker is not available")
+    return await run_in_threadpool(_job_status, job_id)
 
 
 # ----------------------------------------------------------------------------
@@ -861,45 +828,21 @@ def shutdown_event() -> None:
 class ChatAgentIn(BaseModel):
     session_id: Optional[str] = None
     user_message: str = Field(default="", min_length=0)
-    memory: Optional[str] = Field(default="inmem", pattern="^(backend|inmem)$")
+    memory: Optional[str] = Field(default="inmem", pattern="^(backend|inmem|postgres)$")
     apply_side_effects: Optional[bool] = True
+    no_cache: Optional[bool] = False
 
 
-def _append_assistant_message_safe(session_id: str, tab: str, text: str, meta: Dict[str, Any]) -> None:
-    """Best-effort запись сообщения ассистента в БД.
-
-    Если сессии/ветки нет — просто выходим без исключений.
-    """
-    try:
-        with DB() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                try:
-                    thread_id = _get_thread_id_or_404(cur, session_id, tab)
-                except HTTPException:
-                    return
-                cur.execute(
-                    """
-                    INSERT INTO chat_messages (thread_id, role, content, meta_json)
-                    VALUES (%s::uuid, 'assistant'::message_role, %s, %s::jsonb)
-                    """,
-                    (thread_id, text, json.dumps(meta)),
-                )
-    except Exception:
-        # Проглатываем ошибки записи — это побочный эффект
-        pass
-
-
-async def _run_dialog_agent(agent_id: str, body: ChatAgentIn) -> Dict[str, Any]:
-    if not _AGENTS_AVAILABLE:
-        raise HTTPException(status_code=501, detail="Agents package is not available")
+async def _run_dialog_agent(
+    request: Request, agent_id: str, body: ChatAgentIn, idempotency_key: Optional[str]
+) -> Dict[str, Any]:
+    container = _agents()
 
-    # Память: для диалоговых агентов всегда используем BackendMemory,
-    # чтобы учитывать контекст из БД (ветки chat/practice/simulation),
+    # Память: для диалоговых агентов всегда используем БД (PostgresMemory через общий пул),
+    # чтобы учитывать контекст из веток chat/practice/simulation,
     # вне зависимости от флага memory. InMemoryMemory подходит только для CLI.
-    mem = BackendMemory()
-    session_id = body.session_id or "dev-session"
+    session_id = session_or_ephemeral(body.session_id)
 
-    llm = OpenAILLM()
     # Прокинем вкладку в роль, чтобы память грузила правильный поток
     tab_by_agent = {
         "mentor_chat": "chat",
@@ -907,10 +850,20 @@ async def _run_dialog_agent(agent_id: str, body: ChatAgentIn) -> Dict[str, Any]:
         "simulation_mentor": "simulation",
     }
     role_policy = {"tab": tab_by_agent.get(agent_id, "chat")}
-    agent = get_agent(agent_id, "v1", memory=mem, role_policy=role_policy, llm=llm)
-
+    agent = container.agent(agent_id, "v1", memory="postgres", role_policy=role_policy)
+
+    # AICODE-NOTE: Ответ ассистента пишет сам агент (memory.append в ветку вкладки) — ровно одна запись на ход.
+    # apply_side_effects=false — запуск без записи; Idempotency-Key — повтор запроса не создаёт второе сообщение.
+    run_payload: Dict[str, Any] = {
+        "session_id": session_id,
+        "user_message": body.user_message,
+        "persist": body.apply_side_effects is None or body.apply_side_effects,
+    }
+    run_payload.update(await _cache_run_options(request, agent_id, session_id, no_cache=bool(body.no_cache)))
+    if idempotency_key:
+        run_payload["idempotency_key"] = idempotency_key
     final_payload: Optional[Dict[str, Any]] = None
-    async for ev in run_agent_with_events(agent, session_id=session_id, user_message=body.user_message):
+    async for ev in run_agent_with_events(agent, **run_payload):
         if ev.event == "final_result":
             final_payload = ev.payload or {}
 
@@ -921,34 +874,30 @@ async def _run_dialog_agent(agent_id: str, body: ChatAgentIn) -> Dict[str, Any]:
 
 
 @app.post("/agents/mentor_chat/v1/reply")
-async def run_mentor_chat(body: ChatAgentIn) -> Dict[str, Any]:
-    payload = await _run_dialog_agent("mentor_chat", body)
-    # Побочный эффект: записать ответ ассистента в ветку chat
-    if (body.apply_side_effects is None or body.apply_side_effects) and body.session_id:
-        text = str((payload or {}).get("message", ""))
-        if text:
-            _append_assistant_message_safe(body.session_id, "chat", text, {"agentId": "mentor_chat", "version": "v1"})
-    return payload
+async def run_mentor_chat(
+    request: Request,
+    body: ChatAgentIn,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=IDEMPOTENCY_KEY_MAX_LENGTH),
+) -> Dict[str, Any]:
+    return await _run_dialog_agent(request, "mentor_chat", body, idempotency_key)
 
 
 @app.post("/agents/practice_coach/v1/hint")
-async def run_practice_coach(body: ChatAgentIn) -> Dict[str, Any]:
-    payload = await _run_dialog_agent("practice_coach", body)
-    if (body.apply_side_effects is None or body.apply_side_effects) and body.session_id:
-        text = str((payload or {}).get("message", ""))
-        if text:
-            _append_assistant_message_safe(body.session_id, "practice", text, {"agentId": "practice_coach", "version": "v1"})
-    return payload
+async def run_practice_coach(
+    request: Request,
+    body: ChatAgentIn,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=IDEMPOTENCY_KEY_MAX_LENGTH),
+) -> Dict[str, Any]:
+    return await _run_dialog_agent(request, "practice_coach", body, idempotency_key)
 
 
 @app.post("/agents/simulation_mentor/v1/turn")
-async def run_simulation_mentor(body: ChatAgentIn) -> Dict[str, Any]:
-    payload = await _run_dialog_agent("simulation_mentor", body)
-    if (body.apply_side_effects is None or body.apply_side_effects) and body.session_id:
-        text = str((payload or {}).get("message", ""))
-        if text:
-            _append_assistant_message_safe(body.session_id, "simulation", text, {"agentId": "simulation_mentor", "version": "v1"})
-    return payload
+async def run_simulation_mentor(
+    request: Request,
+    body: ChatAgentIn,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=IDEMPOTENCY_KEY_MAX_LENGTH),
+) -> Dict[str, Any]:
+    return await _run_dialog_agent(request, "simulation_mentor", body, idempotency_key)
 
 
 
@@ -0,0 +1,142 @@
+"""
+// AICODE-NOTE: Метрики API для Prometheus (`GET /metrics`, см. backend/API.md).
+
+- `http_request_duration_seconds{method,route,status}` — латентность по шаблону маршрута
+  (`/tracks/{track_id}`, а не фактический путь — иначе кардинальность меток не ограничена).
+  Для SSE/стриминга это время до начала ответа (заголовков), а не до конца стрима.
+- Состояние процесса (пул БД, кэши LLM, очередь трейсов, память агентов) снимается коллектором в момент
+  скрейпа из уже имеющихся `stats()` — на пути запросов ничего не считается дважды.
+- `prometheus_client` — опциональная зависимость: без неё middleware не ставится, `/metrics` отвечает 501.
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Any, Callable, Dict, Iterator, Optional
+
+try:
+    import prometheus_client  # type: ignore
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Histogram, generate_latest  # type: ignore
+    from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily  # type: ignore
+except Exception:  # pragma: no cover - опциональная зависимость
+    prometheus_client = None  # type: ignore
+
+
+_HTTP_LATENCY: Any = None
+if prometheus_client is not None:
+    _HTTP_LATENCY = Histogram(
+        "http_request_duration_seconds",
+        "HTTP request latency by route template",
+        ["method", "route", "status"],
+        buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+    )
+
+
+async def http_metrics_middleware(request: Any, call_next: Callable) -> Any:
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Маршрут известен только после роутинга; 404 и прочее без маршрута — одной меткой
+        route = request.scope.get("route")
+        template = getattr(route, "path", None) or "<unmatched>"
+        _HTTP_LATENCY.labels(request.method, template, str(status)).observe(time.perf_counter() - started)
+
+
+class AppCollector:
+    """Коллектор состояния процесса API: `sources()` возвращает текущие пул/контейнер/приёмник трейсов."""
+
+    def __init__(self, sources: Callable[[], Dict[str, Any]]) -> None:
+        self.sources = sources
+
+    def collect(self) -> Iterator[Any]:
+        src = self.sources()
+        yield from _pool_metrics(src.get("pool"))
+        agents = src.get("agents")
+        if agents is not None:
+            yield from _cache_metrics(agents.cache_stats())
+            yield from _memory_metrics(agents.memory_stats())
+        trace_sink = src.get("trace_sink")
+        if trace_sink is not None:
+            yield from _trace_store_metrics(trace_sink.stats())
+
+
+def _pool_metrics(pool: Any) -> Iterator[Any]:
+    if pool is None:
+        return
+    stats = pool.get_stats()
+    gauges = {
+        "pool_size": ("db_pool_size", "Connections currently open"),
+        "pool_available": ("db_pool_available", "Idle connections in the pool"),
+        "requests_waiting": ("db_pool_requests_waiting", "Requests waiting for a connection"),
+    }
+    for key, (name, doc) in gauges.items():
+        yield GaugeMetricFamily(name, doc, value=stats.get(key, 0))
+    yield GaugeMetricFamily("db_pool_max_size", "Configured pool max size", value=getattr(pool, "max_size", 0))
+    counters = {
+        "requests_num": ("db_pool_requests", "Connection requests"),
+        "requests_queued": ("db_pool_requests_queued", "Connection requests that had to wait"),
+        "requests_errors": ("db_pool_requests_errors", "Connection requests that failed"),
+        "requests_wait_ms": ("db_pool_requests_wait_ms", "Total time spent waiting for a connection, ms"),
+    }
+    # get_stats() отдаёт накопленные значения; счётчики есть не во всех версиях psycopg_pool
+    for key, (name, doc) in counters.items():
+        if key in stats:
+            yield CounterMetricFamily(name, doc, value=stats[key])
+
+
+def _cache_metrics(cache_stats: Dict[str, Dict[str, Any]]) -> Iterator[Any]:
+    hits = CounterMetricFamily("agents_llm_cache_hits", "LLM cache hits", labels=["cache", "tier"])
+    misses = CounterMetricFamily("agents_llm_cache_misses", "LLM cache misses", labels=["cache"])
+    ratio = GaugeMetricFamily("agents_llm_cache_hit_ratio", "LLM cache hit ratio since start", labels=["cache"])
+    for name, stats in cache_stats.items():
+        # CachedLLM: hits по уровням ({"memory": n, "redis": n}); SemanticCacheLLM: одно число
+        value = stats.get("hits", 0)
+        for tier, count in (value.items() if isinstance(value, dict) else [("", value)]):
+            hits.add_metric([name, tier], count)
+        misses.add_metric([name], stats.get("misses", 0))
+        ratio.add_metric([name], stats.get("hit_ratio", 0.0))
+    yield hits
+    yield misses
+    yield ratio
+
+
+def _memory_metrics(memory_stats: Dict[str, Dict[str, Any]]) -> Iterator[Any]:
+    inmem: Optional[Dict[str, Any]] = memory_stats.get("inmem")
+    if not inmem:
+        return
+    yield GaugeMetricFamily("agents_inmem_sessions", "Sessions held by InMemoryMemory", value=inmem.get("sessions", 0))
+    yield GaugeMetricFamily("agents_inmem_bytes", "Approximate bytes held by InMemoryMemory", value=inmem.get("bytes", 0))
+
+
+def _trace_store_metrics(stats: Dict[str, Any]) -> Iterator[Any]:
+    yield GaugeMetricFamily("agents_trace_queue_depth", "Trace records waiting to be written", value=stats.get("queue_depth", 0))
+    yield CounterMetricFamily("agents_trace_dropped", "Trace records dropped", value=stats.get("dropped", 0))
+    yield CounterMetricFamily("agents_trace_written", "Trace records written", value=stats.get("written", 0))
+
+
+_COLLECTOR: Optional[AppCollector] = None
+
+
+def install_app_metrics(sources: Callable[[], Dict[str, Any]]) -> bool:
+    """Зарегистрировать коллектор состояния процесса (один раз на процесс); False — нет prometheus_client."""
+    global _COLLECTOR
+    if prometheus_client is None:
+        return False
+    if _COLLECTOR is None:
+        _COLLECTOR = AppCollector(sources)
+        REGISTRY.register(_COLLECTOR)
+    else:
+        _COLLECTOR.sources = sources
+    return True
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Текст экспозиции Prometheus и его content‑type."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+__all__ = ["AppCollector", "http_metrics_middleware", "install_app_metrics", "prometheus_client", "render_metrics"]
@@ -0,0 +1,442 @@
+"""
+// AICODE-NOTE: Async-репозиторий API: SQL по трекам, сессиям, веткам, сообщениям и конспектам.
+
+- Каждая функция принимает соединение psycopg3 (`async with db() as conn`) — транзакцию задаёт вызывающий.
+- Ничего не знает про HTTP: «не найдено» — это `None`, статус-коды выставляет роут.
+- Строки возвращаются как dict (курсор с `dict_row`), формы совпадают с Pydantic-схемами `main.py`.
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from psycopg.rows import dict_row
+
+
+_ISO_UTC = """'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"'"""
+_MESSAGE_COLUMNS = f"""
+    id::text AS id,
+    role::text AS role,
+    content,
+    to_char(created_at AT TIME ZONE 'UTC', {_ISO_UTC}) AS created_at,
+    meta_json AS meta
+"""
+
+
+async def _fetchone(conn, sql: str, params: Sequence[Any] = ()) -> Optional[Dict[str, Any]]:
+    async with conn.cursor(row_factory=dict_row) as cur:
+        await cur.execute(sql, params)
+        return await cur.fetchone()
+
+
+async def _fetchall(conn, sql: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+    async with conn.cursor(row_factory=dict_row) as cur:
+        await cur.execute(sql, params)
+        return await cur.fetchall()
+
+
+# ----------------------------------------------------------------------------
+# Tracks
+# ----------------------------------------------------------------------------
+
+
+async def list_tracks(conn) -> List[Dict[str, Any]]:
+    return await _fetchall(
+        conn,
+        """
+        SELECT id::text AS id, slug, title, description, goal
+        FROM tracks
+        ORDER BY created_at ASC
+        """,
+    )
+
+
+async def get_track(conn, slug: str) -> Optional[Dict[str, Any]]:
+    return await _fetchone(
+        conn,
+        """
+        SELECT id::text AS id, slug, title, description, goal
+        FROM tracks
+        WHERE slug = %s
+        """,
+        (slug,),
+    )
+
+
+async def create_track(
+    conn,
+    *,
+    title: str,
+    description: Optional[str],
+    goal: Optional[str],
+    desired_slug: str,
+    roadmap: Sequence[str],
+) -> Dict[str, Any]:
+    # Подбираем уникальный slug
+    slug = desired_slug
+    suffix = 2
+    while await _fetchone(conn, "SELECT 1 AS one FROM tracks WHERE slug = %s", (slug,)) is not None:
+        slug = f"{desired_slug}-{suffix}"
+        suffix += 1
+
+    row = await _fetchone(
+        conn,
+        """
+        INSERT INTO tracks (slug, title, description, goal)
+        VALUES (%s, %s, %s, %s)
+        RETURNING id::text AS id, slug, title, description, goal
+        """,
+        (slug, title, description, goal),
+    )
+    assert row is not None
+
+    # Роадмап — одним executemany (pipeline в psycopg3)
+    if roadmap:
+        async with conn.cursor() as cur:
+            await cur.executemany(
+                """
+                INSERT INTO track_roadmap_items (track_id, position, text, done)
+                VALUES (%s::uuid, %s, %s, false)
+                """,
+                [(row["id"], position, text.strip()) for position, text in enumerate(roadmap, start=1)],
+            )
+    return row
+
+
+async def get_track_roadmap(conn, slug: str) -> List[Dict[str, Any]]:
+    return await _fetchall(
+        conn,
+        """
+        SELECT tri.id::text AS id, tri.position, tri.text, tri.done
+        FROM track_roadmap_items tri
+        JOIN tracks t ON t.id = tri.track_id
+        WHERE t.slug = %s
+        ORDER BY tri.position ASC
+        """,
+        (slug,),
+    )
+
+
+# ----------------------------------------------------------------------------
+# Sessions / threads
+# ----------------------------------------------------------------------------
+
+
+async def upsert_session(conn, *, device_id: str, track_slug: str) -> Optional[str]:
+    """Upsert пользователя и сессии трека, обеспечить ветки чатов. `None` — трека нет."""
+    track = await _fetchone(conn, "SELECT id::text AS id FROM tracks WHERE slug = %s", (track_slug,))
+    if track is None:
+        return None
+
+    # AICODE-NOTE: Upsert пользователя по device_id
+    user = await _fetchone(
+        conn,
+        """
+        INSERT INTO users (device_id) VALUES (%s)
+        ON CONFLICT (device_id) DO UPDATE SET updated_at = now()
+        RETURNING id::text AS id
+        """,
+        (device_id,),
+    )
+    assert user is not None
+
+    session = await _fetchone(
+        conn,
+        """
+        INSERT INTO track_sessions (user_id, track_id)
+        VALUES (%s::uuid, %s::uuid)
+        ON CONFLICT (user_id, track_id)
+        DO UPDATE SET updated_at = now()
+        RETURNING id::text AS id
+        """,
+        (user["id"], track["id"]),
+    )
+    assert session is not None
+    session_id = session["id"]
+
+    # Обеспечить ветки чатов (chat|practice|simulation) одним запросом
+    async with conn.cursor() as cur:
+        await cur.execute(
+            """
+            INSERT INTO chat_threads (session_id, tab)
+            SELECT %s::uuid, t::chat_tab FROM unnest(ARRAY['chat', 'practice', 'simulation']) AS t
+            ON CONFLICT (session_id, tab) DO NOTHING
+            """,
+            (session_id,),
+        )
+    return session_id
+
+
+async def session_exists(conn, session_id: str) -> bool:
+    row = await _fetchone(conn, "SELECT 1 AS one FROM track_sessions WHERE id = %s::uuid", (session_id,))
+    return row is not None
+
+
+async def get_session_track_slug(conn, session_id: str) -> Optional[str]:
+    row = await _fetchone(
+        conn,
+        """
+        SELECT t.slug
+        FROM track_sessions ts
+        JOIN tracks t ON t.id = ts.track_id
+        WHERE ts.id = %s::uuid
+        """,
+        (session_id,),
+    )
+    return row["slug"] if row else None
+
+
+async def get_thread_id(conn, session_id: str, tab: str) -> Optional[str]:
+    row = await _fetchone(
+        conn,
+        """
+        SELECT id::text AS id
+        FROM chat_threads
+        WHERE session_id = %s::uuid AND tab = %s::chat_tab
+        """,
+        (session_id, tab),
+    )
+    return row["id"] if row else None
+
+
+# ----------------------------------------------------------------------------
+# Messages
+# ----------------------------------------------------------------------------
+
+
+# AICODE-NOTE: Курсор сообщения — непрозрачная строка над ключом сортировки (created_at, id).
+# created_at хранится с микросекундами (а не ms, как в `created_at` ответа), иначе курсор неоднозначен.
+Cursor = Tuple[datetime, str]
+
+
+def encode_cursor(created_ts: datetime, message_id: str) -> str:
+    raw = f"{created_ts.isoformat()}|{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(value: str) -> Cursor:
+    """Разобрать курсор; `ValueError`, если строка не наша."""
+    try:
+        raw = base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode()
+        ts, message_id = raw.split("|", 1)
+        return datetime.fromisoformat(ts), str(uuid.UUID(message_id))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {value!r}") from e
+
+
+async def thread_version(conn, thread_id: str) -> Tuple[int, Optional[datetime]]:
+    """Версия ветки для ETag: (число сообщений, max(created_at)).
+
+    Сообщения только добавляются, поэтому пара меняется при каждой записи
+    (count — на случай нескольких строк с одним now() в одной транзакции).
+    """
+    row = await _fetchone(
+        conn,
+        "SELECT count(*) AS n, max(created_at) AS last FROM chat_messages WHERE thread_id = %s::uuid",
+        (thread_id,),
+    )
+    assert row is not None
+    return row["n"], row["last"]
+
+
+async def list_messages(
+    conn,
+    thread_id: str,
+    *,
+    before: Optional[Cursor] = None,
+    after: Optional[Cursor] = None,
+    limit: Optional[int] = None,
+    tail: bool = False,
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """Страница сообщений ветки по keyset‑курсору, всегда в порядке возрастания `(created_at, id)`.
+
+    - `after` — сообщения новее курсора, `before` — старше; без курсоров — с начала ветки;
+    - `tail=True` (или `before`) — берём `limit` ближайших к концу окна, т.е. «последние N»;
+    - без `limit` — всё окно целиком (прежнее поведение).
+
+    Возвращает `(rows, has_more)`; `has_more` — есть ли ещё строки в направлении листания.
+    У каждой строки есть `cursor` для следующего запроса. Диапазоны по created_at идут по
+    индексу `idx_chat_messages_thread_created`.
+    """
+    where = ["thread_id = %s::uuid"]
+    params: List[Any] = [thread_id]
+    if after is not None:
+        where.append("created_at >= %s AND (created_at > %s OR id > %s::uuid)")
+        params.extend((after[0], after[0], after[1]))
+    if before is not None:
+        where.append("created_at <= %s AND (created_at < %s OR id < %s::uuid)")
+        params.extend((before[0], before[0], before[1]))
+    newest_first = tail or (before is not None and after is None)
+    direction = "DESC" if newest_first else "ASC"
+    # limit + 1 — чтобы узнать, есть ли следующая страница, без отдельного count
+    params.append(limit + 1 if limit is not None else None)
+    rows = await _fetchall(
+        conn,
+        f"""
+        SELECT {_MESSAGE_COLUMNS}, created_at AS created_ts
+        FROM chat_messages
+        WHERE {" AND ".join(where)}
+        ORDER BY created_at {direction}, id {direction}
+        LIMIT %s
+        """,
+        params,
+    )
+    has_more = limit is not None and len(rows) > limit
+    if has_more:
+        rows = rows[:limit]
+    if newest_first:
+        rows.reverse()
+    for row in rows:
+        row["cursor"] = encode_cursor(row.pop("created_ts"), row["id"])
+    return rows, has_more
+
+
+async def insert_message(
+    conn,
+    thread_id: str,
+    *,
+    role: str,
+    content: str,
+    meta: Optional[Dict[str, Any]] = None,
+    idempotency_key: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Вставить сообщение; при повторе `idempotency_key` в той же ветке вернуть уже сохранённое."""
+    row = await _fetchone(
+        conn,
+        f"""
+        INSERT INTO chat_messages (thread_id, role, content, meta_json, idempotency_key)
+        VALUES (%s::uuid, %s::message_role, %s, %s::jsonb, %s)
+        ON CONFLICT DO NOTHING
+        RETURNING {_MESSAGE_COLUMNS}, created_at AS created_ts
+        """,
+        (thread_id, role, content, json.dumps(meta or {}), idempotency_key),
+    )
+    if row is None and idempotency_key is not None:
+        row = await _fetchone(
+            conn,
+            f"""
+            SELECT {_MESSAGE_COLUMNS}, created_at AS created_ts
+            FROM chat_messages
+            WHERE thread_id = %s::uuid AND idempotency_key = %s
+            """,
+            (thread_id, idempotency_key),
+        )
+    assert row is not None
+    row["cursor"] = encode_cursor(row.pop("created_ts"), row["id"])
+    return row
+
+
+# ----------------------------------------------------------------------------
+# Synopses (live + versions)
+# ----------------------------------------------------------------------------
+
+
+async def get_current_synopsis(conn, session_id: str) -> Optional[Dict[str, Any]]:
+    return await _fetchone(
+        conn,
+        f"""
+        SELECT s.title,
+               sv.items_json AS items,
+               to_char(sv.created_at AT TIME ZONE 'UTC', {_ISO_UTC}) AS last_updated
+        FROM synopses s
+        JOIN synopsis_versions sv ON sv.id = s.current_version_id
+        WHERE s.session_id = %s::uuid
+        """,
+        (session_id,),
+    )
+
+
+async def save_synopsis_version(conn, session_id: str, *, title: str, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Новая версия конспекта + перенос указателя `current_version_id`. Возвращает `{id, created}`."""
+    # Контейнер синопсиса (upsert по session_id)
+    syn = await _fetchone(conn, "SELECT id::text AS id FROM synopses WHERE session_id = %s::uuid", (session_id,))
+    if syn is None:
+        syn = await _fetchone(
+            conn,
+            """
+            INSERT INTO synopses (session_id, title)
+            VALUES (%s::uuid, %s)
+            RETURNING id::text AS id
+            """,
+            (session_id, title),
+        )
+    assert syn is not None
+    syn_id = syn["id"]
+
+    # Следующий номер версии и вставка версии одним запросом
+    version = await _fetchone(
+        conn,
+        f"""
+        INSERT INTO synopsis_versions (synopsis_id, version_num, items_json, kind)
+        SELECT %s::uuid, COALESCE(MAX(version_num), 0) + 1, %s::jsonb, 'generated'
+        FROM synopsis_versions WHERE synopsis_id = %s::uuid
+        RETURNING id::text AS id, to_char(created_at AT TIME ZONE 'UTC', {_ISO_UTC}) AS created
+        """,
+        (syn_id, json.dumps(items), syn_id),
+    )
+    assert version is not None
+
+    async with conn.cursor() as cur:
+        await cur.execute(
+            "UPDATE synopses SET title = %s, current_version_id = %s::uuid, updated_at = now() WHERE id = %s::uuid",
+            (title, version["id"], syn_id),
+        )
+    return version
+
+
+# ----------------------------------------------------------------------------
+# Agent traces (пишет agents/trace_store.py, здесь — только чтение для диагностики)
+# ----------------------------------------------------------------------------
+
+
+_TRACE_COLUMNS = f"""
+    id::text AS id,
+    entity_type,
+    entity_id,
+    version,
+    session_id,
+    status,
+    to_char(started_at AT TIME ZONE 'UTC', {_ISO_UTC}) AS started_at,
+    to_char(finished_at AT TIME ZONE 'UTC', {_ISO_UTC}) AS finished_at,
+    duration_ms,
+    event_count
+"""
+
+
+async def list_agent_traces(
+    conn, *, limit: int, entity_id: Optional[str] = None, min_duration_ms: Optional[float] = None
+) -> List[Dict[str, Any]]:
+    """Последние трейсы (новые сверху); `min_duration_ms` — только завершённые не быстрее порога."""
+    return await _fetchall(
+        conn,
+        f"""
+        SELECT {_TRACE_COLUMNS}
+        FROM agent_traces
+        WHERE (%s::text IS NULL OR entity_id = %s)
+          AND (%s::float8 IS NULL OR duration_ms >= %s)
+        ORDER BY started_at DESC
+        LIMIT %s
+        """,
+        (entity_id, entity_id, min_duration_ms, min_duration_ms, limit),
+    )
+
+
+async def get_agent_trace(conn, trace_id: str) -> Optional[Dict[str, Any]]:
+    trace = await _fetchone(conn, f"SELECT {_TRACE_COLUMNS}, payload FROM agent_traces WHERE id = %s::uuid", (trace_id,))
+    if trace is None:
+        return None
+    trace["events"] = await _fetchall(
+        conn,
+        f"""
+        SELECT seq, event, payload, to_char(created_at AT TIME ZONE 'UTC', {_ISO_UTC}) AS created_at
+        FROM agent_events
+        WHERE trace_id = %s::uuid
+        ORDER BY seq
+        """,
+        (trace_id,),
+    )
+    return trace
@@ -90,9 +90,14 @@ CREATE TABLE IF NOT EXISTS chat_messages (
   role message_role NOT NULL,
   content TEXT NOT NULL,
   meta_json JSONB NOT NULL DEFAULT '{}'::jsonb,
-  created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  -- Idempotency key of the writer (agent turn / client retry): one row per key within a thread
+  idempotency_key TEXT
 );
 CREATE INDEX IF NOT EXISTS idx_chat_messages_thread_created ON chat_messages(thread_id, created_at);
+ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_chat_messages_thread_idempotency
+  ON chat_messages(thread_id, idempotency_key) WHERE idempotency_key IS NOT NULL;
 
 -- Synopses: container + versioned history
 CREATE TYPE synopsis_version_kind AS ENUM ('generated', 'edited', 'imported');
@@ -122,6 +127,43 @@ ALTER TABLE synopses
   FOREIGN KEY (current_version_id) REFERENCES synopsis_versions(id)
   ON DELETE SET NULL;
 
+-- Agent memory KV per session (e.g. rolling dialog summary under key 'summary:<tab>')
+CREATE TABLE IF NOT EXISTS agent_kv (
+  session_id UUID NOT NULL REFERENCES track_sessions(id) ON DELETE CASCADE,
+  key TEXT NOT NULL,
+  value JSONB NOT NULL,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (session_id, key)
+);
+
+-- Agent run traces and their events (written in batches by agents/trace_store.py; no FK so a dropped
+-- trace row never blocks its events)
+CREATE TABLE IF NOT EXISTS agent_traces (
+  id UUID PRIMARY KEY,
+  entity_type TEXT NOT NULL,
+  entity_id TEXT NOT NULL,
+  version TEXT NOT NULL,
+  session_id TEXT,
+  status TEXT NOT NULL,
+  started_at TIMESTAMPTZ NOT NULL,
+  finished_at TIMESTAMPTZ,
+  duration_ms DOUBLE PRECISION,
+  event_count INT NOT NULL DEFAULT 0,
+  payload JSONB NOT NULL DEFAULT '{}'::jsonb
+);
+CREATE INDEX IF NOT EXISTS idx_agent_traces_started ON agent_traces(started_at DESC);
+CREATE INDEX IF NOT EXISTS idx_agent_traces_entity_started ON agent_traces(entity_id, started_at DESC);
+
+CREATE TABLE IF NOT EXISTS agent_events (
+  trace_id UUID NOT NULL,
+  seq INT NOT NULL,
+  event TEXT NOT NULL,
+  session_id TEXT,
+  payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+  created_at TIMESTAMPTZ NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_agent_events_trace ON agent_events(trace_id, seq);
+
 COMMIT;
 
 
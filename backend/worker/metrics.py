@@ -0,0 +1,119 @@
+"""
+// AICODE-NOTE: Экспортер метрик RQ‑воркера для Prometheus (HTTP на `AGENT_WORKER_METRICS_PORT`, 0 — выключен).
+
+- Очередь: `rq_queue_jobs{queue,state}` (queued/started/failed/scheduled/deferred) и длина очереди write‑behind
+  памяти (`agents_memory_writebehind_queue`) — снимаются из Redis в момент скрейпа.
+- Задачи: `rq_job_seconds{job,status}` — длительность `run_agent_job`/`summarize_dialog_job`/`flush_memory_job`.
+- Агенты/LLM: те же метрики, что в API (agents/trace_metrics.py), — подключаются при загрузке агентов.
+- Форкающий `Worker` выполняет задачу в дочернем процессе: метрики задач и LLM переживают его только в
+  multiprocess‑режиме prometheus_client — задайте `PROMETHEUS_MULTIPROC_DIR` (пустой каталог) до старта воркера.
+  Для `SimpleWorker` (один процесс) он не нужен.
+"""
+
+from __future__ import annotations
+
+import functools
+import logging
+import os
+import time
+from typing import Any, Callable, Iterator
+
+try:
+    import prometheus_client  # type: ignore
+    from prometheus_client import CollectorRegistry, Histogram, start_http_server  # type: ignore
+    from prometheus_client.core import GaugeMetricFamily  # type: ignore
+except Exception:  # pragma: no cover - опциональная зависимость
+    prometheus_client = None  # type: ignore
+
+from rq.registry import DeferredJobRegistry, FailedJobRegistry, ScheduledJobRegistry, StartedJobRegistry
+
+
+logger = logging.getLogger("agents.worker.metrics")
+
+
+_JOB_SECONDS: Any = None
+if prometheus_client is not None:
+    _JOB_SECONDS = Histogram(
+        "rq_job_seconds",
+        "RQ job duration",
+        ["job", "status"],
+        buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 900),
+    )
+
+
+def timed_job(func: Callable) -> Callable:
+    """Засечь длительность задачи RQ (`rq_job_seconds{job,status}`); no-op без prometheus_client."""
+    if _JOB_SECONDS is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = func(*args, **kwargs)
+            status = "success"
+            return result
+        finally:
+            _JOB_SECONDS.labels(func.__name__, status).observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+class QueueCollector:
+    """Глубина очереди и реестров RQ + очередь write‑behind; читается из Redis при каждом скрейпе."""
+
+    def __init__(self, redis: Any, queue: Any) -> None:
+        self.redis = redis
+        self.queue = queue
+
+    def collect(self) -> Iterator[Any]:
+        jobs = GaugeMetricFamily("rq_queue_jobs", "Jobs in the RQ queue and its registries", labels=["queue", "state"])
+        registries = {
+            "started": StartedJobRegistry,
+            "failed": FailedJobRegistry,
+            "scheduled": ScheduledJobRegistry,
+            "deferred": DeferredJobRegistry,
+        }
+        try:
+            jobs.add_metric([self.queue.name, "queued"], self.queue.count)
+            for state, registry in registries.items():
+                jobs.add_metric([self.queue.name, state], registry(queue=self.queue).count)
+            yield jobs
+            from agents.memory.tiered import WRITE_BEHIND_QUEUE  # type: ignore
+
+            yield GaugeMetricFamily(
+                "agents_memory_writebehind_queue",
+                "Messages waiting to be flushed to Postgres",
+                value=self.redis.llen(WRITE_BEHIND_QUEUE),
+            )
+        except Exception:
+            # Redis недоступен — скрейп не должен падать целиком
+            logger.warning("failed to collect queue metrics", exc_info=True)
+
+
+def start_exporter(redis: Any, queue: Any) -> bool:
+    """Поднять HTTP‑экспортер на `AGENT_WORKER_METRICS_PORT`; False — выключен или нет prometheus_client."""
+    try:
+        port = int(os.getenv("AGENT_WORKER_METRICS_PORT") or 0)
+    except ValueError:
+        port = 0
+    if port <= 0:
+        return False
+    if prometheus_client is None:
+        logger.warning("AGENT_WORKER_METRICS_PORT is set but prometheus_client is not installed")
+        return False
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess  # type: ignore
+
+        # Метрики дочерних процессов — из файлов каталога; сборщик очереди — в этом процессе
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    registry.register(QueueCollector(redis, queue))
+    start_http_server(port, addr=os.getenv("AGENT_WORKER_METRICS_ADDR", "0.0.0.0"), registry=registry)
+    return True
+
+
+__all__ = ["QueueCollector", "start_exporter", "timed_job"]
@@ -12,6 +12,7 @@ try:
 except Exception:  # pragma: no cover
     SimpleWorker = None  # type: ignore
 
+from .metrics import start_exporter
 from .queue import get_redis_and_queue
 
 
@@ -20,6 +21,7 @@ def main(argv: List[str] | None = None) -> int:
     // AICODE-NOTE: Точка входа RQ-воркера.
     Использует Redis из `REDIS_URL` и очередь из `AGENT_QUEUE`.
     Запускает `rq.Worker` и блокируется до SIGINT/SIGTERM.
+    Метрики Prometheus — на `AGENT_WORKER_METRICS_PORT` (см. backend/worker/metrics.py).
     """
     _argv = argv if argv is not None else sys.argv[1:]
 
@@ -34,6 +36,11 @@ def main(argv: List[str] | None = None) -> int:
         worker = Worker([queue], connection=redis)
         worker.log.info("Starting Worker (forking) on queue '%s'", queue.name)
 
+    if start_exporter(redis, queue):
+        worker.log.info("Metrics exporter listening on port %s", os.getenv("AGENT_WORKER_METRICS_PORT"))
+        if not simple and not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            worker.log.warning("Forking worker without PROMETHEUS_MULTIPROC_DIR: job and LLM metrics are not exported")
+
     # Грейсфул остановка по SIGTERM/SIGINT
     def _graceful_stop(signum, frame):  # type: ignore[no-untyped-def]
         try:
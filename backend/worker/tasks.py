@@ -2,20 +2,34 @@ from __future__ import annotations
 
 import asyncio
 import json
+import logging
 import os
-from typing import Any, Dict, Optional
+import time
+import uuid
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 
 # AICODE-NOTE: Импорт агентов
 from agents import autodiscover, autodiscover_prompts  # type: ignore
-from agents.registry import get_agent  # type: ignore
+from agents.container import AgentContainer  # type: ignore
+from agents.memory import SummarizingMemory  # type: ignore
+from agents.memory.base import session_or_ephemeral  # type: ignore
+from agents.memory.redis_short_term import _loads as _load_entry  # type: ignore
+from agents.memory.tiered import WRITE_BEHIND_LOCK, WRITE_BEHIND_QUEUE, WRITE_BEHIND_SCHEDULED  # type: ignore
+from agents.metrics import add_phase_ms  # type: ignore
 from agents.runner import run_agent_with_events  # type: ignore
-from agents.memory.in_memory import InMemoryMemory  # type: ignore
-from agents.memory.backend_memory import BackendMemory  # type: ignore
-from agents.llm.openai_llm import OpenAILLM  # type: ignore
+from agents.trace_metrics import install_trace_metrics  # type: ignore
+
+from backend.app.db import build_db_url_from_env
+
+from .metrics import timed_job
+from .queue import get_redis_and_queue
+
+
+logger = logging.getLogger("agents.worker.tasks")
 
 
 class AgentJobPayload(BaseModel):
@@ -28,20 +42,106 @@ class AgentJobPayload(BaseModel):
     apply_side_effects: bool = True
 
 
-def _build_memory(kind: str):
-    if kind == "backend":
-        return BackendMemory()
-    return InMemoryMemory()
+# AICODE-NOTE: Процессные синглтоны воркера. SimpleWorker живёт долго и выполняет задачи в одном процессе,
+# поэтому контейнер агентов (LLM‑пул, память) и event loop переиспользуются между задачами.
+_CONTAINER: Optional[AgentContainer] = None
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
 
 
-def _ensure_agents_loaded() -> None:
+def _ensure_agents_loaded() -> AgentContainer:
+    global _CONTAINER
+    if _CONTAINER is None:
+        try:
+            autodiscover()
+            autodiscover_prompts()
+        except Exception:
+            pass
+        _CONTAINER = AgentContainer()
+        # Запуски/LLM по агентам и моделям — в метрики воркера (no-op без prometheus_client)
+        install_trace_metrics()
+    return _CONTAINER
+
+
+def _run_sync(coro):
+    """Выполнить корутину на долгоживущем loop'е процесса (httpx‑пул привязан к loop'у)."""
+    global _LOOP
+    if _LOOP is None or _LOOP.is_closed():
+        _LOOP = asyncio.new_event_loop()
+    return _LOOP.run_until_complete(coro)
+
+
+def _save_live_synopsis_sync(session_id: str, query: Dict[str, Any], final_payload: Dict[str, Any]) -> None:
+    """Запись live‑конспекта (новая версия + перенос current_version_id) — побочный эффект synopsis_manager."""
     try:
-        autodiscover()
-        autodiscover_prompts()
+        synopsis = final_payload.get("synopsis") or {}
+        title = str(((query.get("params") or query).get("title")) or "Конспект")
+        items = synopsis.get("items", [])
+        # AICODE-NOTE: прямое сохранение в БД по схеме API (без импорта эндпоинта)
+        conn = psycopg2.connect(dsn=build_db_url_from_env())
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                # Проверим, что сессия существует
+                cur.execute(
+                    """
+                    SELECT ts.id::text AS id
+                    FROM track_sessions ts
+                    WHERE ts.id = %s::uuid
+                    """,
+                    (session_id,),
+                )
+                if cur.fetchone() is None:
+                    conn.rollback()
+                    return
+
+                # Контейнер синопсиса
+                cur.execute("SELECT id::text AS id FROM synopses WHERE session_id = %s::uuid", (session_id,))
+                row = cur.fetchone()
+                if row is None:
+                    cur.execute(
+                        """
+                        INSERT INTO synopses (session_id, title)
+                        VALUES (%s::uuid, %s)
+                        RETURNING id::text AS id
+                        """,
+                        (session_id, title),
+                    )
+                    syn_id = cur.fetchone()["id"]
+                else:
+                    syn_id = row["id"]
+
+                # Следующий номер версии
+                cur.execute(
+                    "SELECT COALESCE(MAX(version_num), 0) + 1 AS v FROM synopsis_versions WHERE synopsis_id = %s::uuid",
+                    (syn_id,),
+                )
+                v = cur.fetchone()["v"]
+
+                # Новая версия и перенос указателя current_version_id
+                cur.execute(
+                    """
+                    INSERT INTO synopsis_versions (synopsis_id, version_num, items_json, kind)
+                    VALUES (%s::uuid, %s, %s::jsonb, 'generated')
+                    RETURNING id::text AS id
+                    """,
+                    (syn_id, v, json.dumps(items)),
+                )
+                ver_id = cur.fetchone()["id"]
+                cur.execute(
+                    "UPDATE synopses SET title = %s, current_version_id = %s::uuid, updated_at = now() WHERE id = %s::uuid",
+                    (title, ver_id, syn_id),
+                )
+                conn.commit()
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
     except Exception:
+        # AICODE-NOTE: побочный эффект не должен падать всю задачу
         pass
 
 
+@timed_job
 def run_agent_job(payload_dict: Dict[str, Any]) -> Dict[str, Any]:
     """
     // AICODE-NOTE: Синхронная задача RQ.
@@ -50,12 +150,10 @@ def run_agent_job(payload_dict: Dict[str, Any]) -> Dict[str, Any]:
     """
     payload = AgentJobPayload.model_validate(payload_dict)
 
-    _ensure_agents_loaded()
-    memory = _build_memory(payload.memory)
-    session_id = payload.session_id or "dev-session"
-    llm = OpenAILLM()
+    container = _ensure_agents_loaded()
+    session_id = session_or_ephemeral(payload.session_id)
 
-    agent = get_agent(payload.agent_id, payload.version, memory=memory, llm=llm)
+    agent = container.agent(payload.agent_id, payload.version, memory=payload.memory)
 
     final_payload: Dict[str, Any] | None = None
 
@@ -68,90 +166,154 @@ def run_agent_job(payload_dict: Dict[str, Any]) -> Dict[str, Any]:
             return {}
         return final_payload
 
-    final_payload = asyncio.run(_run())
+    final_payload = _run_sync(_run())
 
-    # Доменные побочные эффекты (пример — live‑конспект)
+    # Доменные побочные эффекты (пример — live‑конспект); время — в метрики запуска (фаза side_effects)
     if payload.apply_side_effects and payload.agent_id == "synopsis_manager" and final_payload:
-        try:
-            synopsis = (final_payload or {}).get("synopsis") or {}
-            title = str(((payload.query.get("params") or payload.query).get("title")) or "Конспект")
-            items = synopsis.get("items", [])
-            # AICODE-NOTE: прямое сохранение в БД по схеме API (без импорта эндпоинта)
-            conn = psycopg2.connect(dsn=_build_db_url_from_env())
-            try:
-                with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                    # Проверим, что сессия существует
-                    cur.execute(
-                        """
-                        SELECT ts.id::text AS id
-                        FROM track_sessions ts
-                        WHERE ts.id = %s::uuid
-                        """,
-                        (session_id,),
-                    )
-                    if cur.fetchone() is None:
-                        conn.rollback()
-                        return final_payload or {}
-
-                    # Контейнер синопсиса
-                    cur.execute("SELECT id::text AS id FROM synopses WHERE session_id = %s::uuid", (session_id,))
-                    row = cur.fetchone()
-                    if row is None:
-                        cur.execute(
-                            """
-                            INSERT INTO synopses (session_id, title)
-                            VALUES (%s::uuid, %s)
-                            RETURNING id::text AS id
-                            """,
-                            (session_id, title),
-                        )
-                        syn_id = cur.fetchone()["id"]
-                    else:
-                        syn_id = row["id"]
-
-                    # Следующий номер версии
-                    cur.execute(
-                        "SELECT COALESCE(MAX(version_num), 0) + 1 AS v FROM synopsis_versions WHERE synopsis_id = %s::uuid",
-                        (syn_id,),
-                    )
-                    v = cur.fetchone()["v"]
-
-                    # Новая версия и перенос указателя current_version_id
-                    cur.execute(
-                        """
-                        INSERT INTO synopsis_versions (synopsis_id, version_num, items_json, kind)
-                        VALUES (%s::uuid, %s, %s::jsonb, 'generated')
-                        RETURNING id::text AS id
-                        """,
-                        (syn_id, v, json.dumps(items)),
-                    )
-                    ver_id = cur.fetchone()["id"]
-                    cur.execute(
-                        "UPDATE synopses SET title = %s, current_version_id = %s::uuid, updated_at = now() WHERE id = %s::uuid",
-                        (title, ver_id, syn_id),
-                    )
-                    conn.commit()
-            finally:
-                try:
-                    conn.close()
-                except Exception:
-                    pass
-        except Exception:
-            # AICODE-NOTE: побочный эффект не должен падать всю задачу
-            pass
+        started = time.perf_counter()
+        _save_live_synopsis_sync(session_id, payload.query, final_payload)
+        if isinstance(final_payload.get("metrics"), dict):
+            add_phase_ms(final_payload["metrics"], "side_effects", (time.perf_counter() - started) * 1000)
 
     return final_payload or {}
 
 
-def _build_db_url_from_env() -> str:
-    db_url = os.getenv("DB_URL")
-    if db_url:
-        return db_url
-    host = os.getenv("DB_HOST", "localhost")
-    port = os.getenv("DB_PORT", "5432")
-    user = os.getenv("DB_USER", "user")
-    password = os.getenv("DB_PASSWORD", "password")
-    name = os.getenv("DB_NAME", "ai_learning_db")
-    return f"postgresql://{user}:{password}@{host}:{port}/{name}"
+class SummarizeJobPayload(BaseModel):
+    session_id: str
+    # Политика роли агента (вкладка, history_limit и т.п.) — определяет ветку диалога
+    role_policy: Dict[str, Any] = {}
+    memory: str = "postgres"
+
+
+@timed_job
+def summarize_dialog_job(payload_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    // AICODE-NOTE: Фоновое обновление скользящего конспекта диалога (см. agents/memory/summarizing.py).
+    Ставится SummarizingMemory, когда несвёрнутый хвост ветки превысил порог; LLM‑вызов — только здесь.
+    """
+    payload = SummarizeJobPayload.model_validate(payload_dict)
+    container = _ensure_agents_loaded()
+    memory = SummarizingMemory(container.memory(payload.memory), llm=container.llm())
+    updated = _run_sync(memory.refresh_summary(payload.session_id, payload.role_policy))
+    return {"updated": bool(updated)}
+
+
+def _is_uuid(value: Any) -> bool:
+    try:
+        uuid.UUID(str(value))
+        return True
+    except ValueError:
+        return False
+
+
+def _insert_write_behind(conn, entries: List[Dict[str, Any]]) -> int:
+    """Вставить батч сообщений из очереди write‑behind; повтор того же `id` или ключа идемпотентности игнорируется."""
+    entries = [e for e in entries if isinstance(e, dict) and _is_uuid(e.get("session_id")) and _is_uuid(e.get("id"))]
+    if not entries:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT session_id::text, tab::text, id::text FROM chat_threads WHERE session_id = ANY(%s::uuid[])",
+            (sorted({e["session_id"] for e in entries}),),
+        )
+        threads = {(session_id, tab): thread_id for session_id, tab, thread_id in cur.fetchall()}
+        rows = [
+            (
+                e["id"],
+                threads[(e["session_id"], e.get("tab", "chat"))],
+                e["role"],
+                e["content"],
+                json.dumps(e.get("meta") or {}),
+                e["ts"],
+                e.get("idempotency_key"),
+            )
+            for e in entries
+            if (e["session_id"], e.get("tab", "chat")) in threads  # сессии без ветки (dev) — как в PostgresMemory, пропускаем
+        ]
+        if rows:
+            execute_values(
+                cur,
+                # Без цели конфликта: повтор по id (сброс) и по ключу идемпотентности (повтор хода) — no-op
+                "INSERT INTO chat_messages (id, thread_id, role, content, meta_json, created_at, idempotency_key) VALUES %s "
+                "ON CONFLICT DO NOTHING",
+                rows,
+                template="(%s::uuid, %s::uuid, %s::message_role, %s, %s::jsonb, to_timestamp(%s), %s)",
+                page_size=500,
+            )
+    return len(rows)
+
 
+# AICODE-NOTE: Лок сброса write-behind — только compare-and-act (Lua): воркер, чей лок истёк и достался другому,
+# не может ни продлить, ни снять чужой лок, ни обрезать очередь (LTRIM двумя воркерами теряет сообщения).
+_FLUSH_LOCK_TTL_MS = 120_000
+# KEYS[1]=лок, ARGV[1]=токен, ARGV[2]=TTL мс
+_LOCK_EXTEND_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end
+return 0
+"""
+# KEYS[1]=лок, ARGV[1]=токен
+_LOCK_RELEASE_LUA = """
+if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end
+return 0
+"""
+# KEYS[1]=лок, KEYS[2]=очередь, ARGV[1]=токен, ARGV[2]=сколько записей снять с головы
+_TRIM_IF_OWNER_LUA = """
+if redis.call('get', KEYS[1]) ~= ARGV[1] then return 0 end
+redis.call('ltrim', KEYS[2], ARGV[2], -1)
+return 1
+"""
 
+
+@timed_job
+def flush_memory_job(payload_dict: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """
+    // AICODE-NOTE: Сброс очереди write‑behind TieredMemory (`memory:writebehind`) в `chat_messages` батчами.
+    At‑least‑once: батч удаляется из очереди только после коммита; повтор безопасен (ON CONFLICT по id).
+    Лок продлевается после каждого батча; не удалось — лок уже чужой, сброс прекращается без LTRIM.
+    """
+    batch = int((payload_dict or {}).get("batch") or os.getenv("AGENTS_MEMORY_FLUSH_BATCH") or 500)
+    redis, _ = get_redis_and_queue()
+    extend_lock = redis.register_script(_LOCK_EXTEND_LUA)
+    release_lock = redis.register_script(_LOCK_RELEASE_LUA)
+    trim_if_owner = redis.register_script(_TRIM_IF_OWNER_LUA)
+
+    flushed = inserted = 0
+    while True:
+        # Один сбрасывающий на очередь: LTRIM после параллельного чтения потерял бы сообщения.
+        # Лок занят — выходим сразу (не занимая воркер): держатель дочитает очередь до конца.
+        token = uuid.uuid4().hex
+        if not redis.set(WRITE_BEHIND_LOCK, token, nx=True, px=_FLUSH_LOCK_TTL_MS):
+            return {"flushed": flushed, "inserted": inserted, "skipped": True}
+        # Флаг «сброс запланирован» снимаем под локом: всё, что придёт дальше, запланирует новый сброс
+        redis.delete(WRITE_BEHIND_SCHEDULED)
+        conn = psycopg2.connect(dsn=build_db_url_from_env())
+        try:
+            while True:
+                raw = redis.lrange(WRITE_BEHIND_QUEUE, 0, batch - 1)
+                if not raw:
+                    break
+                entries = []
+                for item in raw:
+                    try:
+                        entries.append(_load_entry(item))
+                    except Exception:
+                        pass  # битая запись не должна блокировать очередь
+                inserted += _insert_write_behind(conn, entries)
+                conn.commit()
+                # Вставленный, но не снятый батч дочитает новый владелец лока (повтор — no-op по ON CONFLICT)
+                if not trim_if_owner(keys=[WRITE_BEHIND_LOCK, WRITE_BEHIND_QUEUE], args=[token, len(raw)]):
+                    logger.warning("write-behind flush lost its lock; stopping after %d entries", flushed)
+                    return {"flushed": flushed, "inserted": inserted, "lost_lock": True}
+                flushed += len(raw)
+                if not extend_lock(keys=[WRITE_BEHIND_LOCK], args=[token, _FLUSH_LOCK_TTL_MS]):
+                    logger.warning("write-behind flush lost its lock; stopping after %d entries", flushed)
+                    return {"flushed": flushed, "inserted": inserted, "lost_lock": True}
+        finally:
+            try:
+                conn.close()
+            finally:
+                release_lock(keys=[WRITE_BEHIND_LOCK], args=[token])
+        # Сообщения, пришедшие между последним чтением и снятием лока: их сброс мог выйти по занятому локу
+        if not redis.llen(WRITE_BEHIND_QUEUE):
+            break
+    return {"flushed": flushed, "inserted": inserted}
@@ -0,0 +1,7 @@
+"""
+// AICODE-NOTE: Бенчмарки горячих путей (см. benchmarks/README.md).
+
+- `fake_llm.py` — локальная OpenAI‑совместимая заглушка с настраиваемой задержкой и скоростью токенов.
+- `load.py` — нагрузочный прогон маршрутов API (агенты, SSE, история, задачи RQ) с JSON‑отчётом.
+- `compare.py` — сравнение двух отчётов между релизами.
+"""
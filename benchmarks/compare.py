@@ -0,0 +1,59 @@
+"""
+// AICODE-NOTE: Сравнение двух отчётов benchmarks.load: изменение rps и перцентилей по сценариям.
+
+`python -m benchmarks.compare old.json new.json [--threshold 10]` — код возврата 1, если какой‑то сценарий
+деградировал сильнее порога (p95 вырос или rps упал больше чем на `threshold` %), — пригодно для CI.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from typing import Any, Dict, List, Optional
+
+
+def _delta(old: Optional[float], new: Optional[float]) -> Optional[float]:
+    if not old or new is None:
+        return None
+    return round((new - old) / old * 100, 1)
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "—" if value is None else f"{value:+.1f}%"
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float) -> tuple[List[str], bool]:
+    lines = [f"{'scenario':<16}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'errors':>10}"]
+    regressed = False
+    for name, cur in new.get("scenarios", {}).items():
+        base = old.get("scenarios", {}).get(name)
+        if base is None:
+            lines.append(f"{name:<16}{'new':>10}")
+            continue
+        rps = _delta(base.get("throughput_rps"), cur.get("throughput_rps"))
+        lat = {p: _delta(base["latency_ms"].get(p), cur["latency_ms"].get(p)) for p in ("p50", "p95", "p99")}
+        errors = f"{base.get('errors', 0)}→{cur.get('errors', 0)}"
+        lines.append(f"{name:<16}{_fmt(rps):>10}{_fmt(lat['p50']):>10}{_fmt(lat['p95']):>10}{_fmt(lat['p99']):>10}{errors:>10}")
+        if (lat["p95"] is not None and lat["p95"] > threshold) or (rps is not None and rps < -threshold):
+            regressed = True
+    return lines, regressed
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed p95/rps regression, %%")
+    args = parser.parse_args(argv)
+    with open(args.old, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old['meta'].get('commit')} → {new['meta'].get('commit')}")
+    lines, regressed = compare(old, new, args.threshold)
+    print("\n".join(lines))
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,165 @@
+"""
+// AICODE-NOTE: Локальная заглушка OpenAI‑совместимого API для бенчмарков (без сети и затрат на токены).
+
+- `POST /v1/chat/completions`: обычный ответ, стрим (SSE‑чанки по токену, последний — с `usage`) и structured output —
+  для `response_format={"type": "json_schema", ...}` отдаётся минимальный валидный по схеме JSON
+  (`SynopsisLLMSchema`, `PlanSO` и любые другие схемы агентов без настройки).
+- Профиль задержки: `latency_ms` — до первого токена, `tokens_per_sec` — скорость генерации, `reply_tokens` — длина
+  ответа. Нестриминговый ответ отдаётся целиком через `latency + reply_tokens / tokens_per_sec`.
+- Запуск: `python -m benchmarks.fake_llm --port 8765 --latency-ms 200 --tokens-per-sec 50`; в API/воркере —
+  `OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=bench`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List
+
+from fastapi import FastAPI, Request
+from starlette.responses import JSONResponse, StreamingResponse
+
+
+_WORDS = ("Хороший", "вопрос.", "Разберём", "его", "по", "шагам", "на", "простом", "примере", "из", "практики.")
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name) or default)
+    except ValueError:
+        return default
+
+
+def sample_from_schema(schema: Dict[str, Any], defs: Dict[str, Any] | None = None) -> Any:
+    """Минимальный экземпляр JSON‑схемы: все required‑поля, по одному элементу в массивах, первый вариант enum."""
+    defs = defs if defs is not None else schema.get("$defs", schema.get("definitions", {}))
+    if "$ref" in schema:
+        return sample_from_schema(defs[schema["$ref"].rsplit("/", 1)[-1]], defs)
+    for key in ("anyOf", "oneOf", "allOf"):
+        if schema.get(key):
+            variants = [v for v in schema[key] if v.get("type") != "null"] or schema[key]
+            return sample_from_schema(variants[0], defs)
+    if "const" in schema:
+        return schema["const"]
+    if schema.get("enum"):
+        return schema["enum"][0]
+    if "default" in schema and schema["default"] is not None:
+        return schema["default"]
+    kind = schema.get("type", "object")
+    if isinstance(kind, list):
+        kind = next((k for k in kind if k != "null"), "null")
+    if kind == "object":
+        props = schema.get("properties", {})
+        required = schema.get("required", list(props))
+        return {name: sample_from_schema(props[name], defs) for name in required if name in props}
+    if kind == "array":
+        count = max(int(schema.get("minItems", 1)), 1)
+        return [sample_from_schema(schema.get("items", {"type": "string"}), defs) for _ in range(count)]
+    if kind == "string":
+        return " ".join(_WORDS[:4])
+    if kind == "integer":
+        return int(schema.get("minimum", 1))
+    if kind == "number":
+        return float(schema.get("minimum", 1.0))
+    if kind == "boolean":
+        return True
+    return None
+
+
+def _prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    # Грубая оценка (≈4 символа на токен) — для правдоподобного usage, точный токенайзер здесь не нужен
+    return max(sum(len(str(m.get("content", ""))) for m in messages) // 4, 1)
+
+
+def create_app(*, latency_ms: float, tokens_per_sec: float, reply_tokens: int) -> FastAPI:
+    app = FastAPI(title="fake-openai")
+    token_delay = 1.0 / tokens_per_sec if tokens_per_sec > 0 else 0.0
+    stats = {"requests": 0, "streams": 0, "structured": 0}
+
+    def reply_text(body: Dict[str, Any]) -> tuple[List[str], bool]:
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            schema = (response_format.get("json_schema") or {}).get("schema") or {}
+            return [json.dumps(sample_from_schema(schema), ensure_ascii=False)], True
+        if response_format.get("type") == "json_object":
+            return ["{}"], True
+        return [_WORDS[i % len(_WORDS)] + " " for i in range(reply_tokens)], False
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request) -> Any:
+        body = await request.json()
+        stats["requests"] += 1
+        model = body.get("model") or "fake"
+        pieces, structured = reply_text(body)
+        stats["structured"] += int(structured)
+        usage = {
+            "prompt_tokens": _prompt_tokens(body.get("messages") or []),
+            "completion_tokens": len(pieces),
+            "total_tokens": 0,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        created = int(time.time())
+
+        if body.get("stream"):
+            stats["streams"] += 1
+
+            async def stream() -> AsyncIterator[str]:
+                await asyncio.sleep(latency_ms / 1000)
+                for i, piece in enumerate(pieces):
+                    if i and token_delay:
+                        await asyncio.sleep(token_delay)
+                    chunk = {
+                        "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                    }
+                    yield "data: " + json.dumps(chunk, ensure_ascii=False) + "\n\n"
+                # include_usage: последний чанк без choices
+                tail = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": created, "model": model,
+                        "choices": [], "usage": usage}
+                yield "data: " + json.dumps(tail) + "\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(stream(), media_type="text/event-stream")
+
+        await asyncio.sleep(latency_ms / 1000 + token_delay * max(len(pieces) - 1, 0))
+        return JSONResponse({
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(pieces).strip()}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    @app.get("/v1/models")
+    async def models() -> Dict[str, Any]:
+        return {"object": "list", "data": [{"id": "fake", "object": "model", "owned_by": "bench"}]}
+
+    @app.get("/stats")
+    async def get_stats() -> Dict[str, Any]:
+        return {**stats, "latency_ms": latency_ms, "tokens_per_sec": tokens_per_sec, "reply_tokens": reply_tokens}
+
+    return app
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("BENCH_LLM_PORT", "8765")))
+    parser.add_argument("--latency-ms", type=float, default=_env_float("BENCH_LLM_LATENCY_MS", 200))
+    parser.add_argument("--tokens-per-sec", type=float, default=_env_float("BENCH_LLM_TOKENS_PER_SEC", 50))
+    parser.add_argument("--reply-tokens", type=int, default=int(_env_float("BENCH_LLM_REPLY_TOKENS", 40)))
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    app = create_app(latency_ms=args.latency_ms, tokens_per_sec=args.tokens_per_sec, reply_tokens=args.reply_tokens)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
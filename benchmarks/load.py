@@ -0,0 +1,320 @@
+"""
+// AICODE-NOTE: Нагрузочный прогон горячих маршрутов API с JSON‑отчётом (см. benchmarks/README.md).
+
+- Сценарии: `mentor_reply` (JSON‑агент), `planner`, `synopsis` (structured output), `sse` (стрим токенов:
+  время до первого `token` и до `final_result`), `messages_list`/`messages_post` (история чата),
+  `job` (RQ: постановка в очередь + опрос `GET /jobs/{id}` до завершения — нужен запущенный воркер).
+- Каждый сценарий гоняется `--concurrency` корутинами до `--requests` запросов или `--duration` секунд;
+  у каждой корутины своя сессия (как у реальных пользователей), `--session-id` — одна общая на всех.
+- Отчёт: на сценарий — число запросов/ошибок, пропускная способность (rps), латентность p50/p95/p99/mean/max (мс),
+  для `sse` — то же по времени до первого токена. Метаданные — commit, параметры прогона, время.
+- Сравнение двух отчётов — `python -m benchmarks.compare old.json new.json`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import dataclass, field, replace
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+
+@dataclass
+class Sample:
+    latency_ms: float
+    ok: bool
+    # Доп. метрики запроса (например, first_token_ms у SSE)
+    extra: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+@dataclass
+class Ctx:
+    client: httpx.AsyncClient
+    session_id: str
+    no_cache: bool
+    job_timeout: float
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Перцентиль методом ближайшего ранга (значения уже отсортированы)."""
+    if not values:
+        return 0.0
+    rank = max(math.ceil(p / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "mean": round(sum(values) / len(values), 3),
+        "max": round(values[-1], 3),
+    }
+
+
+# ----------------------------------------------------------------------------
+# Сценарии: один запрос → Sample
+# ----------------------------------------------------------------------------
+
+
+def _message(i: int) -> str:
+    # Уникальный текст — чтобы кэши ответов не подменяли замер (если не выключены через --no-cache)
+    return f"Объясни тему на примере #{i} ({uuid.uuid4().hex[:8]})"
+
+
+def _headers(ctx: Ctx) -> Dict[str, str]:
+    return {"Cache-Control": "no-cache"} if ctx.no_cache else {}
+
+
+async def _timed(call: Callable[[], Awaitable[httpx.Response]]) -> Sample:
+    started = time.perf_counter()
+    try:
+        resp = await call()
+    except httpx.HTTPError as e:
+        return Sample((time.perf_counter() - started) * 1000, False, error=type(e).__name__)
+    ms = (time.perf_counter() - started) * 1000
+    ok = resp.status_code < 400
+    return Sample(ms, ok, error=None if ok else f"HTTP {resp.status_code}")
+
+
+async def scenario_mentor_reply(ctx: Ctx, i: int) -> Sample:
+    body = {"session_id": ctx.session_id, "user_message": _message(i), "memory": "postgres"}
+    return await _timed(lambda: ctx.client.post("/agents/mentor_chat/v1/reply", json=body, headers=_headers(ctx)))
+
+
+async def scenario_planner(ctx: Ctx, i: int) -> Sample:
+    body = {"session_id": ctx.session_id, "query": {"title": f"Трек {i}", "description": _message(i), "goal": "понять основы"}}
+    return await _timed(lambda: ctx.client.post("/agents/learning_planner/v1/plan", json=body, headers=_headers(ctx)))
+
+
+async def scenario_synopsis(ctx: Ctx, i: int) -> Sample:
+    body = {
+        "session_id": ctx.session_id,
+        "query": {"action": "create", "params": {"title": f"Конспект {i}", "description": _message(i), "goal": "c"}, "plan": ["x"]},
+    }
+    return await _timed(lambda: ctx.client.post("/agents/synopsis_manager/v1/synopsis", json=body, headers=_headers(ctx)))
+
+
+async def scenario_sse(ctx: Ctx, i: int) -> Sample:
+    body = {"session_id": ctx.session_id, "user_message": _message(i)}
+    started = time.perf_counter()
+    first_token: Optional[float] = None
+    final = False
+    try:
+        async with ctx.client.stream(
+            "POST", "/run/agent/mentor_chat/v1", params={"memory": "postgres"}, json=body, headers=_headers(ctx)
+        ) as resp:
+            if resp.status_code >= 400:
+                return Sample((time.perf_counter() - started) * 1000, False, error=f"HTTP {resp.status_code}")
+            async for line in resp.aiter_lines():
+                if line == "event: token" and first_token is None:
+                    first_token = (time.perf_counter() - started) * 1000
+                elif line == "event: final_result":
+                    final = True
+                elif line == "event: error":
+                    return Sample((time.perf_counter() - started) * 1000, False, error="event: error")
+    except httpx.HTTPError as e:
+        return Sample((time.perf_counter() - started) * 1000, False, error=type(e).__name__)
+    extra = {"first_token_ms": first_token} if first_token is not None else {}
+    return Sample((time.perf_counter() - started) * 1000, final, extra=extra, error=None if final else "no final_result")
+
+
+async def scenario_messages_list(ctx: Ctx, i: int) -> Sample:
+    return await _timed(lambda: ctx.client.get(f"/sessions/{ctx.session_id}/messages/chat", params={"tail": 50}))
+
+
+async def scenario_messages_post(ctx: Ctx, i: int) -> Sample:
+    body = {"role": "user", "content": _message(i)}
+    return await _timed(lambda: ctx.client.post(f"/sessions/{ctx.session_id}/messages/chat", json=body))
+
+
+async def scenario_job(ctx: Ctx, i: int) -> Sample:
+    body = {"session_id": ctx.session_id, "query": {"title": f"Трек {i}", "description": _message(i), "goal": "понять основы"}}
+    started = time.perf_counter()
+    try:
+        resp = await ctx.client.post("/jobs/agents/learning_planner/v1", json=body)
+        if resp.status_code >= 400:
+            return Sample((time.perf_counter() - started) * 1000, False, error=f"HTTP {resp.status_code}")
+        job_id = resp.json()["jobId"]
+        deadline = started + ctx.job_timeout
+        delay = 0.02
+        while time.perf_counter() < deadline:
+            status = (await ctx.client.get(f"/jobs/{job_id}")).json().get("status")
+            if status == "finished":
+                return Sample((time.perf_counter() - started) * 1000, True)
+            if status == "failed":
+                return Sample((time.perf_counter() - started) * 1000, False, error="job failed")
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, 0.25)
+    except httpx.HTTPError as e:
+        return Sample((time.perf_counter() - started) * 1000, False, error=type(e).__name__)
+    return Sample((time.perf_counter() - started) * 1000, False, error="job timeout")
+
+
+SCENARIOS: Dict[str, Callable[[Ctx, int], Awaitable[Sample]]] = {
+    "mentor_reply": scenario_mentor_reply,
+    "planner": scenario_planner,
+    "synopsis": scenario_synopsis,
+    "sse": scenario_sse,
+    "messages_list": scenario_messages_list,
+    "messages_post": scenario_messages_post,
+    "job": scenario_job,
+}
+
+DEFAULT_SCENARIOS = ["messages_list", "messages_post", "mentor_reply", "sse", "synopsis"]
+
+
+# ----------------------------------------------------------------------------
+# Прогон
+# ----------------------------------------------------------------------------
+
+
+async def run_scenario(
+    name: str, ctx: Ctx, sessions: List[str], *, concurrency: int, requests: int, duration: float, warmup: int
+) -> Dict[str, Any]:
+    fn = SCENARIOS[name]
+    for i in range(warmup):
+        await fn(replace(ctx, session_id=sessions[i % len(sessions)]), -1 - i)
+
+    samples: List[Sample] = []
+    counter = iter(range(10**9))
+    deadline = time.perf_counter() + duration if duration > 0 else None
+
+    async def worker(wctx: Ctx) -> None:
+        while True:
+            i = next(counter)
+            if requests > 0 and i >= requests:
+                return
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            samples.append(await fn(wctx, i))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(replace(ctx, session_id=sessions[w % len(sessions)])) for w in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ok = [s for s in samples if s.ok]
+    errors: Dict[str, int] = {}
+    for s in samples:
+        if not s.ok:
+            errors[s.error or "error"] = errors.get(s.error or "error", 0) + 1
+    result: Dict[str, Any] = {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "error_kinds": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed > 0 else 0.0,
+        "latency_ms": summarize([s.latency_ms for s in ok]),
+    }
+    extra_keys = {k for s in ok for k in s.extra}
+    for key in sorted(extra_keys):
+        result[key] = summarize([s.extra[key] for s in ok if key in s.extra])
+    return result
+
+
+async def _prepare_session(client: httpx.AsyncClient, track_slug: Optional[str]) -> str:
+    """Сессия трека для сценариев (история, диалоговые агенты пишут в chat_messages)."""
+    if track_slug is None:
+        tracks = (await client.get("/tracks")).raise_for_status().json()
+        if not tracks:
+            raise SystemExit("no tracks in the database: run `make db-seed` or pass --session-id")
+        track_slug = tracks[0]["slug"]
+    resp = await client.post("/sessions", json={"deviceId": f"bench-{uuid.uuid4().hex[:8]}", "trackSlug": track_slug})
+    return resp.raise_for_status().json()["sessionId"]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        if args.session_id:
+            sessions = [args.session_id]
+        else:
+            sessions = [await _prepare_session(client, args.track) for _ in range(args.concurrency)]
+        ctx = Ctx(client=client, session_id=sessions[0], no_cache=args.no_cache, job_timeout=args.timeout)
+        results: Dict[str, Any] = {}
+        for name in args.scenarios:
+            print(f"[bench] {name}: concurrency={args.concurrency}", file=sys.stderr)
+            results[name] = await run_scenario(
+                name, ctx, sessions, concurrency=args.concurrency, requests=args.requests, duration=args.duration, warmup=args.warmup
+            )
+            lat = results[name]["latency_ms"]
+            print(
+                f"[bench] {name}: {results[name]['throughput_rps']} rps, p50={lat.get('p50')} p95={lat.get('p95')} "
+                f"p99={lat.get('p99')} ms, errors={results[name]['errors']}",
+                file=sys.stderr,
+            )
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "duration_s": args.duration,
+            "no_cache": args.no_cache,
+            "python": platform.python_version(),
+            "label": args.label,
+        },
+        "scenarios": results,
+    }
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test for the API hot paths")
+    parser.add_argument("--base-url", default=os.getenv("BENCH_API_URL", "http://127.0.0.1:8000"))
+    parser.add_argument("--scenarios", default=",".join(DEFAULT_SCENARIOS), help=f"comma-separated: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario (0 — until --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="seconds per scenario (0 — until --requests)")
+    parser.add_argument("--warmup", type=int, default=3, help="sequential warm-up requests per scenario")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--no-cache", action="store_true", help="send Cache-Control: no-cache (bypass LLM caches)")
+    parser.add_argument("--session-id", help="existing session id (default: create one)")
+    parser.add_argument("--track", help="track slug for the new session (default: first track)")
+    parser.add_argument("--label", default="", help="free-form label stored in the report")
+    parser.add_argument("--out", help="write the JSON report to this file (default: stdout)")
+    args = parser.parse_args(argv)
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    if args.requests <= 0 and args.duration <= 0:
+        parser.error("set --requests or --duration")
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"[bench] report written to {args.out}", file=sys.stderr)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
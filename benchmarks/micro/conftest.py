@@ -0,0 +1,84 @@
+"""
+// AICODE-NOTE: Общие фикстуры микробенчмарков: агенты/промпты из реестра, LLM без задержки, InMemoryMemory, loop.
+
+Запуск: `pip install -r benchmarks/requirements.txt && python -m pytest benchmarks/micro --benchmark-only`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, Optional, Sequence
+
+import pytest
+
+pytest.importorskip("pytest_benchmark", reason="pytest-benchmark is not installed (benchmarks/requirements.txt)")
+
+from agents import autodiscover, autodiscover_prompts  # noqa: E402
+from agents.llm.base import LLMClientBase, LLMMessage, LLMResponse  # noqa: E402
+from agents.memory import InMemoryMemory  # noqa: E402
+
+
+class ZeroLatencyLLM(LLMClientBase):
+    """LLM без сети и задержки: фиксированный текст (стрим — по словам) и заранее заданный structured‑ответ."""
+
+    def __init__(self, *, reply_tokens: int = 40, structured: Optional[Dict[str, Any]] = None) -> None:
+        super().__init__(default_model="bench")
+        self.pieces = [f"слово{i} " for i in range(reply_tokens)]
+        self.structured = structured or {}
+
+    def _create_client(self, **client_kwargs: Any) -> Any:
+        return None
+
+    async def chat(self, messages: Sequence[LLMMessage], *, model: Optional[str] = None, temperature: float | None = None) -> LLMResponse:
+        return LLMResponse(result="".join(self.pieces), client_response=None)
+
+    async def chat_stream(
+        self, messages: Sequence[LLMMessage], *, model: Optional[str] = None, temperature: float | None = None
+    ) -> AsyncIterator[str]:
+        for piece in self.pieces:
+            yield piece
+
+    async def structured_output(self, messages: Sequence[LLMMessage], *, schema: Any, model: Optional[str] = None, temperature: float | None = None):
+        return self.structured, LLMResponse(result=json.dumps(self.structured), client_response=None)
+
+    async def chat_with_tools(self, messages, tools, *, model=None, temperature=None, max_steps=3) -> LLMResponse:
+        return await self.chat(messages)
+
+    async def vision_analyze(self, *, prompt: str, image_url=None, image_base64=None, model=None, temperature=None) -> LLMResponse:
+        return LLMResponse(result="", client_response=None)
+
+
+def history(n: int) -> list[dict]:
+    """Диалог из `n` сообщений, чередование user/assistant, ~200 символов каждое."""
+    text = "Объясни, как работает индекс в базе данных и когда он замедляет запись. " * 3
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"{i}: {text}", **({"name": "chat_reply"} if i % 2 else {})}
+        for i in range(n)
+    ]
+
+
+@pytest.fixture(scope="session", autouse=True)
+def registry() -> None:
+    autodiscover()
+    autodiscover_prompts()
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def memory(loop) -> InMemoryMemory:
+    """InMemoryMemory с историей из 50 сообщений в сессии `bench`."""
+    mem = InMemoryMemory()
+    loop.run_until_complete(mem.append("bench", history(50)))
+    return mem
+
+
+@pytest.fixture
+def llm() -> ZeroLatencyLLM:
+    return ZeroLatencyLLM()
@@ -0,0 +1,99 @@
+"""
+// AICODE-NOTE: Микробенчмарки CPU‑стоимости хода агента без сети: сборка промпта, события, генератор агента,
+промпты, валидация структурированного ответа. Сравнение с прошлым прогоном — `--benchmark-compare`.
+"""
+
+from __future__ import annotations
+
+from agents.base import Event
+from agents.registry import get_agent, get_prompt
+from agents.roles.policy import DialogueBuilder, to_openai_chat_messages
+from agents.runner import run_agent_with_events
+from agents.under_hood.synopsis_manager.so_schema import SynopsisLLMSchema
+
+from .conftest import history
+
+
+ROLE_POLICY = {"tab": "chat", "history_limit": 50, "retrieval_k": 0}
+SYSTEM = "Ты — наставник курса. Отвечай кратко и по делу."
+
+
+def test_dialogue_builder_build(benchmark, loop, memory):
+    async def build():
+        return await DialogueBuilder.build(
+            memory, "bench", ROLE_POLICY, "chat_reply",
+            system_text=SYSTEM, developer_text="Что такое индекс?", model="gpt-4o-mini",
+        )
+
+    dialog = benchmark(lambda: loop.run_until_complete(build()))
+    assert dialog[0]["role"] == "system" and dialog[-1]["content"] == "Что такое индекс?"
+
+
+def test_to_openai_chat_messages(benchmark):
+    dialog = [{"role": "system", "content": SYSTEM}, *history(50), {"role": "developer", "content": "Что такое индекс?"}]
+    messages = benchmark(to_openai_chat_messages, dialog)
+    assert len(messages) == 52
+
+
+def test_event_create_and_dump(benchmark):
+    def create_and_dump():
+        return Event(event="token", session_id="bench", trace_id="t", payload={"delta": "слово "}).model_dump()
+
+    assert benchmark(create_and_dump)["payload"] == {"delta": "слово "}
+
+
+def test_event_sse_frame(benchmark):
+    """Создание `token` и его SSE‑кадр — то, что SSE‑маршрут делает на каждую дельту."""
+    def create_and_encode():
+        return Event(event="token", session_id="bench", trace_id="t", payload={"delta": "слово "}).sse()
+
+    assert benchmark(create_and_encode).startswith(b"event: token\n")
+
+
+def test_agent_run_with_events(benchmark, loop, memory, llm):
+    """Генератор `AgentABC.run_with_events` (mentor_chat): промпт + 40 дельт `token` + final_result, без раннера."""
+    agent = get_agent("mentor_chat", "v1", memory=memory, role_policy=ROLE_POLICY, llm=llm)
+
+    async def run():
+        count = 0
+        async for _ in agent.run_with_events(session_id="bench", user_message="Что такое индекс?"):
+            count += 1
+        return count
+
+    assert benchmark(lambda: loop.run_until_complete(run())) == 43
+
+
+def test_runner_overhead(benchmark, loop, memory, llm):
+    """То же через `run_agent_with_events`: + трейс, контекст запуска, метрики, хуки."""
+    agent = get_agent("mentor_chat", "v1", memory=memory, role_policy=ROLE_POLICY, llm=llm)
+
+    async def run():
+        final = None
+        async for ev in run_agent_with_events(agent, session_id="bench", user_message="Что такое индекс?", persist=False):
+            if ev.event == "final_result":
+                final = ev.payload
+        return final
+
+    assert "metrics" in benchmark(lambda: loop.run_until_complete(run()))
+
+
+def test_get_prompt_format(benchmark):
+    def render():
+        return get_prompt("mentor_chat.developer").format(message="Что такое индекс?")
+
+    assert "Что такое индекс?" in benchmark(render)
+
+
+def test_synopsis_schema_validation(benchmark):
+    """`SynopsisLLMSchema` на большом конспекте (240 элементов всех типов)."""
+    kinds = [
+        {"type": "heading", "text": "Индексы"},
+        {"type": "text", "text": "B‑tree хранит ключи отсортированными, поиск — O(log n). " * 2},
+        {"type": "definition", "term": "Селективность", "description": "Доля строк, отбираемых условием."},
+        {"type": "list", "items": ["равенство", "диапазон", "сортировка", "покрывающий индекс"]},
+        {"type": "code", "language": "sql", "code": "CREATE INDEX ix_users_email ON users (email);"},
+        {"type": "note", "text": "Каждый индекс замедляет INSERT/UPDATE."},
+    ]
+    payload = {"items": kinds * 40, "lastUpdated": "2025-01-01 12:00"}
+    parsed = benchmark(SynopsisLLMSchema.model_validate, payload)
+    assert len(parsed.items) == 240
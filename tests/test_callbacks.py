@@ -0,0 +1,33 @@
+"""
+// AICODE-NOTE: CallbackManager: вызов, поставленный в очередь сразу после выхода воркера, не должен застревать.
+"""
+
+from __future__ import annotations
+
+import asyncio
+
+from agents.callbacks import CallbackManager
+
+
+def test_fire_right_after_worker_exit_is_dispatched():
+    cb = CallbackManager()
+    got: list[int] = []
+
+    async def fire_second() -> None:
+        cb.fire("after", "agent", n=2)
+
+    def handler(n: int) -> None:
+        got.append(n)
+        if n == 1:
+            # Задача стартует после того, как воркер опустошил очередь и вышел, но до его done-callback'а
+            asyncio.get_running_loop().create_task(fire_second())
+
+    async def main() -> None:
+        cb.register("after", "agent", handler)
+        cb.fire("after", "agent", n=1)
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert got == [1, 2]
+    assert cb.stats()["queue_depth"] == 0